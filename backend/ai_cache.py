@@ -0,0 +1,181 @@
+"""
+AI 分析結果快取 - 以提示輸入的正規化摘要（content-addressed）為 key
+
+提示完全由幣種、價格、指標快照、趨勢、支撐阻力、分析理由、建議與風險決定。
+數值先四捨五入到 AI_CACHE_SIG_DIGITS 位有效數字再計算摘要，價格的微小變動仍會命中；
+正規化只用於計算 key，送給模型的提示仍使用原始數值。
+key 代表的是單一幣種的正規化輸入，而不是送出的提示文字：同一個 key 的結果可能來自單幣提示，
+也可能是批次提示（多個幣種合併成一次呼叫）中拆出的該幣段落，兩者都視為同一份分析。
+
+兩層：記憶體 TTLCache（LRU + TTL），以及選用的 SQLite 磁碟層（AI_CACHE_PATH，重啟後仍可命中）。
+磁碟層在開啟時與每 AICache.PRUNE_EVERY 次寫入後刪除過期項目，並只保留最新的 disk_max_entries 筆。
+磁碟層的方法是同步的，在 async 程式中請以 asyncio.to_thread 呼叫。
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_NUMBER_IN_TEXT = re.compile(r"-?\d+\.\d+")
+
+
+def round_sig(x, digits: int):
+    """四捨五入到 digits 位有效數字（非有限值與 0 原樣回傳）"""
+    if not isinstance(x, float) or x == 0 or not math.isfinite(x):
+        return x
+    return float(f"{x:.{digits}g}")
+
+
+def format_sig(x: float, digits: int) -> str:
+    """四捨五入到 digits 位有效數字，以一般小數表示（不使用科學記號，例如 111733.8 -> "111700"）"""
+    x = round_sig(x, digits)
+    if x == 0:
+        return "0"
+    decimals = max(0, digits - 1 - math.floor(math.log10(abs(x))))
+    return f"{x:.{decimals}f}"
+
+
+def normalize(value, digits: int):
+    """遞迴正規化（只用於計算 key）：浮點數取有效數字，字串中的小數也一併取有效數字"""
+    if isinstance(value, float):
+        return round_sig(value, digits)
+    if isinstance(value, str):
+        return _NUMBER_IN_TEXT.sub(lambda m: format_sig(float(m.group()), digits), value)
+    if isinstance(value, dict):
+        return {k: normalize(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v, digits) for v in value]
+    return value
+
+
+def cache_key(namespace: str, context: dict) -> str:
+    """namespace（例如模型名稱）與已正規化的 context 的 SHA-256 摘要"""
+    payload = json.dumps([namespace, context], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_cache (
+    key        TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    text       TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ai_cache_expires_at ON ai_cache (expires_at);
+"""
+
+
+class AICache:
+    """
+    記憶體 + 選用磁碟兩層的 AI 文字快取
+
+    - get_memory：只查記憶體（微秒級，可直接在 event loop 中呼叫）
+    - get_disk：查磁碟層，命中時回填記憶體
+    - set：寫入記憶體與磁碟層（每 PRUNE_EVERY 次寫入清理一次磁碟層，筆數最多超出上限 PRUNE_EVERY - 1 筆）
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries: int, ttl: float, path: str = "", disk_max_entries: int = 10000):
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries, ttl, name="ai")
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_expired = 0
+        self.disk_evictions = 0
+        self._writes = 0
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self._conn is not None
+
+    def open(self) -> None:
+        """開啟磁碟層並清除過期/超量的項目（path 為空時不啟用）"""
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._prune(conn)
+        conn.commit()
+        self._conn = conn
+        logger.info(f"AI 快取磁碟層已開啟: {self.path}")
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        """刪除過期項目，並只保留到期時間最晚（最新寫入）的 disk_max_entries 筆"""
+        self.disk_expired += conn.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        self.disk_evictions += conn.execute(
+            "DELETE FROM ai_cache WHERE key NOT IN "
+            "(SELECT key FROM ai_cache ORDER BY expires_at DESC LIMIT ?)",
+            (self.disk_max_entries,),
+        ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_memory(self, key: str) -> Optional[str]:
+        return self.memory.get(key)
+
+    def get_disk(self, key: str) -> Optional[str]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, text FROM ai_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        expires_at, text = row
+        self.memory.set(key, text, expires_at=expires_at)
+        return text
+
+    def set(self, key: str, text: str) -> None:
+        expires_at = time.time() + self.ttl
+        self.memory.set(key, text, expires_at=expires_at)
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ai_cache VALUES (?, ?, ?)", (key, expires_at, text))
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(self._conn)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        disk = {"enabled": self.disk_enabled}
+        if self._conn is not None:
+            with self._lock:
+                (count,) = self._conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()
+            total = self.disk_hits + self.disk_misses
+            disk.update({
+                "path": self.path,
+                "entries": count,
+                "max_entries": self.disk_max_entries,
+                "expired": self.disk_expired,
+                "evictions": self.disk_evictions,
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "hit_rate": round(self.disk_hits / total, 4) if total else 0.0,
+            })
+        return {**self.memory.stats(), "ttl": self.ttl, "disk": disk}
@@ -0,0 +1,172 @@
+"""
+AI 分析背景工作佇列 - /analyze 先回傳技術分析，AI 文字在背景產生後以 job_id 查詢
+
+工作放入有上限的 asyncio.PriorityQueue，由 AI_JOB_WORKERS 個 worker 依優先順序處理（實際的 Gemini 呼叫
+仍經過 ai_service 的執行緒池與 ai_scheduler 的配額排程）。每個幣種的結果一出來就可查詢；完成的工作保留 AI_JOB_TTL 秒後過期。
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import ai_service
+from ai_scheduler import PRIORITY_NAMES, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+AI_JOB_WORKERS = max(1, int(os.getenv("AI_JOB_WORKERS", "2")))
+AI_JOB_QUEUE_MAX = max(1, int(os.getenv("AI_JOB_QUEUE_MAX", "100")))
+AI_JOB_TTL = float(os.getenv("AI_JOB_TTL", "600"))
+# 記憶體中保留的工作數上限（超過時淘汰最舊的已完成工作；排隊與執行中的工作不淘汰）
+AI_JOB_MAX_JOBS = max(1, int(os.getenv("AI_JOB_MAX_JOBS", "1000")))
+
+
+class QueueFullError(Exception):
+    """背景佇列已滿，無法再接受新的 AI 工作"""
+
+
+class AIJob:
+    """一次 /analyze 請求的 AI 工作：多個幣種，各自有狀態與結果"""
+
+    def __init__(self, model, items: list, priority: int = PRIORITY_NORMAL):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.items = items
+        self.priority = priority
+        self.status = "pending"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at = self.created_at + AI_JOB_TTL
+        self.results: dict = {coin: {"status": "pending", "ai_analysis": None} for coin, _ in items}
+
+    def set_result(self, index: int, text: Optional[str]) -> None:
+        coin = self.items[index][0]
+        self.results[coin] = {"status": "done", "ai_analysis": text}
+
+    def to_dict(self, coin: Optional[str] = None) -> dict:
+        out = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+        }
+        if coin is None:
+            out["results"] = self.results
+        else:
+            out.update({"coin": coin, **self.results[coin]})
+        return out
+
+
+_jobs: "OrderedDict[str, AIJob]" = OrderedDict()
+_queue: Optional[asyncio.PriorityQueue] = None
+# 同優先順序依排入順序處理
+_seq = itertools.count()
+_workers: list = []
+_counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0}
+
+
+def _purge() -> None:
+    now = time.time()
+    finished = [j.id for j in _jobs.values() if j.status in ("done", "failed")]
+    # 過期的，加上超過 AI_JOB_MAX_JOBS 時最舊的已完成工作（_jobs 依建立順序排列）
+    excess = max(0, len(_jobs) - AI_JOB_MAX_JOBS)
+    for i, job_id in enumerate(finished):
+        if i < excess or _jobs[job_id].expires_at <= now:
+            del _jobs[job_id]
+            _counters["expired"] += 1
+
+
+def submit(model, items: list, priority: int = PRIORITY_NORMAL) -> AIJob:
+    """
+    建立一個 AI 工作並排入佇列；items 為 [(coin, context), ...]（同 ai_service.generate_batch），
+    priority 為 ai_scheduler 的優先順序。佇列已滿時拋出 QueueFullError
+    """
+    if _queue is None:
+        raise QueueFullError("AI 工作佇列尚未啟動")
+    _purge()
+    job = AIJob(model, items, priority)
+    try:
+        _queue.put_nowait((priority, next(_seq), job))
+    except asyncio.QueueFull:
+        _counters["rejected"] += 1
+        raise QueueFullError(f"AI 工作佇列已滿（{AI_JOB_QUEUE_MAX}）")
+    _jobs[job.id] = job
+    _counters["submitted"] += 1
+    return job
+
+
+def get(job_id: str) -> Optional[AIJob]:
+    """取得未過期的工作，不存在或已過期時回傳 None"""
+    _purge()
+    return _jobs.get(job_id)
+
+
+async def _run_job(job: AIJob) -> None:
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        await ai_service.generate_batch(job.model, job.items, on_result=job.set_result, priority=job.priority)
+        job.status = "done"
+        _counters["completed"] += 1
+    except Exception as e:
+        logger.exception(f"AI job {job.id} failed")
+        for coin, result in job.results.items():
+            if result["status"] != "done":
+                job.results[coin] = {"status": "failed", "ai_analysis": ai_service.format_ai_error(e)}
+        job.status = "failed"
+        _counters["failed"] += 1
+    finally:
+        job.model = None
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + AI_JOB_TTL
+
+
+async def _worker() -> None:
+    while True:
+        _, _, job = await _queue.get()
+        try:
+            await _run_job(job)
+        finally:
+            _queue.task_done()
+
+
+async def startup() -> None:
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.PriorityQueue(maxsize=AI_JOB_QUEUE_MAX)
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(AI_JOB_WORKERS))
+
+
+async def shutdown() -> None:
+    global _queue
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
+
+
+def stats() -> dict:
+    by_status: dict = {}
+    by_priority = {name: 0 for name in PRIORITY_NAMES}
+    names = {value: name for name, value in PRIORITY_NAMES.items()}
+    for job in _jobs.values():
+        by_status[job.status] = by_status.get(job.status, 0) + 1
+        if job.status == "pending":
+            by_priority[names.get(job.priority, "normal")] += 1
+    return {
+        **_counters,
+        "workers": AI_JOB_WORKERS,
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "queue_max": AI_JOB_QUEUE_MAX,
+        "queue_by_priority": by_priority,
+        "jobs": by_status,
+        "ttl": AI_JOB_TTL,
+    }
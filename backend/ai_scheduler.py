@@ -0,0 +1,162 @@
+"""
+AI 請求排程器 - 依每個 API key 的配額（每分鐘請求數、每分鐘 token 數）排隊放行
+
+不再等 Gemini 回 429 才發現配額用完：每個請求先估算 token 數，在 rpm / tpm 兩個 token bucket
+與並行上限都允許時才放行，否則排隊等待。佇列依優先順序放行（互動 > 一般 > 背景預取），
+壓力大時（佇列過長或預估等待過久）直接捨棄背景請求。
+收到 429 時可呼叫 penalize() 讓該 key 暫停一段時間，之後的請求繼續排隊而不是失敗。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Optional
+
+from rate_limit import TokenBucket
+
+# 優先順序（數字越小越優先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "normal": PRIORITY_NORMAL, "background": PRIORITY_BACKGROUND}
+
+# 背景請求的捨棄條件：佇列長度上限、預估等待秒數上限
+AI_SCHED_MAX_QUEUE = max(1, int(os.getenv("AI_SCHED_MAX_QUEUE", "50")))
+AI_SCHED_BACKGROUND_MAX_WAIT = float(os.getenv("AI_SCHED_BACKGROUND_MAX_WAIT", "10"))
+# 估算 token 數：提示字元數 / 4 + 預期輸出 token 數
+AI_EST_OUTPUT_TOKENS = int(os.getenv("AI_EST_OUTPUT_TOKENS", "800"))
+
+
+class Overloaded(Exception):
+    """排程器壓力過大，請求被捨棄"""
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt) // 4 + AI_EST_OUTPUT_TOKENS
+
+
+def priority_of(name, default: int = PRIORITY_NORMAL, highest: int = PRIORITY_INTERACTIVE) -> int:
+    """
+    把 "interactive" / "normal" / "background" 轉成優先順序數值
+
+    只接受這三個名稱（其他值，包括數字，一律視為 default）；結果不會高於 highest，
+    讓來自客戶端的值無法插隊到保留給同步請求的優先順序
+    """
+    if not isinstance(name, str):
+        return max(default, highest)
+    return max(PRIORITY_NAMES.get(name.strip().lower(), default), highest)
+
+
+class KeyScheduler:
+    """
+    單一 API key 的排程器
+
+    acquire(priority, tokens) 排隊直到 rpm / tpm / 並行上限都允許，依 (priority, 到達順序) 放行；
+    release() 歸還並行名額。等待中的呼叫被取消時自動移出佇列。
+    """
+
+    def __init__(self, rpm: float, tpm: float, max_concurrency: int):
+        self.rpm = TokenBucket.per_minute(rpm)
+        self.tpm = TokenBucket.per_minute(tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted = 0
+        self.shed = 0
+        self.penalties = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _pending(self) -> list:
+        return [item for item in self._heap if not item[2].done()]
+
+    def _delay(self, tokens: int) -> float:
+        """放行 tokens 個 token 的請求還需要等待的秒數"""
+        return max(self.paused_until - time.monotonic(), self.rpm.wait_time(1), self.tpm.wait_time(tokens), 0.0)
+
+    def estimated_wait(self, tokens: int) -> float:
+        """新請求的粗估等待秒數：目前的配額延遲 + 前面排隊者消耗 rpm 所需的時間"""
+        ahead = len(self._pending())
+        per_request = 1 / self.rpm.rate if self.rpm.rate > 0 else 0.0
+        return self._delay(tokens) + ahead * per_request
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, tokens: int = 0) -> float:
+        """取得放行，回傳等待秒數；背景請求在壓力過大時拋出 Overloaded"""
+        if priority >= PRIORITY_BACKGROUND:
+            if len(self._pending()) >= AI_SCHED_MAX_QUEUE or self.estimated_wait(tokens) > AI_SCHED_BACKGROUND_MAX_WAIT:
+                self.shed += 1
+                raise Overloaded("AI 請求量過高，背景請求已捨棄")
+        fut = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut, tokens))
+        self._pump()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已放行但呼叫端取消：歸還名額
+                self.release()
+            else:
+                fut.cancel()
+                self._pump()
+            raise
+        waited = time.monotonic() - enqueued
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._pump()
+
+    def penalize(self, seconds: float) -> None:
+        """收到 429 等配額錯誤時暫停放行 seconds 秒，並清空已累積的額度"""
+        self.penalties += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.rpm.drain()
+        self._pump()
+
+    def _pump(self) -> None:
+        """依優先順序放行目前允許的請求；需要等待配額時排定計時器再試"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap and self.in_flight < self.max_concurrency:
+            priority, _, fut, tokens = self._heap[0]
+            if fut.done():
+                heapq.heappop(self._heap)
+                continue
+            delay = self._delay(tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            heapq.heappop(self._heap)
+            self.rpm.try_take(1)
+            self.tpm.try_take(tokens)
+            self.in_flight += 1
+            self.granted += 1
+            fut.set_result(None)
+
+    def stats(self) -> dict:
+        pending = self._pending()
+        by_priority: dict = {}
+        for name, value in PRIORITY_NAMES.items():
+            by_priority[name] = sum(1 for item in pending if item[0] == value)
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": len(pending),
+            "queue_by_priority": by_priority,
+            "granted": self.granted,
+            "shed": self.shed,
+            "penalties": self.penalties,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "avg_wait": round(self.wait_total / self.granted, 3) if self.granted else 0.0,
+            "max_wait": round(self.wait_max, 3),
+            # 不限制時為 None（JSON 無法表示無限大）
+            "rpm_available": round(self.rpm.available, 2) if self.rpm.rate > 0 else None,
+            "tpm_available": round(self.tpm.available) if self.tpm.rate > 0 else None,
+        }
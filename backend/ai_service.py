@@ -0,0 +1,597 @@
+"""
+AI 深度分析服務 - 在專用執行緒池中呼叫 Gemini，不阻塞 event loop
+
+google-generativeai 的 generate_content 是同步呼叫（數秒），直接在 async handler 中呼叫會卡住
+整個 uvicorn event loop。這裡以有上限的 ThreadPoolExecutor 執行，並以 semaphore 限制同時
+進行的呼叫數、以 AI_CALL_TIMEOUT 限制單次呼叫的時間。
+model 為 gemini_pool.KeyedModel：每個 API key 的 rpm / tpm 配額由 ai_scheduler 排隊放行，
+呼叫帶有優先順序（互動 > 一般 > 背景），排隊超過 AI_QUEUE_TIMEOUT 秒或背景請求被捨棄時回傳忙碌訊息；
+收到 429 時暫停該 key 並重試一次。
+結果依提示輸入的正規化摘要快取（見 ai_cache），相同輸入的並行呼叫只送出一次。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional
+
+from ai_cache import AICache, cache_key, normalize
+from ai_scheduler import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, Overloaded, estimate_tokens
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 執行 Gemini 呼叫的執行緒數、同時進行的呼叫上限、單次呼叫逾時秒數（含等待）
+AI_MAX_WORKERS = max(1, int(os.getenv("AI_MAX_WORKERS", "4")))
+AI_MAX_CONCURRENCY = max(1, int(os.getenv("AI_MAX_CONCURRENCY", str(AI_MAX_WORKERS))))
+AI_CALL_TIMEOUT = float(os.getenv("AI_CALL_TIMEOUT", "30"))
+# 在 key 的配額佇列中最多等待的秒數；收到 429 且錯誤中沒有建議等待時間時，該 key 暫停的秒數
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "120"))
+AI_QUOTA_BACKOFF = float(os.getenv("AI_QUOTA_BACKOFF", "30"))
+
+# AI 結果快取：記憶體筆數上限、存活秒數、數值正規化的有效位數；
+# AI_CACHE_PATH 設定時啟用 SQLite 磁碟層（重啟後仍可命中）
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "900"))
+AI_CACHE_SIG_DIGITS = max(1, int(os.getenv("AI_CACHE_SIG_DIGITS", "4")))
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "").strip()
+AI_CACHE_DISK_MAX_ENTRIES = int(os.getenv("AI_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+# 一次 Gemini 請求最多合併幾個幣種（1 代表不合併，每個幣種各自呼叫）
+AI_BATCH_SIZE = max(1, int(os.getenv("AI_BATCH_SIZE", "5")))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_sem: Optional[asyncio.Semaphore] = None
+_counters = {
+    "calls": 0, "completed": 0, "failed": 0, "timeouts": 0, "waiting": 0, "running": 0,
+    "batch_calls": 0, "batch_coins": 0, "batch_fallbacks": 0,
+    "streams": 0, "streams_cancelled": 0,
+    "shed": 0, "queue_timeouts": 0, "quota_retries": 0,
+}
+_latency = {"total": 0.0, "max": 0.0}
+# running 由 worker 執行緒更新
+_running_lock = threading.Lock()
+_cache = AICache(AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, AI_CACHE_PATH, AI_CACHE_DISK_MAX_ENTRIES)
+_flight = SingleFlight("ai")
+_RETRY_IN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+
+
+def build_prompt(
+    last_price: float,
+    indicators: dict,
+    trend: str,
+    support_resistance: dict,
+    rationale: list[str],
+    action: str,
+    risk: str,
+) -> str:
+    """組出給 Gemini 的分析提示"""
+    return f"""You are a professional crypto analyst. Provide investment advice based on:
+
+MARKET DATA:
+- Current Price: ${last_price:.2f}
+- Trend: {trend}
+- Risk Preference: {risk} (low=conservative, medium=neutral, high=aggressive)
+
+TECHNICAL INDICATORS:
+- RSI(14): {indicators.get('rsi14', 'N/A')}
+- MACD: {indicators.get('macd', 'N/A')}
+- Signal: {indicators.get('signal', 'N/A')}
+- ATR: {indicators.get('atr', 'N/A')}
+- Volatility: {indicators.get('volatility_pct', 'N/A')}%
+- MA(7): {indicators.get('ma7', 'N/A')}
+- MA(25): {indicators.get('ma25', 'N/A')}
+
+SUPPORT & RESISTANCE:
+- Support: {support_resistance.get('support', [])}
+- Resistance: {support_resistance.get('resistance', [])}
+
+TECHNICAL ASSESSMENT:
+{'; '.join(rationale)}
+
+RECOMMENDATION:
+{action}
+
+Please provide concise, practical advice (5 points):
+1. Market analysis (2-3 sentences): Current state and key signals
+2. Entry strategy: Suggested entry prices and batch allocation based on risk preference
+3. Risk management: Suggested stop-loss and profit targets
+4. Risk warnings: Main current risk factors
+5. Follow-up points: Key levels or indicator changes to monitor
+
+Be concise and actionable. Answer in Traditional Chinese."""
+
+
+def build_batch_prompt(items: list) -> str:
+    """
+    多幣種合併提示：items 為 [(coin, context), ...]，context 為 build_prompt 的參數；
+    要求以 JSON 物件回傳，key 為幣種，value 為該幣種的分析文字
+    """
+    sections = []
+    for coin, ctx in items:
+        ind = ctx["indicators"]
+        sr = ctx["support_resistance"]
+        sections.append(f"""### {coin}
+- Current Price: ${ctx['last_price']:.2f}
+- Trend: {ctx['trend']}
+- RSI(14): {ind.get('rsi14', 'N/A')}, MACD: {ind.get('macd', 'N/A')}, Signal: {ind.get('signal', 'N/A')}
+- ATR: {ind.get('atr', 'N/A')}, Volatility: {ind.get('volatility_pct', 'N/A')}%
+- MA(7): {ind.get('ma7', 'N/A')}, MA(25): {ind.get('ma25', 'N/A')}
+- Support: {sr.get('support', [])}, Resistance: {sr.get('resistance', [])}
+- Technical assessment: {'; '.join(ctx['rationale'])}
+- Recommendation: {ctx['action']}
+- Risk Preference: {ctx['risk']} (low=conservative, medium=neutral, high=aggressive)""")
+    coins = ", ".join(f'"{coin}"' for coin, _ in items)
+    return f"""You are a professional crypto analyst. Provide investment advice for each coin below.
+
+{chr(10).join(sections)}
+
+For EACH coin, provide concise, practical advice (5 points):
+1. Market analysis (2-3 sentences): Current state and key signals
+2. Entry strategy: Suggested entry prices and batch allocation based on risk preference
+3. Risk management: Suggested stop-loss and profit targets
+4. Risk warnings: Main current risk factors
+5. Follow-up points: Key levels or indicator changes to monitor
+
+Be concise and actionable. Answer in Traditional Chinese.
+Respond with ONLY a JSON object (no markdown) whose keys are exactly {coins} and whose values are the advice text for that coin as a single string."""
+
+
+def parse_batch_response(text: str, coins: list) -> dict:
+    """解析合併請求的 JSON 回應，回傳 {coin: 文字}；無法解析時拋出 ValueError，缺少的幣種不列入"""
+    body = text.strip()
+    if body.startswith("```"):
+        # 去掉 ```json ... ``` 外框
+        body = body.split("\n", 1)[1] if "\n" in body else ""
+        body = body.rsplit("```", 1)[0]
+    start, end = body.find("{"), body.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("回應中沒有 JSON 物件")
+    data = json.loads(body[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("回應不是 JSON 物件")
+    out = {}
+    for coin in coins:
+        value = data.get(coin)
+        if isinstance(value, list):
+            value = "\n".join(str(v) for v in value)
+        if isinstance(value, str) and value.strip():
+            out[coin] = value.strip()
+    return out
+
+
+def is_quota_error(error: Exception) -> bool:
+    error_msg = str(error)
+    return "429" in error_msg or "quota" in error_msg.lower()
+
+
+def quota_backoff(error: Exception) -> float:
+    """429 錯誤建議的等待秒數（例如 "Please retry in 23.5s"），沒有時用 AI_QUOTA_BACKOFF"""
+    match = _RETRY_IN.search(str(error))
+    return float(match.group(1)) if match else AI_QUOTA_BACKOFF
+
+
+def format_ai_error(error: Exception) -> str:
+    """把 Gemini 呼叫的例外轉成前端顯示的訊息"""
+    error_msg = str(error)
+    if is_quota_error(error):
+        return f"[配額已滿] API 配額已達上限。請在 24 小時後重試或升級付費方案。"
+    elif "invalid_api_key" in error_msg or "INVALID_ARGUMENT" in error_msg:
+        return f"[API 金鑰無效] 請檢查 GEMINI_API_KEY 是否正確設置。"
+    else:
+        return f"[AI 分析失敗] {error_msg[:100]}"
+
+
+def timeout_message() -> str:
+    return f"[AI 分析逾時] 超過 {AI_CALL_TIMEOUT:g} 秒未回應，請稍後重試。"
+
+
+def overloaded_message() -> str:
+    return "[AI 忙碌] 目前 AI 請求量過高，請稍後重試。"
+
+
+def _generate_sync(model, prompt: str) -> str:
+    """在 worker 執行緒中執行的同步呼叫"""
+    with _running_lock:
+        _counters["running"] += 1
+    try:
+        return model.generate_content(prompt).text
+    finally:
+        with _running_lock:
+            _counters["running"] -= 1
+
+
+def _close_stream(response) -> None:
+    """
+    中斷上游串流：取消底層的 gRPC 串流呼叫（可從任何執行緒呼叫），
+    worker 執行緒中阻塞等待下一個片段的讀取會立即以錯誤結束
+
+    google-generativeai 的串流回應沒有公開的關閉方法，底層呼叫在 GenerateContentResponse._iterator
+    （見 requirements.txt 的版本固定與 tests/test_gemini_pool.py）。
+    """
+    for target in (response, getattr(response, "_iterator", None)):
+        cancel = getattr(target, "cancel", None)
+        if callable(cancel):
+            try:
+                cancel()
+            except Exception as e:
+                logger.debug(f"Failed to cancel AI stream: {e}")
+            return
+
+
+def _stream_sync(
+    model,
+    prompt: str,
+    emit: Callable[[str, object], None],
+    cancel: threading.Event,
+    holder: dict,
+) -> None:
+    """
+    在 worker 執行緒中以串流模式呼叫 Gemini，每個片段透過 emit("chunk", text) 送回 event loop；
+    結束時 emit("done")，失敗時 emit("error", 例外)。
+    串流回應放在 holder["response"]，讓 event loop 在呼叫端離開時直接取消（_close_stream），
+    不必等到下一個片段才發現 cancel
+    """
+    with _running_lock:
+        _counters["running"] += 1
+    try:
+        response = model.generate_content(prompt, stream=True)
+        holder["response"] = response
+        # 先放入 holder 再檢查 cancel：event loop 先設定 cancel 再讀 holder，兩邊至少有一邊會關閉串流
+        if cancel.is_set():
+            _close_stream(response)
+            return
+        for chunk in response:
+            if cancel.is_set():
+                _close_stream(response)
+                return
+            text = chunk.text
+            if text:
+                emit("chunk", text)
+        emit("done", None)
+    except Exception as e:
+        if not cancel.is_set():
+            emit("error", e)
+    finally:
+        with _running_lock:
+            _counters["running"] -= 1
+
+
+async def startup() -> None:
+    global _executor, _sem
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AI_MAX_WORKERS, thread_name_prefix="gemini")
+    _sem = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+    if AI_CACHE_PATH and not _cache.disk_enabled:
+        try:
+            await asyncio.to_thread(_cache.open)
+        except Exception:
+            logger.exception(f"無法開啟 AI 快取磁碟層 {AI_CACHE_PATH}，改為僅使用記憶體")
+
+
+async def shutdown() -> None:
+    global _executor, _sem
+    if _executor is not None:
+        # 不等待仍在進行的 Gemini 呼叫，未開始的直接取消
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    _sem = None
+    await asyncio.to_thread(_cache.close)
+
+
+def _cache_key(model, coin: str, context: dict) -> str:
+    """快取 key：以正規化後的 context 計算摘要（提示本身仍以原始 context 產生）"""
+    normalized = normalize(context, AI_CACHE_SIG_DIGITS)
+    return cache_key(getattr(model, "model_name", ""), {"coin": coin, **normalized})
+
+
+async def _lookup(key: str) -> Optional[str]:
+    """查快取：先記憶體（不經過執行緒），再磁碟層"""
+    text = _cache.get_memory(key)
+    if text is None and _cache.disk_enabled:
+        text = await asyncio.to_thread(_cache.get_disk, key)
+    return text
+
+
+async def _store(key: str, text: str) -> None:
+    if _cache.disk_enabled:
+        await asyncio.to_thread(_cache.set, key, text)
+    else:
+        _cache.set(key, text)
+
+
+async def _acquire_slot(model, priority: int, tokens: int) -> None:
+    """
+    等待名額：先依優先順序取得該 key 的配額/並行名額，再取得全域並行名額
+    （被限速的 key 不會佔住其他 key 可用的全域名額）；呼叫端負責 _release_slot(model)
+
+    排隊超過 AI_QUEUE_TIMEOUT 秒時拋出 Overloaded；背景請求可能直接被排程器捨棄（同樣是 Overloaded）。
+    """
+    if _executor is None or _sem is None:
+        await startup()
+    _counters["waiting"] += 1
+    try:
+        try:
+            await asyncio.wait_for(model.acquire(priority, tokens), timeout=AI_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            _counters["queue_timeouts"] += 1
+            raise Overloaded(f"排隊超過 {AI_QUEUE_TIMEOUT:g} 秒")
+        try:
+            await _sem.acquire()
+        except BaseException:
+            model.release()
+            raise
+    finally:
+        _counters["waiting"] -= 1
+
+
+def _release_slot(model) -> None:
+    _sem.release()
+    model.release()
+
+
+async def _run(model, prompt: str, priority: int) -> str:
+    """
+    排隊取得名額後呼叫 Gemini（單次呼叫逾時拋出 asyncio.TimeoutError）
+
+    收到 429 時讓該 key 暫停建議的秒數（之後的請求繼續排隊而不是失敗），並重新排隊重試一次。
+    """
+    tokens = estimate_tokens(prompt)
+    for attempt in range(2):
+        await _acquire_slot(model, priority, tokens)
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(_executor, _generate_sync, model, prompt),
+                timeout=AI_CALL_TIMEOUT,
+            )
+        except Exception as e:
+            if attempt or not is_quota_error(e):
+                raise
+            backoff = quota_backoff(e)
+            model.penalize(backoff)
+            _counters["quota_retries"] += 1
+            logger.warning(f"Gemini quota exceeded (key {getattr(model, 'key_id', '?')}), pausing {backoff:g}s and retrying")
+        finally:
+            _release_slot(model)
+
+
+async def _generate_one(model, coin: str, context: dict, key: str, priority: int) -> str:
+    """單一幣種的單獨呼叫（呼叫端已查過快取）；相同 key 的並行呼叫合併為一次 Gemini 呼叫"""
+    return await _flight.do(key, lambda: _generate_uncached(model, coin, key, build_prompt(**context), priority))
+
+
+async def _generate_uncached(model, coin: str, key: str, prompt: str, priority: int) -> str:
+    """
+    呼叫 Gemini 並寫入快取；失敗、逾時或被排程器捨棄時回傳提示訊息（不快取）
+
+    逾時時已送出的呼叫無法中斷，會在背景執行緒跑完後丟棄結果，
+    執行緒數有上限，因此不會無限累積。
+    """
+    _counters["calls"] += 1
+    started = time.monotonic()
+    try:
+        text = await _run(model, prompt, priority)
+    except Overloaded as e:
+        _counters["shed"] += 1
+        logger.warning(f"{coin} AI analysis shed: {e}")
+        return overloaded_message()
+    except asyncio.TimeoutError:
+        _counters["timeouts"] += 1
+        logger.warning(f"{coin} AI analysis timed out (>{AI_CALL_TIMEOUT}s)")
+        return timeout_message()
+    except Exception as e:
+        _counters["failed"] += 1
+        logger.exception(f"{coin} AI analysis failed")
+        return format_ai_error(e)
+    elapsed = time.monotonic() - started
+    _counters["completed"] += 1
+    _latency["total"] += elapsed
+    _latency["max"] = max(_latency["max"], elapsed)
+    logger.info(f"{coin} AI analysis completed successfully ({elapsed:.2f}s)")
+    await _store(key, text)
+    return text
+
+
+async def generate_batch(
+    model,
+    items: list,
+    on_result: Optional[Callable[[int, Optional[str]], None]] = None,
+    priority: int = PRIORITY_NORMAL,
+) -> list:
+    """
+    產生多個幣種的 AI 分析，回傳與 items（[(coin, context), ...]）順序相同的文字列表
+
+    context 為 build_prompt 的參數。先逐一查快取（記憶體命中不經過執行緒池），未命中的幣種每 AI_BATCH_SIZE 個
+    合併成一次 Gemini 請求（JSON 回應依幣種拆回；只剩一個幣種時直接單獨呼叫）。只有成功的結果會寫入快取。
+    回應無法解析或缺少某些幣種時，這些幣種改為各自單獨呼叫（_generate_one）；
+    合併請求本身失敗（配額、逾時等）時直接回傳錯誤訊息，不再放大請求數。
+    on_result(index, text) 會在每個幣種的結果出來時立即呼叫（例如讓背景工作逐步公開結果）。
+    """
+    if not model:
+        return [None] * len(items)
+    texts: list = [None] * len(items)
+    pending = []
+    for i, (coin, context) in enumerate(items):
+        key = _cache_key(model, coin, context)
+        text = await _lookup(key)
+        if text is not None:
+            texts[i] = text
+            if on_result is not None:
+                on_result(i, text)
+        else:
+            pending.append((i, coin, context, key))
+
+    async def _chunk_and_publish(chunk: list) -> None:
+        for (i, _, _, _), text in zip(chunk, await _generate_chunk(model, chunk, priority)):
+            texts[i] = text
+            if on_result is not None:
+                on_result(i, text)
+
+    chunks = [pending[j:j + AI_BATCH_SIZE] for j in range(0, len(pending), AI_BATCH_SIZE)]
+    await asyncio.gather(*[_chunk_and_publish(chunk) for chunk in chunks])
+    return texts
+
+
+async def _generate_chunk(model, chunk: list, priority: int) -> list:
+    """一組未命中快取的幣種：單一幣種直接呼叫，多個幣種合併成一次請求"""
+    if len(chunk) == 1:
+        _, coin, context, key = chunk[0]
+        return [await _generate_one(model, coin, context, key, priority)]
+
+    coins = [coin for _, coin, _, _ in chunk]
+    label = ",".join(coins)
+    _counters["calls"] += 1
+    _counters["batch_calls"] += 1
+    _counters["batch_coins"] += len(chunk)
+    started = time.monotonic()
+    try:
+        raw = await _run(model, build_batch_prompt([(coin, context) for _, coin, context, _ in chunk]), priority)
+    except Overloaded as e:
+        _counters["shed"] += 1
+        logger.warning(f"{label} batched AI analysis shed: {e}")
+        return [overloaded_message()] * len(chunk)
+    except asyncio.TimeoutError:
+        _counters["timeouts"] += 1
+        logger.warning(f"{label} batched AI analysis timed out (>{AI_CALL_TIMEOUT}s)")
+        return [timeout_message()] * len(chunk)
+    except Exception as e:
+        _counters["failed"] += 1
+        logger.exception(f"{label} batched AI analysis failed")
+        return [format_ai_error(e)] * len(chunk)
+    elapsed = time.monotonic() - started
+    _counters["completed"] += 1
+    _latency["total"] += elapsed
+    _latency["max"] = max(_latency["max"], elapsed)
+
+    try:
+        parsed = parse_batch_response(raw, coins)
+    except ValueError as e:
+        logger.warning(f"{label} batched AI response could not be parsed ({e}), falling back to per-coin calls")
+        parsed = {}
+    texts = []
+    fallback = []
+    for pos, (_, coin, context, key) in enumerate(chunk):
+        text = parsed.get(coin)
+        if text is None:
+            fallback.append(pos)
+            texts.append(None)
+            continue
+        await _store(key, text)
+        texts.append(text)
+    logger.info(f"{label} batched AI analysis completed ({elapsed:.2f}s, {len(chunk) - len(fallback)}/{len(chunk)} parsed)")
+
+    if fallback:
+        _counters["batch_fallbacks"] += len(fallback)
+        retried = await asyncio.gather(*[
+            _generate_one(model, chunk[pos][1], chunk[pos][2], chunk[pos][3], priority) for pos in fallback
+        ])
+        for pos, text in zip(fallback, retried):
+            texts[pos] = text
+    return texts
+
+
+async def stream_analysis(
+    model, coin: str, context: dict, priority: int = PRIORITY_INTERACTIVE
+) -> AsyncIterator[str]:
+    """
+    以串流模式產生一個幣種的 AI 分析，逐段 yield 模型產生的文字
+
+    快取命中時一次 yield 完整文字。完整產生後寫入快取（與 generate_batch 共用 key）。
+    片段之間超過 AI_CALL_TIMEOUT 秒時拋出 asyncio.TimeoutError；排隊逾時或被捨棄時拋出 Overloaded；
+    Gemini 錯誤原樣拋出（429 時另外讓該 key 暫停）。
+    呼叫端提前結束（例如客戶端斷線，generator 被關閉或取消）時立即取消上游串流，worker 執行緒隨即釋放。
+    只有完整產生且非空的文字才寫入快取。
+    """
+    if not model:
+        return
+    key = _cache_key(model, coin, context)
+    text = await _lookup(key)
+    if text is not None:
+        logger.info(f"{coin} AI analysis served from cache")
+        yield text
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancel = threading.Event()
+    holder: dict = {}
+    completed = False
+
+    def emit(kind: str, value) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+        except RuntimeError:
+            # event loop 已關閉
+            cancel.set()
+
+    _counters["calls"] += 1
+    _counters["streams"] += 1
+    started = time.monotonic()
+    prompt = build_prompt(**context)
+    try:
+        await _acquire_slot(model, priority, estimate_tokens(prompt))
+    except Overloaded:
+        _counters["shed"] += 1
+        raise
+    parts: list = []
+    try:
+        loop.run_in_executor(_executor, _stream_sync, model, prompt, emit, cancel, holder)
+        while True:
+            try:
+                kind, value = await asyncio.wait_for(queue.get(), timeout=AI_CALL_TIMEOUT)
+            except asyncio.TimeoutError:
+                _counters["timeouts"] += 1
+                logger.warning(f"{coin} AI stream stalled (>{AI_CALL_TIMEOUT}s)")
+                raise
+            if kind == "chunk":
+                if not parts:
+                    logger.info(f"{coin} AI stream first chunk after {time.monotonic() - started:.2f}s")
+                parts.append(value)
+                yield value
+            elif kind == "error":
+                _counters["failed"] += 1
+                logger.error(f"{coin} AI stream failed: {value}")
+                if is_quota_error(value):
+                    model.penalize(quota_backoff(value))
+                raise value
+            else:
+                completed = True
+                break
+    except (GeneratorExit, asyncio.CancelledError):
+        _counters["streams_cancelled"] += 1
+        logger.info(f"{coin} AI stream cancelled by caller")
+        raise
+    finally:
+        cancel.set()
+        if not completed and "response" in holder:
+            _close_stream(holder["response"])
+        _release_slot(model)
+
+    elapsed = time.monotonic() - started
+    _counters["completed"] += 1
+    _latency["total"] += elapsed
+    _latency["max"] = max(_latency["max"], elapsed)
+    text = "".join(parts)
+    logger.info(f"{coin} AI stream completed ({elapsed:.2f}s, {len(text)} chars)")
+    if text:
+        await _store(key, text)
+
+
+def stats() -> dict:
+    completed = _counters["completed"]
+    return {
+        **_counters,
+        "max_workers": AI_MAX_WORKERS,
+        "max_concurrency": AI_MAX_CONCURRENCY,
+        "timeout": AI_CALL_TIMEOUT,
+        "queue_timeout": AI_QUEUE_TIMEOUT,
+        "batch_size": AI_BATCH_SIZE,
+        "avg_latency": round(_latency["total"] / completed, 3) if completed else 0.0,
+        "max_latency": round(_latency["max"], 3),
+        "cache": _cache.stats(),
+        "singleflight": _flight.stats(),
+    }
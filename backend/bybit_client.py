@@ -0,0 +1,101 @@
+"""
+Bybit HTTP client 模組 - 全程序共用的長連線 httpx.AsyncClient
+
+所有 K 線請求（main.py 與 chart_generator.py）都經由同一個 client，
+避免每次請求都重新建立 TCP + TLS 連線。client 於 FastAPI 啟動時建立、關閉時釋放。
+
+可用環境變數調整：
+    BYBIT_BASE_URL            預設 https://api.bybit.com
+    BYBIT_TIMEOUT             單次請求逾時秒數（預設 15）
+    BYBIT_MAX_CONNECTIONS     連線池上限（預設 50）
+    BYBIT_MAX_KEEPALIVE       保持存活的閒置連線數（預設 20）
+    BYBIT_KEEPALIVE_EXPIRY    閒置連線保留秒數（預設 30）
+    BYBIT_HTTP2               設為 1 啟用 HTTP/2（需安裝 h2 套件）
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+BYBIT_BASE_URL = os.getenv("BYBIT_BASE_URL", "https://api.bybit.com").rstrip("/")
+BYBIT_TIMEOUT = float(os.getenv("BYBIT_TIMEOUT", "15"))
+BYBIT_MAX_CONNECTIONS = int(os.getenv("BYBIT_MAX_CONNECTIONS", "50"))
+BYBIT_MAX_KEEPALIVE = int(os.getenv("BYBIT_MAX_KEEPALIVE", "20"))
+BYBIT_KEEPALIVE_EXPIRY = float(os.getenv("BYBIT_KEEPALIVE_EXPIRY", "30"))
+BYBIT_HTTP2 = os.getenv("BYBIT_HTTP2", "0").strip().lower() in ("1", "true", "yes")
+
+KLINE_PATH = "/v5/market/kline"
+
+_client: Optional[httpx.AsyncClient] = None
+# 建立 client 時所在的 event loop；httpx 的連線綁定在 loop 上，換 loop 必須重建
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _http2_enabled() -> bool:
+    """BYBIT_HTTP2 開啟且已安裝 h2 時才使用 HTTP/2"""
+    if not BYBIT_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("BYBIT_HTTP2=1 但未安裝 h2 套件，改用 HTTP/1.1（pip install httpx[http2]）")
+        return False
+    return True
+
+
+def _create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=BYBIT_MAX_CONNECTIONS,
+        max_keepalive_connections=BYBIT_MAX_KEEPALIVE,
+        keepalive_expiry=BYBIT_KEEPALIVE_EXPIRY,
+    )
+    http2 = _http2_enabled()
+    logger.info(
+        f"建立 Bybit HTTP client: base={BYBIT_BASE_URL}, http2={http2}, "
+        f"max_connections={BYBIT_MAX_CONNECTIONS}, max_keepalive={BYBIT_MAX_KEEPALIVE}"
+    )
+    return httpx.AsyncClient(
+        base_url=BYBIT_BASE_URL,
+        timeout=BYBIT_TIMEOUT,
+        limits=limits,
+        http2=http2,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    取得共用的 Bybit client
+
+    正常情況下 client 在 app 啟動時已建立；若在啟動流程之外被呼叫
+    （例如 generate_candlestick_chart_sync 透過 asyncio.run 執行），會在目前的 loop 上延遲建立。
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _create_client()
+        _client_loop = loop
+    return _client
+
+
+async def startup() -> None:
+    """於 app 啟動時建立 client"""
+    get_client()
+
+
+async def shutdown() -> None:
+    """於 app 關閉時釋放連線池"""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Bybit HTTP client 已關閉")
+    _client = None
+    _client_loop = None
+
+
+async def get_kline(params: dict) -> httpx.Response:
+    """以共用 client 呼叫 v5 kline API，params 例如 {"category": "linear", "symbol": ..., "interval": ..., "limit": ...}"""
+    return await get_client().get(KLINE_PATH, params=params)
@@ -0,0 +1,178 @@
+"""
+本機 K 線倉庫 - 以 SQLite 依 (symbol, interval, ts) 保存已收盤的 candle
+
+重啟後 /analyze、/history 與圖表可直接從本機讀取歷史資料，只向 Bybit 補抓缺少的區間。
+所有方法都是同步的（sqlite3），在 async 程式中請以 asyncio.to_thread 呼叫。
+"""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+import numpy as np
+
+from market_data import Candles
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    symbol   TEXT    NOT NULL,
+    interval TEXT    NOT NULL,
+    ts       INTEGER NOT NULL,
+    open     REAL    NOT NULL,
+    high     REAL    NOT NULL,
+    low      REAL    NOT NULL,
+    close    REAL    NOT NULL,
+    volume   REAL    NOT NULL,
+    PRIMARY KEY (symbol, interval, ts)
+) WITHOUT ROWID
+"""
+
+# 每個序列最早可取得的 candle（上市時間），避免重複向 Bybit 查詢更早的空區間
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series_meta (
+    symbol   TEXT    NOT NULL,
+    interval TEXT    NOT NULL,
+    first_ts INTEGER NOT NULL,
+    PRIMARY KEY (symbol, interval)
+) WITHOUT ROWID
+"""
+
+
+class CandleStore:
+    """
+    SQLite 實作的 candle 倉庫
+
+    - append：寫入（同一根 candle 重複寫入時覆蓋）
+    - load：依時間範圍查詢，回傳升序的 Candles
+    - compact：每個序列只保留最新 max_per_series 根，並回收空間
+    - get_first_ts / set_first_ts：序列的上市時間（最早一根 candle 的 ts）
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        conn.execute(_META_SCHEMA)
+        conn.commit()
+        self._conn = conn
+        logger.info(f"K 線倉庫已開啟: {self.path}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def append(self, symbol: str, interval: str, candles: Candles) -> int:
+        """寫入 candles，回傳寫入筆數"""
+        if self._conn is None or len(candles) == 0:
+            return 0
+        rows = zip(
+            [symbol] * len(candles), [interval] * len(candles), candles.ts.tolist(),
+            candles.open.tolist(), candles.high.tolist(), candles.low.tolist(),
+            candles.close.tolist(), candles.volume.tolist(),
+        )
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        return len(candles)
+
+    def load(
+        self,
+        symbol: str,
+        interval: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Candles:
+        """
+        查詢 start <= ts <= end 的 candle（皆可省略），依時間升序回傳；
+        指定 limit 時取範圍內最新的 limit 根
+        """
+        if self._conn is None:
+            return Candles.empty()
+        sql = "SELECT ts, open, high, low, close, volume FROM candles WHERE symbol = ? AND interval = ?"
+        args: list = [symbol, interval]
+        if start is not None:
+            sql += " AND ts >= ?"
+            args.append(int(start))
+        if end is not None:
+            sql += " AND ts <= ?"
+            args.append(int(end))
+        sql += " ORDER BY ts DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        if not rows:
+            return Candles.empty()
+        arr = np.array(rows[::-1], dtype=np.float64)
+        return Candles(
+            arr[:, 0].astype(np.int64), arr[:, 1], arr[:, 2], arr[:, 3], arr[:, 4], arr[:, 5]
+        )
+
+    def get_first_ts(self, symbol: str, interval: str) -> Optional[int]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT first_ts FROM series_meta WHERE symbol = ? AND interval = ?", (symbol, interval)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_first_ts(self, symbol: str, interval: str, ts: int) -> None:
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO series_meta VALUES (?, ?, ?)", (symbol, interval, int(ts)))
+            self._conn.commit()
+
+    def compact(self, max_per_series: int) -> int:
+        """每個 (symbol, interval) 只保留最新 max_per_series 根，刪除其餘並 VACUUM，回傳刪除筆數"""
+        if self._conn is None:
+            return 0
+        deleted = 0
+        with self._lock:
+            series = self._conn.execute("SELECT DISTINCT symbol, interval FROM candles").fetchall()
+            for symbol, interval in series:
+                row = self._conn.execute(
+                    "SELECT ts FROM candles WHERE symbol = ? AND interval = ? ORDER BY ts DESC LIMIT 1 OFFSET ?",
+                    (symbol, interval, max_per_series),
+                ).fetchone()
+                if row is None:
+                    continue
+                cur = self._conn.execute(
+                    "DELETE FROM candles WHERE symbol = ? AND interval = ? AND ts <= ?",
+                    (symbol, interval, row[0]),
+                )
+                deleted += cur.rowcount
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+        if deleted:
+            logger.info(f"K 線倉庫壓縮完成，刪除 {deleted} 筆")
+        return deleted
+
+    def stats(self) -> dict:
+        if self._conn is None:
+            return {"enabled": False}
+        with self._lock:
+            count, n_series = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT symbol || '/' || interval) FROM candles"
+            ).fetchone()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {"enabled": True, "path": self.path, "candles": count, "series": n_series, "bytes": size}
@@ -0,0 +1,202 @@
+"""
+圖表 PNG 快取 - 以 (幣種, 週期, K 線數, 最後一根 K 線的 ts 與收盤價, 指標組合) 的摘要為 key
+
+同樣的輸入一定產生同樣的圖，key 也直接作為 HTTP ETag。兩層：
+- 記憶體 TTLCache（LRU + TTL），命中時不經過渲染池也不碰磁碟
+- 選用的磁碟層（CHART_CACHE_DIR），每張圖一個檔案，總大小超過 CHART_CACHE_DISK_MAX_BYTES 時
+  淘汰最久未使用的檔案（讀取時更新 mtime），重啟後依 mtime 重建索引
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "64"))
+CHART_CACHE_TTL = float(os.getenv("CHART_CACHE_TTL", "600"))
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", "").strip()
+CHART_CACHE_DISK_MAX_BYTES = int(os.getenv("CHART_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+# 回應的 Cache-Control max-age（秒）；新的 K 線出現後 key 即改變
+CHART_HTTP_MAX_AGE = int(os.getenv("CHART_HTTP_MAX_AGE", "30"))
+
+# 圖表樣式改變時遞增，讓舊的磁碟快取失效
+_STYLE_VERSION = 1
+
+
+def chart_key(symbol: str, interval: str, limit: int, last_ts: int, last_close: float, overlays: list) -> str:
+    """
+    圖表快取 key（SHA-256）；最後一根 K 線仍在變動時收盤價會改變，因此一併納入
+    overlays 視為集合（順序不影響圖表）
+    """
+    payload = json.dumps(
+        [_STYLE_VERSION, symbol, interval, limit, last_ts, last_close, sorted(overlays)],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def etag(key: str) -> str:
+    """快取 key 對應的 HTTP ETag"""
+    return f'"{key[:32]}"'
+
+
+class ChartCache:
+    """
+    記憶體 + 選用磁碟兩層的 PNG 快取
+
+    - get_memory：只查記憶體（可直接在 event loop 中呼叫）
+    - get_disk / set_disk：磁碟層（同步，請以 asyncio.to_thread 呼叫），get_disk 命中時回填記憶體
+    """
+
+    def __init__(self, max_entries: int, ttl: float, directory: str = "", disk_max_bytes: int = 0):
+        self.memory = TTLCache(max_entries, ttl, name="chart")
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        # key -> 檔案大小，依最近使用排序
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._enabled = False
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_evictions = 0
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self._enabled
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def open(self) -> None:
+        """建立目錄並依 mtime 重建索引，超過大小上限的部分立即淘汰（directory 為空時不啟用）"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".tmp"):
+                # 上次寫到一半中斷的暫存檔
+                os.remove(entry.path)
+            elif entry.is_file() and entry.name.endswith(".png"):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        with self._lock:
+            self._index.clear()
+            self._disk_bytes = 0
+            for _, key, size in sorted(entries):
+                self._index[key] = size
+                self._disk_bytes += size
+            self._evict_locked()
+            self._enabled = True
+        logger.info(f"圖表快取磁碟層已開啟: {self.directory}（{len(self._index)} 張，{self._disk_bytes} bytes）")
+
+    def close(self) -> None:
+        with self._lock:
+            self._enabled = False
+
+    def _evict_locked(self) -> None:
+        while self._index and self._disk_bytes > self.disk_max_bytes:
+            key, size = self._index.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get_memory(self, key: str) -> Optional[bytes]:
+        return self.memory.get(key)
+
+    def get_disk(self, key: str) -> Optional[bytes]:
+        if not self._enabled:
+            return None
+        with self._lock:
+            if key not in self._index:
+                self.disk_misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                png = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._index.pop(key, 0)
+                self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, png)
+        return png
+
+    def set_memory(self, key: str, png: bytes) -> None:
+        self.memory.set(key, png)
+
+    def set_disk(self, key: str, png: bytes) -> None:
+        if not self._enabled or len(png) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(png) - self._index.pop(key, 0)
+            self._index[key] = len(png)
+            self._evict_locked()
+
+    def stats(self) -> dict:
+        disk = {"enabled": self._enabled}
+        if self._enabled:
+            total = self.disk_hits + self.disk_misses
+            disk.update({
+                "path": self.directory,
+                "entries": len(self._index),
+                "bytes": self._disk_bytes,
+                "max_bytes": self.disk_max_bytes,
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "hit_rate": round(self.disk_hits / total, 4) if total else 0.0,
+                "evictions": self.disk_evictions,
+            })
+        return {**self.memory.stats(), "disk": disk}
+
+
+_cache = ChartCache(CHART_CACHE_MAX_ENTRIES, CHART_CACHE_TTL, CHART_CACHE_DIR, CHART_CACHE_DISK_MAX_BYTES)
+
+
+async def get(key: str) -> Optional[bytes]:
+    """查快取：先記憶體（不經過執行緒），再磁碟層"""
+    png = _cache.get_memory(key)
+    if png is None and _cache.disk_enabled:
+        png = await asyncio.to_thread(_cache.get_disk, key)
+    return png
+
+
+async def put(key: str, png: bytes) -> None:
+    _cache.set_memory(key, png)
+    if _cache.disk_enabled:
+        await asyncio.to_thread(_cache.set_disk, key, png)
+
+
+async def startup() -> None:
+    if CHART_CACHE_DIR and not _cache.disk_enabled:
+        try:
+            await asyncio.to_thread(_cache.open)
+        except Exception:
+            logger.exception(f"無法開啟圖表快取磁碟層 {CHART_CACHE_DIR}，改為僅使用記憶體")
+
+
+async def shutdown() -> None:
+    _cache.close()
+
+
+def stats() -> dict:
+    return {**_cache.stats(), "http_max_age": CHART_HTTP_MAX_AGE}
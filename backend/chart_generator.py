@@ -3,16 +3,26 @@
 """
 import logging
 import asyncio
-import httpx
+import bybit_client
+import chart_cache
+import chart_renderer
+import market_data
+from market_data import Candles
+from indicators import IndicatorEngine
+from singleflight import SingleFlight
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import math
+from typing import Callable, Optional
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+_flight = SingleFlight("chart")
 
-async def fetch_kline_data(symbol: str, interval: str, limit: int = 500):
+
+async def fetch_kline_data(symbol: str, interval: str, limit: int = 500) -> Candles:
     """
     從 Bybit API 獲取 K 線資料
     
@@ -22,96 +32,86 @@ async def fetch_kline_data(symbol: str, interval: str, limit: int = 500):
         limit: 返回的 candle 數量
     
     Returns:
-        包含 OHLCV 資料的列表，按時間升序排列
+        Candles（按時間升序排列），失敗時為空的 Candles
     """
-    url = f"https://api.bybit.com/v5/market/kline?category=linear&symbol={symbol}&interval={interval}&limit={limit}"
-    
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        try:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            
-            data = resp.json()
-            if data.get("retCode") != 0:
-                logger.error(f"Bybit API error: {data.get('retMsg')}")
-                return []
-            
-            klist = data.get("result", {}).get("list", [])
-            if not klist:
-                logger.warning(f"No kline data returned for {symbol}")
-                return []
-            
-            # 轉換為升序（最舊到最新）
-            candles = []
-            for item in klist:
-                try:
-                    candle = {
-                        "time": int(item[0]) // 1000,  # 轉換為秒
-                        "open": float(item[1]),
-                        "high": float(item[2]),
-                        "low": float(item[3]),
-                        "close": float(item[4]),
-                        "volume": float(item[5])
-                    }
-                    candles.append(candle)
-                except (IndexError, ValueError) as e:
-                    logger.warning(f"Failed to parse candle: {e}")
-                    continue
-            
-            # 反轉為升序
-            candles.reverse()
-            return candles
-            
-        except Exception as e:
-            logger.error(f"Failed to fetch kline data: {e}")
-            return []
+    try:
+        return await market_data.get_candles(symbol, interval, limit)
+    except Exception as e:
+        logger.error(f"Failed to fetch kline data: {e}")
+        return Candles.empty()
 
 
-async def generate_candlestick_chart(
-    symbol: str,
-    interval: str,
-    limit: int = 500,
-    save_path: str = None
-):
+# 可選的指標疊加：ema / bollinger 疊在主圖，rsi / macd 各自一個子圖
+CHART_OVERLAYS = ("ema", "bollinger", "rsi", "macd")
+# /chart-data 可回傳的指標（ma 即圖上固定的 MA7 / MA25；sr 為每一根的支撐/阻力）
+CHART_DATA_OVERLAYS = ("ma", "ema", "rsi", "macd", "bollinger", "sr")
+# sr 的回看根數（與 /analyze 的支撐/阻力相同）
+CHART_SR_LOOKBACK = 200
+
+
+def parse_overlays(overlays, allowed=CHART_OVERLAYS) -> list:
+    """把 "ema,rsi" 或 ["ema", "rsi"] 轉成 allowed 中的 overlay 名稱列表（忽略未知名稱）"""
+    if not overlays:
+        return []
+    if isinstance(overlays, str):
+        overlays = overlays.split(",")
+    names = []
+    for name in overlays:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in allowed:
+            logger.warning(f"Unknown chart overlay ignored: {name}")
+            continue
+        if name not in names:
+            names.append(name)
+    return names
+
+
+async def _fetch_for_chart(symbol: str, interval: str, limit: int) -> Candles:
+    candles = await fetch_kline_data(symbol, interval, limit)
+    if len(candles) == 0:
+        logger.error(f"No data to plot for {symbol}")
+        raise ValueError(f"Unable to fetch data for {symbol}")
+    return candles
+
+
+def build_candlestick_figure(candles: Candles, symbol: str, interval: str, overlays: list) -> tuple:
     """
-    生成蠟燭圖並保存或返回
-    
+    由 K 線建立蠟燭圖 figure
+
     Args:
-        symbol: 交易對，如 "BTCUSDT"
-        interval: 時間間隔
-        limit: K 線數量
-        save_path: 圖片保存路徑（如果為 None，返回 HTML）
-    
+        candles: K 線（按時間升序排列，不可為空）
+        symbol: 交易對（圖表標題與圖例用）
+        interval: 時間間隔（圖表標題用）
+        overlays: parse_overlays 的結果
+
     Returns:
-        圖表對象或保存路徑
+        (figure, 圖高 px)
     """
+    # 準備資料
+    times = [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in (candles.ts // 1000).tolist()]
+    opens = candles.open
+    highs = candles.high
+    lows = candles.low
+    closes = candles.close
+    volumes = candles.volume
     
-    # 獲取資料
-    candles = await fetch_kline_data(symbol, interval, limit)
-    
-    if not candles:
-        logger.error(f"No data to plot for {symbol}")
-        raise ValueError(f"Unable to fetch data for {symbol}")
+    # 指標與 /analyze 共用同一個向量化引擎（padding 方式一致）
+    engine = IndicatorEngine(candles)
+    ma7 = engine.ma(7)
+    ma25 = engine.ma(25)
     
-    # 準備資料
-    times = [datetime.fromtimestamp(c["time"]).strftime('%Y-%m-%d %H:%M:%S') for c in candles]
-    opens = [c["open"] for c in candles]
-    highs = [c["high"] for c in candles]
-    lows = [c["low"] for c in candles]
-    closes = [c["close"] for c in candles]
-    volumes = [c["volume"] for c in candles]
-    
-    # 計算簡單移動平均
-    ma7 = calculate_ma(closes, 7)
-    ma25 = calculate_ma(closes, 25)
-    
-    # 建立子圖：主圖表 + 成交量
+    # 建立子圖：主圖表 + 成交量（+ RSI / MACD）
+    sub_rows = [name for name in ("rsi", "macd") if name in overlays]
+    rows = 2 + len(sub_rows)
+    row_heights = [0.7, 0.3] if rows == 2 else [0.55, 0.15] + [0.3 / len(sub_rows)] * len(sub_rows)
     fig = make_subplots(
-        rows=2, cols=1,
+        rows=rows, cols=1,
         shared_xaxes=True,
-        vertical_spacing=0.1,
-        row_heights=[0.7, 0.3],
-        specs=[[{"secondary_y": False}], [{"secondary_y": False}]]
+        vertical_spacing=0.1 if rows == 2 else 0.05,
+        row_heights=row_heights,
+        specs=[[{"secondary_y": False}]] * rows
     )
     
     # 蠟燭圖
@@ -151,8 +151,29 @@ async def generate_candlestick_chart(
         row=1, col=1
     )
     
+    if "ema" in overlays:
+        for period, color in ((12, '#FF66CC'), (26, '#9966FF')):
+            fig.add_trace(
+                go.Scatter(x=times, y=engine.ema(period), name=f'EMA{period}', line=dict(color=color, width=1)),
+                row=1, col=1
+            )
+    
+    if "bollinger" in overlays:
+        _, upper, lower = engine.bollinger(20, 2.0)
+        fig.add_trace(
+            go.Scatter(x=times, y=upper, name='BB Upper', line=dict(color='#AAAAAA', width=1, dash='dot')),
+            row=1, col=1
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=times, y=lower, name='BB Lower', line=dict(color='#AAAAAA', width=1, dash='dot'),
+                fill='tonexty', fillcolor='rgba(170,170,170,0.08)',
+            ),
+            row=1, col=1
+        )
+    
     # 成交量柱狀圖
-    colors = ['#00CC00' if closes[i] >= opens[i] else '#FF0000' for i in range(len(closes))]
+    colors = np.where(closes >= opens, '#00CC00', '#FF0000').tolist()
     fig.add_trace(
         go.Bar(
             x=times,
@@ -164,39 +185,169 @@ async def generate_candlestick_chart(
         row=2, col=1
     )
     
+    for row, name in enumerate(sub_rows, start=3):
+        if name == "rsi":
+            fig.add_trace(
+                go.Scatter(x=times, y=engine.rsi(14), name='RSI14', line=dict(color='#FFD700', width=1)),
+                row=row, col=1
+            )
+            for level in (30, 70):
+                fig.add_hline(y=level, line=dict(color='#666666', width=1, dash='dash'), row=row, col=1)
+        else:
+            macd, signal = engine.macd(12, 26, 9)
+            fig.add_trace(
+                go.Bar(
+                    x=times, y=macd - signal, name='MACD Hist',
+                    marker_color=np.where(macd >= signal, '#00CC00', '#FF0000').tolist(), opacity=0.5,
+                ),
+                row=row, col=1
+            )
+            fig.add_trace(
+                go.Scatter(x=times, y=macd, name='MACD', line=dict(color='#00BFFF', width=1)),
+                row=row, col=1
+            )
+            fig.add_trace(
+                go.Scatter(x=times, y=signal, name='Signal', line=dict(color='#FF8C00', width=1)),
+                row=row, col=1
+            )
+    
+    height = 600 + 150 * len(sub_rows)
+    
     # 更新圖表配置
     fig.update_layout(
         title=f"{symbol} K-Line Chart (Interval: {interval})",
-        height=600,
+        height=height,
         template='plotly_dark',
         hovermode='x unified',
         margin=dict(l=50, r=50, t=50, b=50),
         xaxis_rangeslider_visible=False,
     )
     
-    # 保存或返回
+    return fig, height
+
+
+async def render_candlestick_png(
+    symbol: str,
+    interval: str,
+    limit: int = 500,
+    overlays=None,
+    is_current: Optional[Callable[[str], bool]] = None,
+) -> tuple:
+    """
+    產生蠟燭圖 PNG，回傳 (PNG bytes, 快取 key)
+
+    先以最新 K 線算出 chart_cache.chart_key，命中快取時不重新渲染；未命中時相同 key 的並行請求
+    只渲染一次（建圖與渲染都在 chart_renderer 的渲染行程中，不阻塞 event loop）。
+    is_current(key) 回傳 True 時（例如客戶端的 ETag 仍有效）不取圖，回傳 (None, key)。
+    """
+    overlays = parse_overlays(overlays)
+    candles = await _fetch_for_chart(symbol, interval, limit)
+    key = chart_cache.chart_key(
+        symbol, interval, limit, int(candles.ts[-1]), float(candles.close[-1]), overlays
+    )
+    if is_current is not None and is_current(key):
+        return None, key
+    png = await chart_cache.get(key)
+    if png is None:
+        png = await _flight.do(key, lambda: _render_and_store(key, candles, symbol, interval, overlays))
+    return png, key
+
+
+def _render_chart_png(candles: Candles, symbol: str, interval: str, overlays: list) -> bytes:
+    """在渲染行程（或執行緒）中執行：建立 figure 並轉成 PNG，建圖與序列化都不佔用 event loop"""
+    fig, height = build_candlestick_figure(candles, symbol, interval, overlays)
+    return fig.to_image(format="png", width=1200, height=height)
+
+
+async def _render_and_store(key: str, candles: Candles, symbol: str, interval: str, overlays: list) -> bytes:
+    png = await chart_renderer.render(_render_chart_png, candles, symbol, interval, overlays)
+    await chart_cache.put(key, png)
+    return png
+
+
+def _build_chart_html(candles: Candles, symbol: str, interval: str, overlays: list) -> str:
+    fig, _ = build_candlestick_figure(candles, symbol, interval, overlays)
+    return fig.to_html()
+
+
+async def generate_candlestick_chart(
+    symbol: str,
+    interval: str,
+    limit: int = 500,
+    save_path: str = None,
+    overlays=None,
+):
+    """
+    生成蠟燭圖並保存或返回
+    
+    Args:
+        symbol: 交易對，如 "BTCUSDT"
+        interval: 時間間隔
+        limit: K 線數量
+        save_path: 圖片保存路徑（如果為 None，返回 HTML）
+        overlays: 額外指標，CHART_OVERLAYS 中的名稱（逗號分隔字串或列表）
+    
+    Returns:
+        圖表對象或保存路徑
+    """
     if save_path:
-        fig.write_image(save_path, width=1200, height=600)
+        png, _ = await render_candlestick_png(symbol, interval, limit, overlays)
+        await asyncio.to_thread(_write_file, save_path, png)
         logger.info(f"Chart saved to {save_path}")
         return save_path
-    else:
-        return fig.to_html()
+    candles = await _fetch_for_chart(symbol, interval, limit)
+    return await asyncio.to_thread(_build_chart_html, candles, symbol, interval, parse_overlays(overlays))
 
 
-def calculate_ma(data: list, period: int) -> list:
-    """計算簡單移動平均"""
-    if len(data) < period:
-        return [None] * len(data)
-    
-    ma = []
-    for i in range(len(data)):
-        if i < period - 1:
-            ma.append(None)
-        else:
-            window = data[i - period + 1:i + 1]
-            ma.append(sum(window) / period)
-    
-    return ma
+def _column(values: np.ndarray) -> list:
+    """numpy 陣列轉 JSON 列表，非有限值轉為 None"""
+    if np.isfinite(values).all():
+        return values.tolist()
+    return [v if math.isfinite(v) else None for v in values.tolist()]
+
+
+def build_chart_data(candles: Candles, overlays=None, max_points: int = 0) -> dict:
+    """
+    給前端自行繪圖的欄式資料：OHLCV 欄位 + 指標序列（CHART_DATA_OVERLAYS 中的名稱）
+
+    指標一律以完整序列計算（與 /analyze、PNG 圖表相同的引擎），max_points > 0 且 K 線數超過時
+    再以 Candles.downsample 做 OHLC 桶聚合，指標取每桶最後一根的值（與 close 對齊）。
+    """
+    overlays = parse_overlays(overlays, CHART_DATA_OVERLAYS)
+    engine = IndicatorEngine(candles)
+    series = {}
+    if "ma" in overlays:
+        series.update({"ma7": engine.ma(7), "ma25": engine.ma(25)})
+    if "ema" in overlays:
+        series.update({"ema12": engine.ema(12), "ema26": engine.ema(26)})
+    if "rsi" in overlays:
+        series["rsi14"] = engine.rsi(14)
+    if "macd" in overlays:
+        macd, signal = engine.macd(12, 26, 9)
+        series.update({"macd": macd, "signal": signal, "histogram": macd - signal})
+    if "bollinger" in overlays:
+        mid, upper, lower = engine.bollinger(20, 2.0)
+        series.update({"bb_mid": mid, "bb_upper": upper, "bb_lower": lower})
+    if "sr" in overlays:
+        # 每一根以最近 CHART_SR_LOOKBACK 根計算，最後一根即 /analyze 回傳的 support_resistance
+        sr = engine.support_resistance_series(CHART_SR_LOOKBACK, 3)
+        for kind in ("support", "resistance"):
+            for level in range(sr[kind].shape[1]):
+                series[f"{kind}{level + 1}"] = sr[kind][:, level]
+
+    sampled, idx = candles.downsample(max_points)
+    return {
+        "count": len(sampled),
+        "source_count": len(candles),
+        "downsampled": len(sampled) < len(candles),
+        "columns": sampled.to_columns(),
+        "overlays": {name: _column(np.asarray(values)[idx]) for name, values in series.items()},
+    }
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
 
 
 # 同步包裝器（用於非異步環境）
@@ -204,7 +355,15 @@ def generate_candlestick_chart_sync(
     symbol: str,
     interval: str,
     limit: int = 500,
-    save_path: str = None
+    save_path: str = None,
+    overlays=None,
 ):
     """同步版本的蠟燭圖生成"""
-    return asyncio.run(generate_candlestick_chart(symbol, interval, limit, save_path))
+    async def _run():
+        try:
+            return await generate_candlestick_chart(symbol, interval, limit, save_path, overlays)
+        finally:
+            # asyncio.run 結束後 loop 即關閉，共用 client 不能留到下一個 loop
+            await bybit_client.shutdown()
+            await chart_renderer.shutdown()
+    return asyncio.run(_run())
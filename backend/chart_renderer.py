@@ -0,0 +1,195 @@
+"""
+圖表渲染池 - 在常駐的子行程中以 kaleido 把 plotly figure 轉成 PNG
+
+fig.write_image 是同步呼叫，且第一次呼叫要啟動 kaleido（數秒），直接在 async handler 中執行會卡住
+整個 event loop。這裡以 ProcessPoolExecutor 維持 CHART_RENDER_WORKERS 個已預熱的渲染行程
+（initializer 先渲染一張小圖，讓 kaleido 在啟動時就緒）。呼叫端送出模組層級的渲染函式與參數（例如
+chart_generator 送出 K 線與指標設定），figure 的建立、序列化與渲染都在行程中進行，取回 PNG bytes。
+
+同時送進行程池的渲染數不超過行程數，其餘在 event loop 端排隊；新行程池（啟動或重建後）的行程預熱完成
+前也先等待，因此 CHART_RENDER_TIMEOUT 只計算行程實際渲染的時間，排隊與預熱不會造成逾時。等待中 + 進行中的渲染數超過 CHART_RENDER_WORKERS + CHART_RENDER_QUEUE_MAX
+時直接拒絕（RenderQueueFull）。渲染逾時拋出 asyncio.TimeoutError，並重建行程池（卡住的 kaleido 行程無法
+單獨中斷）；只有送出時的行程池仍是目前的行程池才重建，同一個舊行程池上的其他渲染改拋 RenderUnavailable，
+不會連環重建。CHART_RENDER_WORKERS=0 時改在執行緒中渲染（不使用子行程）。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 渲染行程數、超出行程數後還可排隊的渲染數、單次渲染逾時秒數（不含排隊）
+CHART_RENDER_WORKERS = max(0, int(os.getenv("CHART_RENDER_WORKERS", str(min(2, os.cpu_count() or 1)))))
+CHART_RENDER_QUEUE_MAX = max(0, int(os.getenv("CHART_RENDER_QUEUE_MAX", "16")))
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "20"))
+
+
+class RenderQueueFull(Exception):
+    """渲染佇列已滿，無法再接受新的圖表"""
+
+
+class RenderUnavailable(Exception):
+    """渲染中的行程池已被重建或關閉（工作隨之中斷），可稍後重試"""
+
+
+def _warm_worker() -> None:
+    """子行程 initializer：預先載入 plotly 並渲染一張小圖，讓 kaleido 啟動成本不落在第一個請求上"""
+    try:
+        _render_png('{"data": [], "layout": {}}', 10, 10)
+    except Exception as e:
+        # 預熱失敗不影響行程，真正渲染時會再回報錯誤
+        logging.getLogger(__name__).warning(f"Chart render worker warm-up failed: {e}")
+
+
+def _render_png(fig_json: str, width: int, height: int) -> bytes:
+    """在渲染行程（或執行緒）中執行：figure JSON 規格 → PNG bytes"""
+    import plotly.io as pio
+
+    return pio.from_json(fig_json, skip_invalid=True).to_image(format="png", width=width, height=height)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+# 同時送進行程池（或執行緒）的渲染數上限 = 行程數
+_slots: Optional[asyncio.Semaphore] = None
+# 目前行程池的預熱工作（每個行程一個 _ping），完成前不開始計算渲染逾時
+_warming: list = []
+_outstanding = 0
+_counters = {"rendered": 0, "failed": 0, "timeouts": 0, "rejected": 0, "restarts": 0}
+_latency = {"total": 0.0, "max": 0.0}
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    # 使用 spawn：父行程有多個執行緒（event loop、執行緒池），fork 可能複製到持有中的鎖
+    pool = ProcessPoolExecutor(
+        max_workers=CHART_RENDER_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_worker,
+    )
+    # 行程是用到時才建立的，先送出 no-op 讓所有行程立即啟動並預熱
+    _warming[:] = [pool.submit(_ping) for _ in range(CHART_RENDER_WORKERS)]
+    return pool
+
+
+async def _wait_warm(pool: ProcessPoolExecutor) -> None:
+    """等目前行程池的行程啟動並預熱完成（預熱本身也有 CHART_RENDER_TIMEOUT 上限）"""
+    pending = [f for f in _warming if not f.done()]
+    if pool is _pool and pending:
+        await asyncio.wait_for(
+            asyncio.gather(*(asyncio.wrap_future(f) for f in pending)), timeout=CHART_RENDER_TIMEOUT
+        )
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """放棄行程池：取消未開始的工作並終止行程（包括卡住的 kaleido）"""
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def _restart_pool() -> None:
+    global _pool
+    if _pool is None:
+        return
+    old, _pool = _pool, _new_pool()
+    _counters["restarts"] += 1
+    _discard_pool(old)
+
+
+async def startup() -> None:
+    global _pool
+    if _pool is None and CHART_RENDER_WORKERS > 0:
+        _pool = _new_pool()
+        logger.info(f"Chart render pool started ({CHART_RENDER_WORKERS} workers)")
+
+
+async def shutdown() -> None:
+    global _pool, _slots
+    _slots = None
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+async def render(fn, *args) -> bytes:
+    """
+    在渲染行程中執行 fn(*args) 並回傳結果（fn 須為模組層級函式，參數可 pickle）
+
+    佇列已滿時拋出 RenderQueueFull，逾時拋出 asyncio.TimeoutError，
+    行程池被重建或關閉時拋出 RenderUnavailable，渲染錯誤原樣拋出
+    """
+    global _outstanding, _slots
+    if _outstanding >= max(CHART_RENDER_WORKERS, 1) + CHART_RENDER_QUEUE_MAX:
+        _counters["rejected"] += 1
+        raise RenderQueueFull(f"圖表渲染佇列已滿（{CHART_RENDER_QUEUE_MAX}）")
+    if _pool is None and CHART_RENDER_WORKERS > 0:
+        await startup()
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(CHART_RENDER_WORKERS, 1))
+    loop = asyncio.get_running_loop()
+    _outstanding += 1
+    try:
+        async with _slots:
+            # 記下送出時的行程池：逾時或中斷時只在它仍是目前的行程池時才重建
+            pool = _pool
+            try:
+                if pool is None:
+                    started = time.monotonic()
+                    job = asyncio.to_thread(fn, *args)
+                else:
+                    await _wait_warm(pool)
+                    started = time.monotonic()
+                    job = loop.run_in_executor(pool, fn, *args)
+                result = await asyncio.wait_for(job, timeout=CHART_RENDER_TIMEOUT)
+            except asyncio.TimeoutError:
+                _counters["timeouts"] += 1
+                if pool is not None and pool is _pool:
+                    logger.warning(f"Chart render timed out (>{CHART_RENDER_TIMEOUT}s), restarting render pool")
+                    _restart_pool()
+                raise
+            except BrokenProcessPool:
+                _counters["failed"] += 1
+                if pool is _pool:
+                    logger.error("Chart render worker died, restarting render pool")
+                    _restart_pool()
+                raise RenderUnavailable("圖表渲染行程中斷，請稍後重試") from None
+            except asyncio.CancelledError:
+                # 呼叫端自己被取消，或行程池仍是目前的（不是被重建取消的）時原樣傳遞
+                if pool is None or pool is _pool or asyncio.current_task().cancelling():
+                    raise
+                _counters["failed"] += 1
+                raise RenderUnavailable("圖表渲染行程池已重建，請稍後重試") from None
+            except Exception:
+                _counters["failed"] += 1
+                raise
+    finally:
+        _outstanding -= 1
+    elapsed = time.monotonic() - started
+    _counters["rendered"] += 1
+    _latency["total"] += elapsed
+    _latency["max"] = max(_latency["max"], elapsed)
+    return result
+
+
+def stats() -> dict:
+    rendered = _counters["rendered"]
+    return {
+        **_counters,
+        "workers": CHART_RENDER_WORKERS,
+        "mode": "process" if CHART_RENDER_WORKERS > 0 else "thread",
+        "outstanding": _outstanding,
+        "queue_max": CHART_RENDER_QUEUE_MAX,
+        "timeout": CHART_RENDER_TIMEOUT,
+        "avg_latency": round(_latency["total"] / rendered, 3) if rendered else 0.0,
+        "max_latency": round(_latency["max"], 3),
+    }
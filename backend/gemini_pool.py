@@ -0,0 +1,143 @@
+"""
+Gemini model 池 - 每個 API key 一個已設定好的 model，跨請求重用
+
+genai.configure() 會修改 SDK 的全域設定，多個使用者以不同 key 並行請求時會互相覆蓋。
+這裡改為每個 key 建立自己的 GenerativeServiceClient 並指定給 model._client，
+不碰全域設定；池以 key 的 SHA-256 摘要為索引（不保存明文 key 作為索引），LRU 淘汰。
+每個 key 各自有並行上限與每分鐘請求數 / token 數配額（由 ai_scheduler 排隊放行）。
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from ai_scheduler import PRIORITY_NORMAL, KeyScheduler
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "models/gemini-2.5-flash")
+# 池中最多保留幾個 key 的 model、每個 key 同時進行的呼叫上限、
+# 每分鐘請求數 / token 數上限（0 代表不限制）
+GEMINI_POOL_MAX_KEYS = max(1, int(os.getenv("GEMINI_POOL_MAX_KEYS", "64")))
+GEMINI_KEY_MAX_CONCURRENCY = max(1, int(os.getenv("GEMINI_KEY_MAX_CONCURRENCY", "4")))
+GEMINI_KEY_RPM = float(os.getenv("GEMINI_KEY_RPM", "15"))
+GEMINI_KEY_TPM = float(os.getenv("GEMINI_KEY_TPM", "250000"))
+
+
+def key_id(api_key: str) -> str:
+    """API key 的摘要（用於索引與記錄，不洩漏明文 key）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class KeyedModel:
+    """
+    一個 API key 專用的 Gemini model，附帶該 key 的配額排程器（見 ai_scheduler）
+
+    generate_content 直接轉給底層 model（在 worker 執行緒中呼叫）；
+    呼叫前須在 event loop 中 await acquire(priority, tokens)，結束後 release()。
+    """
+
+    def __init__(self, key_id: str, model):
+        self.key_id = key_id
+        self.model = model
+        self.model_name = getattr(model, "model_name", GEMINI_MODEL_NAME)
+        self.scheduler = KeyScheduler(GEMINI_KEY_RPM, GEMINI_KEY_TPM, GEMINI_KEY_MAX_CONCURRENCY)
+
+    def generate_content(self, *args, **kwargs):
+        return self.model.generate_content(*args, **kwargs)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, tokens: int = 0) -> float:
+        return await self.scheduler.acquire(priority, tokens)
+
+    def release(self) -> None:
+        self.scheduler.release()
+
+    def penalize(self, seconds: float) -> None:
+        self.scheduler.penalize(seconds)
+
+    def stats(self) -> dict:
+        return self.scheduler.stats()
+
+
+def _make_model(api_key: str):
+    """
+    建立只使用這個 key 的 model（獨立的 client，不呼叫 genai.configure）
+
+    SDK 沒有公開的「每個 model 指定 client」介面，這裡依賴 google-generativeai 的內部實作：
+    client._ClientManager 與 GenerativeModel._client（generate_content 在 _client 為 None 時才取全域 client）。
+    版本固定在 requirements.txt，tests/test_gemini_pool.py 會在內部介面消失時失敗。
+    """
+    if not hasattr(genai_client, "_ClientManager"):
+        raise RuntimeError(f"google-generativeai {genai.__version__} 沒有 client._ClientManager，請使用 requirements.txt 固定的版本")
+    manager = genai_client._ClientManager()
+    manager.configure(api_key=api_key)
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    model._client = manager.make_client("generative")
+    return model
+
+
+class ModelPool:
+    """以 key 摘要索引的 KeyedModel LRU 池"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._models: "OrderedDict[str, KeyedModel]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key: str) -> Optional[KeyedModel]:
+        """取得（或建立）此 key 的 model；建立失敗時回傳 None"""
+        api_key = (api_key or "").strip()
+        if not api_key:
+            return None
+        kid = key_id(api_key)
+        model = self._models.get(kid)
+        if model is not None:
+            self._models.move_to_end(kid)
+            self.hits += 1
+            return model
+        self.misses += 1
+        try:
+            model = KeyedModel(kid, _make_model(api_key))
+        except Exception as e:
+            logger.warning(f"Gemini model 建立失敗（key {kid}）: {e}")
+            return None
+        self._models[kid] = model
+        while len(self._models) > self.max_keys:
+            # 被淘汰的 model 若仍有進行中的呼叫，呼叫端持有參照，可正常完成
+            self._models.popitem(last=False)
+            self.evictions += 1
+        logger.info(f"Gemini model 已建立（key {kid}）")
+        return model
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "keys": len(self._models),
+            "max_keys": self.max_keys,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "per_key_max_concurrency": GEMINI_KEY_MAX_CONCURRENCY,
+            "per_key_rpm": GEMINI_KEY_RPM,
+            "per_key_tpm": GEMINI_KEY_TPM,
+            "queue_depth": sum(m.scheduler.stats()["queue_depth"] for m in self._models.values()),
+            "by_key": {kid: m.stats() for kid, m in self._models.items()},
+        }
+
+
+_pool = ModelPool(GEMINI_POOL_MAX_KEYS)
+
+
+def get_model(api_key: str) -> Optional[KeyedModel]:
+    return _pool.get(api_key)
+
+
+def stats() -> dict:
+    return _pool.stats()
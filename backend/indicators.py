@@ -0,0 +1,470 @@
+"""
+技術指標模組（純 numpy，不依賴 talib）
+
+所有指數平滑（EMA、MACD、RSI 與 ATR 的 Wilder smoothing）共用同一個向量化核心 ewm_filter，
+可處理 1-D 序列，也可處理 2-D（多個幣種 × 時間）陣列，沿最後一軸計算。
+"""
+import math
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+
+
+def ewm_filter(x, alpha: float, seed) -> np.ndarray:
+    """
+    一階遞迴濾波 y[..., i] = (1 - alpha) * y[..., i-1] + alpha * x[..., i]，y[..., -1] = seed
+
+    x 可為 1-D 或 2-D（每列一個序列），seed 為純量或每列一個值。
+    以分塊閉式解向量化：每塊長度 C 內用 cumsum 算出局部解，
+    再由 _chunk_carries 算出每塊開頭承接的值。C 取 (1-alpha)^C >= 1e-3，讓 (1-alpha)^-j 的縮放不致損失精度。
+    """
+    x = np.asarray(x, dtype=float)
+    one_d = x.ndim == 1
+    x2 = x.reshape(1, -1) if one_d else x
+    rows, n = x2.shape
+    if n == 0:
+        return np.empty_like(x)
+    beta = 1.0 - alpha
+    if beta <= 0:
+        return x.copy()
+    chunk = int(max(1, min(n, math.log(1e-3) / math.log(beta))))
+    pad = (-n) % chunk
+    if pad:
+        x2 = np.concatenate([x2, np.zeros((rows, pad))], axis=1)
+    xp = x2.reshape(rows, -1, chunk)
+    k = np.arange(chunk)
+    # local[r, i, k] = alpha * sum_{j<=k} beta^(k-j) * x[r, i, j]
+    local = alpha * np.cumsum(xp * beta ** -k, axis=-1) * beta ** k
+    decay = beta ** (k + 1)
+    carries = _chunk_carries(local[:, :, -1], float(decay[-1]), seed)
+    y = (local + decay * carries[:, :, None]).reshape(rows, -1)[:, :n]
+    return y[0] if one_d else y
+
+
+def _chunk_carries(last: np.ndarray, d: float, seed) -> np.ndarray:
+    """
+    各塊開頭的 carry：c[:, 0] = seed，c[:, i] = d * c[:, i-1] + last[:, i-1]
+
+    d = (1-alpha)^C 很小，展開後 d^t 項很快低於浮點精度，
+    只需累加前幾項位移後的 last 即可，不必逐塊迴圈。
+    """
+    rows, n_chunks = last.shape
+    seed = np.broadcast_to(np.asarray(seed, dtype=float), (rows,))
+    carries = seed[:, None] * d ** np.arange(n_chunks)
+    terms = n_chunks - 1 if d <= 0 else min(n_chunks - 1, int(math.ceil(math.log(1e-18) / math.log(d))) + 1)
+    for t in range(terms):
+        carries[:, t + 1:] += d ** t * last[:, :n_chunks - 1 - t]
+    return carries
+
+
+def ema(x, period: int) -> np.ndarray:
+    """EMA（k = 2 / (period + 1)），以第一個元素作為 seed；沿最後一軸計算"""
+    x = np.asarray(x, dtype=float)
+    if x.shape[-1] == 0:
+        return x.copy()
+    out = np.empty_like(x)
+    out[..., 0] = x[..., 0]
+    out[..., 1:] = ewm_filter(x[..., 1:], 2 / (period + 1), x[..., 0])
+    return out
+
+
+def wilder(x, period: int) -> np.ndarray:
+    """Wilder smoothing（k = 1 / period），以第一個元素作為 seed；沿最後一軸計算"""
+    x = np.asarray(x, dtype=float)
+    if x.shape[-1] == 0:
+        return x.copy()
+    out = np.empty_like(x)
+    out[..., 0] = x[..., 0]
+    out[..., 1:] = ewm_filter(x[..., 1:], 1 / period, x[..., 0])
+    return out
+
+
+def ma_series(data, period: int) -> np.ndarray:
+    """返回與 data 相同長度的移動平均（leading 用第一個有效值填補）；沿最後一軸計算"""
+    x = np.asarray(data, dtype=float)
+    n = x.shape[-1]
+    if n == 0:
+        return x.copy()
+    if n < period:
+        # 若資料不足，回傳 copy 的原價（避免 null）
+        return x.copy()
+    ma_valid = np.lib.stride_tricks.sliding_window_view(x, period, axis=-1).mean(axis=-1)
+    # pad 前面的 (period-1) 個值，使用第一個有效 ma 值填補
+    pads = np.repeat(ma_valid[..., :1], period - 1, axis=-1)
+    return np.concatenate([pads, ma_valid], axis=-1)
+
+
+def bollinger_bands(data, period: int = 20, num_std: float = 2.0):
+    """
+    布林通道，回傳 (中線, 上軌, 下軌)，皆與 data 等長；沿最後一軸計算
+
+    中線即 ma_series，標準差採母體標準差；leading 的填補方式與 ma_series 相同
+    （資料不足 period 時三條線皆為原價）。
+    """
+    x = np.asarray(data, dtype=float)
+    mid = ma_series(x, period)
+    if x.shape[-1] < period:
+        return mid, x.copy(), x.copy()
+    sd_valid = np.lib.stride_tricks.sliding_window_view(x, period, axis=-1).std(axis=-1)
+    sd = np.concatenate([np.repeat(sd_valid[..., :1], period - 1, axis=-1), sd_valid], axis=-1)
+    return mid, mid + num_std * sd, mid - num_std * sd
+
+
+def rsi_from_deltas(deltas, period: int = 14) -> np.ndarray:
+    """
+    由價格差分計算 RSI，回傳長度 len(deltas) + 1（前面 period 個值用第一個有效 RSI 填補）
+
+    呼叫端須保證 len(deltas) >= period；沿最後一軸計算。
+    """
+    deltas = np.asarray(deltas, dtype=float)
+    seed = deltas[..., :period]
+    up = np.where(seed > 0, seed, 0.0).sum(axis=-1) / period
+    down = -np.where(seed < 0, seed, 0.0).sum(axis=-1) / period
+    rest = deltas[..., period:]
+    up_ema = np.concatenate(
+        [up[..., None], ewm_filter(np.maximum(rest, 0.0), 1 / period, up)], axis=-1
+    )
+    down_ema = np.concatenate(
+        [down[..., None], ewm_filter(np.maximum(-rest, 0.0), 1 / period, down)], axis=-1
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(down_ema != 0, 100 - 100 / (1 + up_ema / down_ema), 100.0)
+    return np.concatenate([np.repeat(rsi[..., :1], period, axis=-1), rsi], axis=-1)
+
+
+def compute_rsi(data, period: int = 14) -> np.ndarray:
+    """RSI（Wilder smoothing），回傳與 data 相同長度的 ndarray（前面用第一個有效 RSI 填補）"""
+    prices = np.asarray(data, dtype=float)
+    if prices.shape[-1] == 0:
+        return prices.copy()
+    deltas = np.diff(prices, axis=-1)
+    if deltas.shape[-1] < period:
+        # 不足則回傳價格（避免 null）
+        return prices.copy()
+    return rsi_from_deltas(deltas, period)
+
+
+def macd_from_emas(ema_short, ema_long, signal: int = 9):
+    """由長短 EMA 計算 MACD 與 signal 線"""
+    macd = np.asarray(ema_short) - np.asarray(ema_long)
+    return macd, ema(macd, signal)
+
+
+def compute_macd(data, short: int = 12, long: int = 26, signal: int = 9):
+    """計算 MACD 與 signal，回傳兩個與 data 相同長度的陣列"""
+    prices = np.asarray(data, dtype=float)
+    if prices.shape[-1] == 0:
+        return prices.copy(), prices.copy()
+    return macd_from_emas(ema(prices, short), ema(prices, long), signal)
+
+
+def ema_series(data, period: int) -> np.ndarray:
+    """計算 EMA 序列（與輸入等長），初始值用第一個元素作為 seed"""
+    return ema(data, period)
+
+
+def true_range(highs, lows, closes) -> np.ndarray:
+    """True Range：max(h - l, |h - 前收|, |l - 前收|)，第一根以自身收盤作為前收"""
+    h = np.asarray(highs, dtype=float)
+    l = np.asarray(lows, dtype=float)
+    c = np.asarray(closes, dtype=float)
+    if c.shape[-1] == 0:
+        return c.copy()
+    prev_close = np.concatenate([c[..., :1], c[..., :-1]], axis=-1)
+    return np.maximum(h - l, np.maximum(np.abs(h - prev_close), np.abs(l - prev_close)))
+
+
+def atr_series(highs, lows, closes, period: int = 14) -> np.ndarray:
+    """計算 ATR（Average True Range，Wilder smoothing），回傳與輸入等長"""
+    return wilder(true_range(highs, lows, closes), period)
+
+
+def volatility_pct(closes, period: int = 14) -> float:
+    """回傳最近 period 的年化波動性百分比（近似）"""
+    if len(closes) < 2:
+        return 0.0
+    arr = np.asarray(closes[-period:], dtype=float)
+    logrets = np.diff(np.log(arr + 1e-12))
+    if len(logrets) < 2:
+        return 0.0
+    sd = float(np.std(logrets, ddof=1))
+    # daily-ish to annualize: 假設 timeframe 可視為日級別視為 sqrt(252)，若 intraday 則此為近似
+    annualized = sd * math.sqrt(252)
+    return annualized * 100
+
+
+def support_resistance_simple(prices, lookback: int = 50, levels: int = 3) -> dict:
+    """簡單地找出最近 lookback 範圍內的高低 percentile 作為阻力/支撐"""
+    if len(prices) == 0:
+        return {"support": [], "resistance": []}
+    arr = np.asarray(prices[-lookback:], dtype=float)
+    # 支撐取 10%/25%/40% 百分位，阻力取 60%/75%/90%
+    supports = np.percentile(arr, [10, 25, 40]).tolist()
+    resistances = np.percentile(arr, [60, 75, 90]).tolist()
+    return {"support": supports[-levels:], "resistance": resistances[-levels:]}
+
+
+class RollingPercentile:
+    """
+    滑動視窗百分位數：以排序好的視窗（bisect）維護最近 window 個值
+
+    每次更新以二分搜尋找到插入/移除位置（O(log w) 比較，加上 list 的區塊搬移），
+    不必像 np.percentile 每根都重新排序整個視窗。
+    百分位數採用與 np.percentile 預設（linear）相同的插值公式，結果逐位元相同。
+    """
+
+    def __init__(self, window: int, percentiles):
+        self.window = window
+        self.quantiles = [q / 100 for q in percentiles]
+        self._values: deque = deque()
+        self._sorted: list = []
+        self.count = 0
+
+    def update(self, x, replace: bool = False) -> list:
+        x = float(x)
+        if replace and self._values:
+            old = self._values[-1]
+            del self._sorted[bisect_left(self._sorted, old)]
+            self._values[-1] = x
+        else:
+            self._values.append(x)
+            self.count += 1
+            if len(self._values) > self.window:
+                old = self._values.popleft()
+                del self._sorted[bisect_left(self._sorted, old)]
+        insort(self._sorted, x)
+        return self.value
+
+    @property
+    def value(self) -> list:
+        s = self._sorted
+        n = len(s)
+        if not n:
+            return []
+        out = []
+        for q in self.quantiles:
+            idx = (n - 1) * q
+            lo = math.floor(idx)
+            if idx >= n - 1:
+                out.append(s[-1])
+                continue
+            a, b = s[lo], s[lo + 1]
+            t = idx - lo
+            diff = b - a
+            out.append(b - diff * (1 - t) if t >= 0.5 else a + diff * t)
+        return out
+
+
+def rolling_support_resistance(prices, lookback: int = 50, levels: int = 3) -> dict:
+    """
+    每一根的支撐/阻力（與 support_resistance_simple 在該根所得結果相同），一次掃描完成
+
+    回傳 {"support": (n, levels) 陣列, "resistance": (n, levels) 陣列}；
+    以 RollingPercentile 的排序視窗逐根更新，不必每根重新排序。
+    """
+    arr = np.asarray(prices, dtype=float)
+    qs = [10, 25, 40, 60, 75, 90]
+    rolling = RollingPercentile(lookback, qs)
+    out = np.array([rolling.update(x) for x in arr.tolist()], dtype=float).reshape(len(arr), len(qs))
+    return {"support": out[:, :3][:, -levels:], "resistance": out[:, 3:][:, -levels:]}
+
+
+def trend_from_emas(ema_short, ema_long) -> str:
+    """用長短 EMA 交叉判斷趨勢：短 EMA 在長 EMA 上方 => 上升，反之下跌，否則中性"""
+    if ema_short[-1] > ema_long[-1] and ema_short[-2] <= ema_long[-2]:
+        return "上升"
+    if ema_short[-1] < ema_long[-1] and ema_short[-2] >= ema_long[-2]:
+        return "下跌"
+    # 若兩者差距顯著則也視為趨勢
+    diff = (ema_short[-1] - ema_long[-1]) / (ema_long[-1] + 1e-9)
+    if diff > 0.02:
+        return "上升"
+    if diff < -0.02:
+        return "下跌"
+    return "中性"
+
+
+def detect_trend_via_ema(closes) -> str:
+    """用 EMA12 / EMA26 交叉判斷趨勢（資料不足 26 根時為中性）"""
+    if len(closes) < 26:
+        return "中性"
+    return trend_from_emas(ema(closes, 12), ema(closes, 26))
+
+
+class IndicatorEngine:
+    """
+    對單一組 Candles 計算指標的引擎
+
+    每個指標以 (名稱, 參數) 記憶化；指標之間的依賴（MACD 依賴 EMA12/EMA26、
+    RSI 依賴價格差分、ATR 依賴 True Range、趨勢判斷依賴 EMA12/EMA26）
+    透過呼叫其他方法自動解析，同一次分析中共用的中間結果只計算一次。
+    """
+
+    def __init__(self, candles):
+        self.candles = candles
+        self.closes = np.asarray(candles.close, dtype=float)
+        self._memo: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.closes)
+
+    def _cached(self, key, fn):
+        if key not in self._memo:
+            self._memo[key] = fn()
+        return self._memo[key]
+
+    def ema(self, period: int) -> np.ndarray:
+        return self._cached(("ema", period), lambda: ema(self.closes, period))
+
+    def ma(self, period: int) -> np.ndarray:
+        return self._cached(("ma", period), lambda: ma_series(self.closes, period))
+
+    def deltas(self) -> np.ndarray:
+        return self._cached(("deltas",), lambda: np.diff(self.closes))
+
+    def rsi(self, period: int = 14) -> np.ndarray:
+        def _rsi():
+            d = self.deltas()
+            if len(d) < period:
+                # 不足則回傳價格（與 compute_rsi 相同）
+                return self.closes.copy()
+            return rsi_from_deltas(d, period)
+        return self._cached(("rsi", period), _rsi)
+
+    def macd(self, short: int = 12, long: int = 26, signal: int = 9):
+        """回傳 (macd, signal)"""
+        return self._cached(
+            ("macd", short, long, signal),
+            lambda: macd_from_emas(self.ema(short), self.ema(long), signal),
+        )
+
+    def bollinger(self, period: int = 20, num_std: float = 2.0):
+        """回傳 (中線, 上軌, 下軌)"""
+        return self._cached(("bollinger", period, num_std), lambda: bollinger_bands(self.closes, period, num_std))
+
+    def true_range(self) -> np.ndarray:
+        c = self.candles
+        return self._cached(("true_range",), lambda: true_range(c.high, c.low, c.close))
+
+    def atr(self, period: int = 14) -> np.ndarray:
+        return self._cached(("atr", period), lambda: wilder(self.true_range(), period))
+
+    def volatility_pct(self, period: int = 14) -> float:
+        return self._cached(("volatility_pct", period), lambda: volatility_pct(self.closes, period))
+
+    def support_resistance(self, lookback: int = 50, levels: int = 3) -> dict:
+        return self._cached(
+            ("support_resistance", lookback, levels),
+            lambda: support_resistance_simple(self.closes, lookback, levels),
+        )
+
+    def support_resistance_series(self, lookback: int = 50, levels: int = 3) -> dict:
+        """每一根的支撐/阻力（rolling_support_resistance）"""
+        return self._cached(
+            ("support_resistance_series", lookback, levels),
+            lambda: rolling_support_resistance(self.closes, lookback, levels),
+        )
+
+    def trend(self) -> str:
+        def _trend():
+            if len(self.closes) < 26:
+                return "中性"
+            return trend_from_emas(self.ema(12), self.ema(26))
+        return self._cached(("trend",), _trend)
+
+    def snapshot(self, fields=None) -> dict:
+        """
+        最後一根的指標快照（欄位與 analyze_one_coin 回傳的 indicators 相同）；
+        fields 可指定只計算部分欄位
+        """
+        names = SNAPSHOT_FIELDS if fields is None else fields
+        return {name: SNAPSHOT_FIELDS[name](self) for name in names}
+
+
+def _last(arr):
+    return float(arr[-1]) if len(arr) else None
+
+
+# 快照欄位 -> 計算方式（依賴的中間結果由 IndicatorEngine 記憶化共用）
+SNAPSHOT_FIELDS = {
+    "last_price": lambda e: float(e.closes[-1]),
+    "ma7": lambda e: _last(e.ma(7)),
+    "ma25": lambda e: _last(e.ma(25)),
+    "ema12": lambda e: _last(e.ema(12)),
+    "ema26": lambda e: _last(e.ema(26)),
+    "rsi14": lambda e: float(e.rsi(14)[-1]),
+    "macd": lambda e: _last(e.macd(12, 26, 9)[0]),
+    "signal": lambda e: _last(e.macd(12, 26, 9)[1]),
+    "atr": lambda e: float(e.atr(14)[-1]),
+    "volatility_pct": lambda e: float(e.volatility_pct(14)),
+}
+
+
+class BatchIndicatorEngine:
+    """
+    多幣種批次計算：把等長的 Candles 疊成 (幣種 × 時間) 的 2-D 陣列，
+    每個指標對整組只做一次向量化計算，再拆成各幣種的 IndicatorEngine（記憶化結果已預先填入）
+
+    拆出來的 engine 與單獨建立的 IndicatorEngine 用法相同，未預先計算的指標仍會按需計算。
+    長度不同的 Candles 依長度分組，各組分別計算。
+    """
+
+    def __init__(self, candles_list):
+        self.candles_list = list(candles_list)
+
+    def engines(self, sr_lookback: int = 200, sr_levels: int = 3) -> list:
+        """回傳與輸入順序相同的 IndicatorEngine 列表"""
+        engines = [IndicatorEngine(c) for c in self.candles_list]
+        groups: dict[int, list[int]] = {}
+        for i, e in enumerate(engines):
+            if len(e):
+                groups.setdefault(len(e), []).append(i)
+        for n, idx in groups.items():
+            self._fill([engines[i] for i in idx], min(sr_lookback, n), sr_levels)
+        return engines
+
+    @staticmethod
+    def _fill(engines: list, sr_lookback: int, sr_levels: int) -> None:
+        closes = np.stack([e.closes for e in engines])
+        highs = np.stack([np.asarray(e.candles.high, dtype=float) for e in engines])
+        lows = np.stack([np.asarray(e.candles.low, dtype=float) for e in engines])
+
+        ema12, ema26 = ema(closes, 12), ema(closes, 26)
+        macd, signal = macd_from_emas(ema12, ema26, 9)
+        deltas = np.diff(closes, axis=-1)
+        rsi = rsi_from_deltas(deltas, 14) if deltas.shape[-1] >= 14 else closes.copy()
+        tr = true_range(highs, lows, closes)
+        atr = wilder(tr, 14)
+        vol = _batch_volatility_pct(closes, 14)
+        window = closes[:, -sr_lookback:]
+        supports = np.percentile(window, [10, 25, 40], axis=-1).T
+        resistances = np.percentile(window, [60, 75, 90], axis=-1).T
+        computed = {
+            ("ema", 12): ema12,
+            ("ema", 26): ema26,
+            ("ma", 7): ma_series(closes, 7),
+            ("ma", 25): ma_series(closes, 25),
+            ("deltas",): deltas,
+            ("rsi", 14): rsi,
+            ("true_range",): tr,
+            ("atr", 14): atr,
+        }
+        for row, e in enumerate(engines):
+            for key, arr in computed.items():
+                e._memo[key] = arr[row]
+            e._memo[("macd", 12, 26, 9)] = (macd[row], signal[row])
+            e._memo[("volatility_pct", 14)] = float(vol[row])
+            e._memo[("support_resistance", sr_lookback, sr_levels)] = {
+                "support": supports[row].tolist()[-sr_levels:],
+                "resistance": resistances[row].tolist()[-sr_levels:],
+            }
+
+
+def _batch_volatility_pct(closes: np.ndarray, period: int = 14) -> np.ndarray:
+    """volatility_pct 的 2-D 版本，每列一個值"""
+    arr = closes[:, -period:]
+    if arr.shape[-1] < 3:
+        return np.zeros(len(closes))
+    logrets = np.diff(np.log(arr + 1e-12), axis=-1)
+    return np.std(logrets, axis=-1, ddof=1) * math.sqrt(252) * 100
@@ -1,16 +1,23 @@
 # main.py
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, Request
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import httpx
-import numpy as np
-import math
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import logging
-from chart_generator import generate_candlestick_chart
+from chart_generator import build_chart_data, render_candlestick_png
+import ai_jobs
+import ai_service
+from ai_scheduler import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, Overloaded, priority_of
+import gemini_pool
+import bybit_client
+import chart_cache
+import chart_renderer
+import market_data
+from market_data import Candles
+from indicators import BatchIndicatorEngine, IndicatorEngine
 import os
-from datetime import datetime
-import google.generativeai as genai
 import json
 from dotenv import load_dotenv
 
@@ -30,24 +37,42 @@ is_valid_key = (
 )
 
 if is_valid_key:
-    try:
-        genai.configure(api_key=gemini_api_key)
-        # 使用最新的 Gemini 2.5 Flash 模型
-        gemini_model = genai.GenerativeModel("models/gemini-2.5-flash")
+    # 伺服器預設 key 的 model 也放在 gemini_pool 中（不修改 SDK 全域設定）
+    gemini_model = gemini_pool.get_model(gemini_api_key)
+    if gemini_model:
         logging.info("✓ Google Gemini API 已配置 - AI 深度分析功能已啟用")
-    except Exception as e:
-        logging.warning(f"⚠ Gemini API 初始化失敗: {e}")
-        logging.warning("⚠ AI 深度分析功能暫時無法使用")
-        gemini_model = None
+    else:
+        logging.warning("⚠ Gemini API 初始化失敗，AI 深度分析功能暫時無法使用")
 else:
     logging.info("ℹ Gemini API key 未設置或無效 - AI 深度分析功能已禁用（可選功能）")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """啟動時建立共用資源，關閉時釋放"""
+    await bybit_client.startup()
+    await market_data.startup()
+    await ai_service.startup()
+    await ai_jobs.startup()
+    await chart_cache.startup()
+    await chart_renderer.startup()
+    try:
+        yield
+    finally:
+        await chart_renderer.shutdown()
+        await chart_cache.shutdown()
+        await ai_jobs.shutdown()
+        await ai_service.shutdown()
+        await market_data.shutdown()
+        await bybit_client.shutdown()
+
+
 app = FastAPI(
     title="加密貨幣 AI 投資分析系統",
     description="後端 API - 提供技術分析、AI 深度分析與圖表生成功能",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS（允許本機開發前端呼叫）
@@ -67,233 +92,16 @@ INTERVAL_MAP = {
     "1d": "D",
 }
 
-# ====== 技術指標實作（純 numpy，不依賴 talib） ======
-
-def ma_series(data: list[float], period: int) -> list[float]:
-    """返回與 data 相同長度的移動平均（leading 用第一個有效值填補）"""
-    x = np.array(data, dtype=float)
-    if len(x) == 0:
-        return []
-    if len(x) < period:
-        # 若資料不足，回傳 copy 的原價（避免 null）
-        return x.tolist()
-    # 使用卷積計算 simple MA
-    kernel = np.ones(period) / period
-    ma_valid = np.convolve(x, kernel, mode="valid")  # 長度 len(x)-period+1
-    # pad 前面的 (period-1) 個值，使用第一個有效 ma 值填補
-    pad_val = float(ma_valid[0])
-    pads = np.full(period - 1, pad_val)
-    ma_full = np.concatenate([pads, ma_valid])
-    return ma_full.tolist()
-
-def compute_rsi(data: list[float], period: int = 14) -> list[float]:
-    """簡單的 RSI 計算，回傳與 data 相同長度（前面用第一個有效 RSI 填補）"""
-    prices = np.array(data, dtype=float)
-    if len(prices) == 0:
-        return []
-    deltas = np.diff(prices)
-    if len(deltas) < period:
-        # 不足則回傳價格（避免 null）
-        return prices.tolist()
-    seed = deltas[:period]
-    up = seed[seed > 0].sum() / period
-    down = -seed[seed < 0].sum() / period
-    rs = up / down if down != 0 else np.inf
-    first_rsi = 100 - 100 / (1 + rs) if not math.isinf(rs) else 100.0
-    rsi_list = [first_rsi]
-    up_ema = up
-    down_ema = down
-    for d in deltas[period:]:
-        gain = max(d, 0)
-        loss = -min(d, 0)
-        up_ema = (up_ema * (period - 1) + gain) / period
-        down_ema = (down_ema * (period - 1) + loss) / period
-        rs = up_ema / down_ema if down_ema != 0 else np.inf
-        r = 100 - 100 / (1 + rs) if not math.isinf(rs) else 100.0
-        rsi_list.append(r)
-    # rsi_list 長度 = len(deltas) - period +1
-    # pad 前面 period 個值用 first_rsi
-    pad = [first_rsi] * period
-    rsi_full = pad + rsi_list
-    # 若因任何原因長度錯誤，調整
-    if len(rsi_full) < len(prices):
-        # pad tail
-        rsi_full = rsi_full + [rsi_full[-1]] * (len(prices) - len(rsi_full))
-    elif len(rsi_full) > len(prices):
-        rsi_full = rsi_full[-len(prices):]
-    return [float(x) for x in rsi_full]
-
-def compute_macd(data: list[float], short: int = 12, long: int = 26, signal: int = 9):
-    """計算 MACD 與 signal，回傳兩個與 data 相同長度的陣列（前面用 0 填補）"""
-    prices = np.array(data, dtype=float)
-    n = len(prices)
-    if n == 0:
-        return [], []
-    # EMA 用公式逐步計算
-    def ema(series, period):
-        res = np.zeros(len(series))
-        k = 2 / (period + 1)
-        res[0] = series[0]
-        for i in range(1, len(series)):
-            res[i] = series[i] * k + res[i - 1] * (1 - k)
-        return res
-    if n < 1:
-        return [0.0] * n, [0.0] * n
-    ema_short = ema(prices, short)
-    ema_long = ema(prices, long)
-    macd = ema_short - ema_long
-    signal_line = ema(macd, signal)
-    return macd.tolist(), signal_line.tolist()
-
-
-def ema_series(data: list[float], period: int) -> list[float]:
-    """計算 EMA 序列（與輸入等長），初始值用第一個元素作為 seed"""
-    if not data:
-        return []
-    res = [0.0] * len(data)
-    k = 2 / (period + 1)
-    res[0] = float(data[0])
-    for i in range(1, len(data)):
-        res[i] = float(data[i]) * k + res[i - 1] * (1 - k)
-    return res
-
-
-def atr_series(highs: list[float], lows: list[float], closes: list[float], period: int = 14) -> list[float]:
-    """計算 ATR（Average True Range），回傳與輸入等長"""
-    n = len(closes)
-    if n == 0:
-        return []
-    tr = [0.0] * n
-    for i in range(n):
-        h = highs[i]
-        l = lows[i]
-        if i == 0:
-            prev_close = closes[0]
-        else:
-            prev_close = closes[i - 1]
-        tr[i] = max(h - l, abs(h - prev_close), abs(l - prev_close))
-    # ATR 使用 Wilder smoothing (EMA with k=1/period)
-    atr = [0.0] * n
-    atr[0] = tr[0]
-    alpha = 1 / period
-    for i in range(1, n):
-        atr[i] = (atr[i - 1] * (period - 1) + tr[i]) / period
-    return atr
-
-
-def volatility_pct(closes: list[float], period: int = 14) -> float:
-    """回傳最近 period 的年化波動性百分比（近似）"""
-    if not closes or len(closes) < 2:
-        return 0.0
-    import math
-    arr = np.array(closes[-period:], dtype=float)
-    logrets = np.diff(np.log(arr + 1e-12))
-    if len(logrets) < 2:
-        return 0.0
-    sd = float(np.std(logrets, ddof=1))
-    # daily-ish to annualize: 假設 timeframe 可視為日級別視為 sqrt(252)，若 intraday 則此為近似
-    annualized = sd * math.sqrt(252)
-    return annualized * 100
-
-
-def support_resistance_simple(prices: list[float], lookback: int = 50, levels: int = 3) -> dict:
-    """簡單地找出最近 lookback 範圍內的高低 percentile 作為阻力/支撐"""
-    if not prices:
-        return {"support": [], "resistance": []}
-    arr = np.array(prices[-lookback:], dtype=float)
-    # 支撐取 10%/25%/40% 百分位，阻力取 60%/75%/90%
-    supports = np.percentile(arr, [10, 25, 40]).tolist()
-    resistances = np.percentile(arr, [60, 75, 90]).tolist()
-    return {"support": supports[-levels:], "resistance": resistances[-levels:]}
-
-
-def detect_trend_via_ema(closes: list[float]) -> str:
-    """用長短 EMA 交叉判斷趨勢：短 EMA 在長 EMA 上方 => 上升，反之下跌，否則中性"""
-    if not closes or len(closes) < 26:
-        return "中性"
-    ema_short = ema_series(closes, 12)
-    ema_long = ema_series(closes, 26)
-    if ema_short[-1] > ema_long[-1] and ema_short[-2] <= ema_long[-2]:
-        return "上升"
-    if ema_short[-1] < ema_long[-1] and ema_short[-2] >= ema_long[-2]:
-        return "下跌"
-    # 若兩者差距顯著則也視為趨勢
-    diff = (ema_short[-1] - ema_long[-1]) / (ema_long[-1] + 1e-9)
-    if diff > 0.02:
-        return "上升"
-    if diff < -0.02:
-        return "下跌"
-    return "中性"
-
-
-# ====== AI 分析函式（使用 Gemini，由用戶自行提供 API key） ======
-
-def generate_ai_analysis(
-    coin: str,
-    last_price: float,
-    indicators: dict,
-    trend: str,
-    support_resistance: dict,
-    rationale: list[str],
-    action: str,
-    risk: str,
-) -> Optional[str]:
-    """調用 Google Gemini 生成分析（用戶需自行提供 API key）"""
-    
-    # 若未配置 API key，返回 None（前端會隱藏 AI 區塊）
-    if not gemini_model:
-        return None
-    
-    prompt = f"""You are a professional crypto analyst. Provide investment advice based on:
-
-MARKET DATA:
-- Current Price: ${last_price:.2f}
-- Trend: {trend}
-- Risk Preference: {risk} (low=conservative, medium=neutral, high=aggressive)
-
-TECHNICAL INDICATORS:
-- RSI(14): {indicators.get('rsi14', 'N/A')}
-- MACD: {indicators.get('macd', 'N/A')}
-- Signal: {indicators.get('signal', 'N/A')}
-- ATR: {indicators.get('atr', 'N/A')}
-- Volatility: {indicators.get('volatility_pct', 'N/A')}%
-- MA(7): {indicators.get('ma7', 'N/A')}
-- MA(25): {indicators.get('ma25', 'N/A')}
-
-SUPPORT & RESISTANCE:
-- Support: {support_resistance.get('support', [])}
-- Resistance: {support_resistance.get('resistance', [])}
-
-TECHNICAL ASSESSMENT:
-{'; '.join(rationale)}
-
-RECOMMENDATION:
-{action}
-
-Please provide concise, practical advice (5 points):
-1. Market analysis (2-3 sentences): Current state and key signals
-2. Entry strategy: Suggested entry prices and batch allocation based on risk preference
-3. Risk management: Suggested stop-loss and profit targets
-4. Risk warnings: Main current risk factors
-5. Follow-up points: Key levels or indicator changes to monitor
-
-Be concise and actionable. Answer in Traditional Chinese."""
-    
-    try:
-        response = gemini_model.generate_content(prompt)
-        ai_text = response.text
-        logging.info(f"{coin} AI analysis completed successfully")
-        return ai_text
-    except Exception as e:
-        error_msg = str(e)
-        logging.exception(f"{coin} AI analysis failed")
-        # 詳細記錄錯誤以便用戶調試
-        if "429" in error_msg or "quota" in error_msg.lower():
-            return f"[配額已滿] API 配額已達上限。請在 24 小時後重試或升級付費方案。"
-        elif "invalid_api_key" in error_msg or "INVALID_ARGUMENT" in error_msg:
-            return f"[API 金鑰無效] 請檢查 GEMINI_API_KEY 是否正確設置。"
-        else:
-            return f"[AI 分析失敗] {error_msg[:100]}"
+# /analyze 並行設定：同時進行中的幣種數上限，以及單一幣種（抓取 + 分析）的逾時秒數
+ANALYZE_MAX_CONCURRENCY = max(1, int(os.getenv("ANALYZE_MAX_CONCURRENCY", "8")))
+ANALYZE_COIN_TIMEOUT = float(os.getenv("ANALYZE_COIN_TIMEOUT", "20"))
+
+# AI 分析模式："sync"（預設）等 AI 完成後一起回傳 ai_analysis；"async" 先回傳技術分析與 ai_job_id，
+# AI 文字在背景產生（GET /ai-analysis/{job_id} 查詢，前端需自行輪詢）。請求 body 的 ai_mode 可覆寫
+ANALYZE_AI_MODE = os.getenv("ANALYZE_AI_MODE", "sync").strip().lower()
+
+# /history 單次可要求的最大 candle 數（超過 Bybit 單頁上限的部分會分頁抓取）
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "50000"))
 
 # ====== Bybit K 線取得（v5 API） ======
 
@@ -304,39 +112,8 @@ async def fetch_kline_from_bybit(symbol: str, interval: str, limit: int = 200) -
     limit: 要求筆數
     回傳：時間序列的收盤價 (從最舊到最新)
     """
-    url = f"https://api.bybit.com/v5/market/kline?category=linear&symbol={symbol}&interval={interval}&limit={limit}"
-    logging.info(f"抓取 Bybit K 線: {symbol}, interval={interval}, url={url}")
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        res = await client.get(url)
-    # 印出原始回傳（除錯用）
-    logging.debug(f"Bybit 回傳 ({symbol}): status={res.status_code}, text={res.text[:800]}")
-    if res.status_code != 200:
-        raise ValueError(f"Bybit HTTP {res.status_code}")
-    try:
-        j = res.json()
-    except Exception as e:
-        raise ValueError(f"回傳非 JSON: {e}")
-    if j.get("retCode") != 0:
-        raise ValueError(f"Bybit API 錯誤: {j.get('retMsg')}")
-    result = j.get("result", {})
-    klist = result.get("list") or []
-    if not klist:
-        # 回傳空 list 代表無資料
-        raise ValueError("K 線資料為空")
-    # klist 項目範例: ["1760274000000","111733.8","111887.9","111500","111523.5","770.477","86055557.1538"]
-    # index 4 是 close price
-    closes = []
-    for item in klist:
-        try:
-            closes.append(float(item[4]))
-        except Exception:
-            closes.append(float("nan"))
-    # Bybit 回傳順序是從最新到最舊（視情況），為了畫圖通常要調成從最舊到最新
-    closes = closes[::-1]
-    # 若有 nan，替補為前一個有效值或 0
-    for i, v in enumerate(closes):
-        if math.isnan(v):
-            closes[i] = closes[i - 1] if i > 0 else 0.0
+    candles = await market_data.get_candles(symbol, interval, limit)
+    closes = candles.close.tolist()
     logging.info(f"{symbol} 收盤價取得: {len(closes)} 筆 (first={closes[0] if closes else 'n/a'}, last={closes[-1] if closes else 'n/a'})")
     return closes
 
@@ -355,18 +132,20 @@ def normalize_risk(risk_str: str) -> str:
 
 def analyze_one_coin(
     coin: str,
-    opens: list[float],
-    highs: list[float],
-    lows: list[float],
-    closes: list[float],
-    volumes: list[float],
+    candles: Candles,
     indicator: str,
     risk_raw: str,
+    engine: Optional[IndicatorEngine] = None,
 ) -> dict:
-    """更嚴謹的分析函式，回傳包含建議、進出場、停損、目標價、資金配置與指標快照的物件。"""
+    """
+    更嚴謹的分析函式，回傳包含建議、進出場、停損、目標價、資金配置與指標快照的物件。
+
+    engine 可傳入已預先計算的 IndicatorEngine（例如 BatchIndicatorEngine 的結果），省略時自行建立。
+    """
     ind = (indicator or "").upper()
     risk = normalize_risk(risk_raw)
 
+    closes = candles.close
     n = len(closes)
     # 若資料不足，回傳無法分析
     if n < 10:
@@ -384,20 +163,22 @@ def analyze_one_coin(
             "risk_raw": risk_raw,
         }
 
-    # 基本指標
-    ma7 = ma_series(closes, 7)
-    ma25 = ma_series(closes, 25)
-    ema12 = ema_series(closes, 12)
-    ema26 = ema_series(closes, 26)
-    rsi = compute_rsi(closes, period=14)
-    macd, signal = compute_macd(closes, short=12, long=26, signal=9)
-    atr = atr_series(highs, lows, closes, period=14)
-    vol_pct = volatility_pct(closes, period=14)
-    sr = support_resistance_simple(closes, lookback=min(200, n), levels=3)
-    trend = detect_trend_via_ema(closes)
+    # 基本指標（共用的 EMA、差分、True Range 由 engine 只計算一次）
+    if engine is None:
+        engine = IndicatorEngine(candles)
+    ma7 = engine.ma(7)
+    ma25 = engine.ma(25)
+    ema12 = engine.ema(12)
+    ema26 = engine.ema(26)
+    rsi = engine.rsi(14)
+    macd, signal = engine.macd(12, 26, 9)
+    atr = engine.atr(14)
+    vol_pct = engine.volatility_pct(14)
+    sr = engine.support_resistance(lookback=min(200, n), levels=3)
+    trend = engine.trend()
 
     last_price = float(closes[-1])
-    last_atr = float(atr[-1]) if atr else 0.0
+    last_atr = float(atr[-1]) if len(atr) else 0.0
 
     # 初始得分與信心分數組成
     score = 0.0
@@ -510,18 +291,7 @@ def analyze_one_coin(
 
     # 如果 action 為 建議賣出，翻轉停損/目標邏輯為做空（若該策略允許），否則保留 sell 提示
     # 最後組裝 rationale 與指標快照
-    indicators_snapshot = {
-        "last_price": last_price,
-        "ma7": float(ma7[-1]) if ma7 else None,
-        "ma25": float(ma25[-1]) if ma25 else None,
-        "ema12": float(ema12[-1]) if ema12 else None,
-        "ema26": float(ema26[-1]) if ema26 else None,
-        "rsi14": float(last_rsi),
-        "macd": float(macd[-1]) if macd else None,
-        "signal": float(signal[-1]) if signal else None,
-        "atr": float(last_atr),
-        "volatility_pct": float(vol_pct),
-    }
+    indicators_snapshot = engine.snapshot()
 
     # 建立分批進場計畫（entry_plan）
     entry_plan = []
@@ -589,18 +359,6 @@ def analyze_one_coin(
     # 將 take_profit 四捨五入並以價格表示（若為空，保持原樣）
     take_profit_prices = [round(tp, 6) for tp in take_profit] if take_profit else []
 
-    # 調用 AI 生成深入分析（若已配置 API key）
-    ai_analysis = generate_ai_analysis(
-        coin=coin,
-        last_price=last_price,
-        indicators=indicators_snapshot,
-        trend=trend,
-        support_resistance=sr,
-        rationale=rationale,
-        action=action,
-        risk=risk,
-    )
-
     return {
         "coin": coin,
         "action": action,
@@ -615,28 +373,124 @@ def analyze_one_coin(
         "indicators": indicators_snapshot,
         "risk": risk,
         "risk_raw": risk_raw,
-        "ai_analysis": ai_analysis,  # 若未配置 API key 則為 None
+        "ai_analysis": None,  # 由 /analyze 透過 ai_service 填入；未配置 API key 則維持 None
+    }
+
+def _analysis_error(coin: str, reason: str) -> dict:
+    """單一幣種分析失敗時回傳的結構（與前端既有格式相容）"""
+    return {
+        "coin": coin,
+        "suggestion": "無法分析",
+        "reason": reason,
+        "trend": "未知",
+        "kLine": [],
+        "ma7": [],
+        "ma25": [],
+        "rsi": [],
+        "macd": [],
+        "signal": []
     }
 
+
+async def _fetch_coin_candles(
+    sem: asyncio.Semaphore,
+    coin: str,
+    bybit_interval: str,
+):
+    """在並行上限與單幣逾時限制下抓取一個幣種的 K 線；失敗時回傳錯誤結構而不拋出"""
+    symbol = f"{coin}USDT"
+    async with sem:
+        try:
+            # 取 200 根 candle（若你要更少可改 limit）
+            candles = await asyncio.wait_for(
+                market_data.get_candles(symbol, bybit_interval, 200),
+                timeout=ANALYZE_COIN_TIMEOUT,
+            )
+            logging.info(f"{symbol} data count={len(candles)} first={candles.close[0]:.6f} last={candles.close[-1]:.6f}")
+        except asyncio.TimeoutError:
+            logging.warning(f"{coin} 分析逾時（>{ANALYZE_COIN_TIMEOUT}s）")
+            return _analysis_error(coin, f"分析逾時（>{ANALYZE_COIN_TIMEOUT:g} 秒）")
+        except Exception as e:
+            logging.exception(f"{coin} 分析失敗")
+            return _analysis_error(coin, str(e))
+    return candles
+
+
+def _analyze_coins_batch(
+    coins: list,
+    fetched: list,
+    indicator: str,
+    risk: str,
+) -> list:
+    """
+    對已抓到 K 線的幣種以 BatchIndicatorEngine 一次計算所有指標，再逐幣種組裝分析結果；
+    fetched 中的錯誤結構原樣保留，輸出順序與 coins 相同
+    """
+    ok = [i for i, item in enumerate(fetched) if isinstance(item, Candles)]
+    engines = BatchIndicatorEngine([fetched[i] for i in ok]).engines()
+    results = list(fetched)
+    for i, engine in zip(ok, engines):
+        try:
+            results[i] = analyze_one_coin(coins[i], fetched[i], indicator, risk, engine=engine)
+        except Exception as e:
+            logging.exception(f"{coins[i]} 分析失敗")
+            results[i] = _analysis_error(coins[i], str(e))
+    return results
+
+
+def _ai_items(results: list) -> tuple[list, list]:
+    """挑出分析成功的幣種，回傳 (結果列表, ai_service.generate_batch 的 items)"""
+    targets = [r for r in results if "action" in r and r["indicators"]]
+    items = [
+        (
+            r["coin"],
+            {
+                "last_price": r["indicators"]["last_price"],
+                "indicators": r["indicators"],
+                "trend": r["trend"],
+                "support_resistance": r["support_resistance"],
+                "rationale": r["rationale"],
+                "action": r["action"],
+                "risk": r["risk"],
+            },
+        )
+        for r in targets
+    ]
+    return targets, items
+
+
+async def _attach_ai_analysis(results: list, model) -> None:
+    """
+    對分析成功的幣種產生 AI 分析並等待完成（在 ai_service 的執行緒池中執行，不阻塞 event loop）；
+    多個幣種會依 AI_BATCH_SIZE 合併成較少的 Gemini 請求；使用者正在等待，以互動優先順序排隊
+    """
+    if not model:
+        return
+    targets, items = _ai_items(results)
+    texts = await ai_service.generate_batch(model, items, priority=PRIORITY_INTERACTIVE)
+    for r, text in zip(targets, texts):
+        r["ai_analysis"] = text
+
+
+def _resolve_model(api_key: Optional[str]):
+    """請求提供的 API key 對應的 model；未提供或建立失敗時使用伺服器預設的 gemini_model"""
+    api_key = (api_key or "").strip()
+    if api_key and api_key != gemini_api_key:
+        model = gemini_pool.get_model(api_key)
+        if model is not None:
+            return model
+        logging.warning("前端 API key 配置失敗，改用伺服器預設設定")
+    return gemini_model
+
 # ====== API 路由 ======
 
 @app.post("/analyze")
 async def analyze(request: Request):
-    global gemini_model  # 允許動態修改模型
-    
     body = await request.json()
-    logging.info(f"收到分析請求: {body}")
+    logging.info(f"收到分析請求: { {k: v for k, v in body.items() if k != 'gemini_api_key'} }")
     
-    # 若前端提供了 API key，則動態配置 Gemini
-    frontend_api_key = body.get("gemini_api_key", "").strip()
-    if frontend_api_key and frontend_api_key != gemini_api_key:
-        try:
-            genai.configure(api_key=frontend_api_key)
-            gemini_model = genai.GenerativeModel("models/gemini-2.5-flash")
-            logging.info("✓ 使用前端提供的 Gemini API key")
-        except Exception as e:
-            logging.warning(f"前端 API key 配置失敗: {e}")
-            # 保持使用原有的 gemini_model
+    # 若前端提供了 API key，使用該 key 專用的 model（由 gemini_pool 重用，不影響其他請求）
+    model = _resolve_model(body.get("gemini_api_key", ""))
     
     indicator = body.get("indicator", "")
     risk = body.get("risk", "")
@@ -646,189 +500,239 @@ async def analyze(request: Request):
     # map interval
     bybit_interval = INTERVAL_MAP.get(interval_in, "60")
 
-    results = []
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        # 我們對每個 coin 逐一抓取（也可改為並行 gather）
-        for coin in coins:
-            symbol = f"{coin}USDT"
-            try:
-                # 取 200 根 candle（若你要更少可改 limit）
-                url = f"https://api.bybit.com/v5/market/kline?category=linear&symbol={symbol}&interval={bybit_interval}&limit=200"
-                logging.info(f"Fetching {symbol} -> {url}")
-                resp = await client.get(url)
-                logging.debug(f"{symbol} resp status {resp.status_code}")
-                if resp.status_code != 200:
-                    raise ValueError(f"HTTP {resp.status_code}")
-
-                j = resp.json()
-                if j.get("retCode") != 0:
-                    raise ValueError(f"Bybit error: {j.get('retMsg')}")
-                klist = j.get("result", {}).get("list") or []
-                if not klist:
-                    raise ValueError("K 線資料為空")
-
-                # 取得完整 OHLCV 並轉 float，將順序改成 earliest -> latest
-                opens = []
-                highs = []
-                lows = []
-                closes = []
-                volumes = []
-                timestamps = []
-                for item in klist:
-                    try:
-                        timestamps.append(int(item[0]))
-                        opens.append(float(item[1]))
-                        highs.append(float(item[2]))
-                        lows.append(float(item[3]))
-                        closes.append(float(item[4]))
-                        try:
-                            volumes.append(float(item[5]))
-                        except Exception:
-                            volumes.append(0.0)
-                    except Exception:
-                        # 若解析失敗，補 0 或 nan，之後會處理
-                        timestamps.append(0)
-                        opens.append(0.0)
-                        highs.append(0.0)
-                        lows.append(0.0)
-                        closes.append(float("nan"))
-                        volumes.append(0.0)
-
-                # 轉成 earliest -> latest
-                opens = opens[::-1]
-                highs = highs[::-1]
-                lows = lows[::-1]
-                closes = closes[::-1]
-                volumes = volumes[::-1]
-                timestamps = timestamps[::-1]
-
-                # 補 nan 為前一個有效值或 0
-                for i in range(len(closes)):
-                    if math.isnan(closes[i]):
-                        closes[i] = closes[i - 1] if i > 0 else 0.0
-                    if math.isnan(opens[i]):
-                        opens[i] = closes[i]
-                    if math.isnan(highs[i]):
-                        highs[i] = closes[i]
-                    if math.isnan(lows[i]):
-                        lows[i] = closes[i]
-
-                logging.info(f"{symbol} data count={len(closes)} first={closes[0]:.6f} last={closes[-1]:.6f}")
-
-                analysis = analyze_one_coin(coin, opens, highs, lows, closes, volumes, indicator, risk)
-                results.append(analysis)
-            except Exception as e:
-                logging.exception(f"{coin} 分析失敗")
-                results.append({
-                    "coin": coin,
-                    "suggestion": "無法分析",
-                    "reason": str(e),
-                    "trend": "未知",
-                    "kLine": [],
-                    "ma7": [],
-                    "ma25": [],
-                    "rsi": [],
-                    "macd": [],
-                    "signal": []
-                })
-
-    return {"recommendations": results}
+    sem = asyncio.Semaphore(ANALYZE_MAX_CONCURRENCY)
+    # 每個 coin 各自抓取 K 線，以 semaphore 限制同時進行的請求數；
+    # gather 保持與 coins 相同的順序，單一幣種逾時不會拖住其他幣種
+    fetched = await asyncio.gather(*[
+        _fetch_coin_candles(sem, coin, bybit_interval) for coin in coins
+    ])
+    # 指標對所有幣種一次以 2-D 陣列計算
+    results = _analyze_coins_batch(coins, fetched, indicator, risk)
+    response = {"recommendations": results}
+    if not model:
+        return response
+
+    ai_mode = str(body.get("ai_mode") or ANALYZE_AI_MODE).lower()
+    if ai_mode == "sync":
+        # AI 分析在執行緒池中並行進行，等待期間 event loop 可繼續服務其他請求
+        await _attach_ai_analysis(results, model)
+        return response
+
+    # 背景產生 AI 分析，前端以 ai_job_id 查詢 /ai-analysis/{job_id}；
+    # ai_priority 為 "background"（例如預取）時，配額吃緊會被優先捨棄；不接受 "interactive"（保留給同步請求）
+    _, items = _ai_items(results)
+    if not items:
+        return response
+    try:
+        job = ai_jobs.submit(model, items, priority_of(body.get("ai_priority"), PRIORITY_NORMAL, highest=PRIORITY_NORMAL))
+    except ai_jobs.QueueFullError as e:
+        logging.warning(f"AI 工作未排入: {e}")
+        response["ai_job_id"] = None
+        response["ai_error"] = str(e)
+        return response
+    response["ai_job_id"] = job.id
+    return response
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 
 @app.get("/generate-chart/{symbol}")
 async def generate_chart(
     symbol: str,
     interval: str = "60",
-    limit: int = 200
+    limit: int = 200,
+    overlays: str = "",
+    if_none_match: Optional[str] = Header(None),
 ):
-    """生成 K 線圖並返回圖片"""
-    # 確保輸出目錄存在
-    output_dir = "chart_output"
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 生成唯一的檔案名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{symbol}_{interval}_{timestamp}.png"
-    save_path = os.path.join(output_dir, filename)
-    
-    # 生成圖表
-    await generate_candlestick_chart(
-        symbol=symbol,
-        interval=interval,
-        limit=limit,
-        save_path=save_path
-    )
-    
-    # 返回圖片
-    return FileResponse(
-        save_path,
-        media_type="image/png",
-        filename=filename
-    )
+    """
+    生成 K 線圖並直接回傳 PNG（不寫檔）；overlays 可指定額外指標，如 ?overlays=ema,bollinger,rsi,macd
+    圖表依最新 K 線與參數快取（見 chart_cache），ETag 即快取 key，If-None-Match 相符時回傳 304 且不渲染
+    """
+    # 渲染在 chart_renderer 的行程池中進行
+    try:
+        png, key = await render_candlestick_png(
+            symbol=symbol,
+            interval=interval,
+            limit=limit,
+            overlays=overlays,
+            is_current=lambda k: _etag_matches(if_none_match, chart_cache.etag(k)),
+        )
+    except (chart_renderer.RenderQueueFull, chart_renderer.RenderUnavailable) as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": f"圖表渲染逾時（>{chart_renderer.CHART_RENDER_TIMEOUT:g}s）"}, status_code=504)
+
+    headers = {
+        "ETag": chart_cache.etag(key),
+        "Cache-Control": f"public, max-age={chart_cache.CHART_HTTP_MAX_AGE}",
+    }
+    if png is None:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'inline; filename="{symbol}_{interval}.png"'
+    return Response(content=png, media_type="image/png", headers=headers)
+
+
+async def _history_candles(symbol: str, interval: str, limit: int, endTime: Optional[int]) -> Candles:
+    """最新 limit 根，或結束於 endTime（毫秒）的 limit 根 candle"""
+    if endTime is None:
+        # 最新 limit 根（經由 K 線快取與增量緩衝區）
+        return await market_data.get_candles(symbol, interval, limit)
+    end_ms = max(0, int(endTime))
+    start_ms = max(0, end_ms - limit * market_data.interval_to_ms(interval) + 1)
+    return (await market_data.get_range(symbol, interval, start_ms, end_ms)).tail(limit)
+
+
+def _kline_error_response(e: Exception) -> JSONResponse:
+    """K 線取得失敗時的錯誤回應：Bybit 錯誤依 KlineError.status，完全沒有資料為 404，其餘為 502"""
+    if isinstance(e, market_data.KlineError):
+        status = e.status
+    elif isinstance(e, market_data.NoCandles):
+        status = 404
+    else:
+        status = 502
+    return JSONResponse({"error": str(e)}, status_code=status)
 
 
 @app.get("/history")
 async def history(symbol: str, interval: str = "60", limit: int = 500, endTime: Optional[int] = None):
     """返回歷史 candles（從最舊到最新），每個 candle 包含 ts, open, high, low, close, volume
     例: /history?symbol=BTC&interval=60&limit=500 或 /history?symbol=BTCUSDT&interval=60&limit=500
+    endTime（毫秒）可指定結束時間；limit 超過 Bybit 單頁上限時會自動分頁抓取並拼接
+    Bybit 請求失敗時回傳 4xx/5xx 與 {"error": ...}，不回傳有缺口的資料
     """
     # 自動補上 USDT 後綴（如果沒有）
     if not symbol.endswith("USDT"):
         symbol = f"{symbol}USDT"
     
     bybit_interval = interval
-    limit = max(1, min(2000, int(limit)))
-
-    def _interval_to_seconds(iv: str) -> int:
-        if iv == "D":
-            return 86400
-        if iv == "W":
-            return 7 * 86400
-        if iv == "M":
-            return 30 * 86400
-        try:
-            return int(iv) * 60
-        except Exception:
-            return 3600
+    limit = max(1, min(HISTORY_MAX_LIMIT, int(limit)))
+    logging.info(f"history fetch {symbol} interval={bybit_interval} limit={limit} endTime={endTime}")
 
-    from_ts = None
-    if endTime is not None:
-        try:
-            end_sec = max(0, int(endTime) // 1000)
-            window = _interval_to_seconds(bybit_interval) * limit
-            from_ts = max(0, end_sec - window)
-        except Exception:
-            from_ts = None
-
-    base = f"https://api.bybit.com/v5/market/kline?category=linear&symbol={symbol}&interval={bybit_interval}&limit={limit}"
-    if from_ts:
-        base += f"&from={from_ts}"
-    logging.info(f"history fetch {symbol} interval={bybit_interval} limit={limit} from={from_ts}")
-
-    async with httpx.AsyncClient(timeout=15.0) as client:
+    try:
+        candles = await _history_candles(symbol, bybit_interval, limit, endTime)
+        return {"candles": candles.to_records()}  # oldest -> latest
+    except Exception as e:
+        logging.exception("history fetch failed")
+        return _kline_error_response(e)
+
+
+@app.get("/chart-data")
+async def chart_data(
+    symbol: str,
+    interval: str = "60",
+    limit: int = 500,
+    endTime: Optional[int] = None,
+    max_points: int = 0,
+    overlays: str = "ma,ema,rsi,macd",
+):
+    """
+    給前端自行繪製 K 線圖的輕量資料：欄式 OHLCV（columns.ts / open / high / low / close / volume）
+    加上預先算好的指標（overlays.ma7 / ema12 / rsi14 / macd / signal / histogram ...，與 columns 等長）；
+    overlays 含 sr 時另有每一根的支撐/阻力（support1..3 / resistance1..3）
+    例: /chart-data?symbol=BTC&interval=60&limit=20000&max_points=1500&overlays=ma,ema,rsi,macd,bollinger,sr
+    max_points > 0 時以 OHLC 桶聚合降到最多 max_points 根（保留每桶的最高/最低價）；
+    symbol / interval / limit / endTime 同 /history
+    """
+    if not symbol.endswith("USDT"):
+        symbol = f"{symbol}USDT"
+    limit = max(1, min(HISTORY_MAX_LIMIT, int(limit)))
+    max_points = max(0, int(max_points))
+    logging.info(f"chart-data {symbol} interval={interval} limit={limit} endTime={endTime} max_points={max_points}")
+
+    try:
+        candles = await _history_candles(symbol, interval, limit, endTime)
+        # 指標（尤其 sr 的逐根百分位數）在長序列上需要數百毫秒，放到執行緒中避免卡住 event loop
+        data = await asyncio.to_thread(build_chart_data, candles, overlays, max_points)
+        return {"symbol": symbol, "interval": interval, **data}
+    except Exception as e:
+        logging.exception("chart-data fetch failed")
+        return _kline_error_response(e)
+
+
+@app.get("/ai-analysis/{job_id}")
+async def ai_analysis(job_id: str):
+    """查詢 /analyze 背景 AI 工作的狀態與各幣種結果（status: pending / running / done / failed）"""
+    job = ai_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "找不到 AI 工作（可能已過期）"}, status_code=404)
+    return job.to_dict()
+
+
+@app.get("/ai-analysis/{job_id}/{coin}")
+async def ai_analysis_coin(job_id: str, coin: str):
+    """查詢背景 AI 工作中單一幣種的結果"""
+    job = ai_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "找不到 AI 工作（可能已過期）"}, status_code=404)
+    if coin not in job.results:
+        return JSONResponse({"error": f"AI 工作中沒有 {coin}"}, status_code=404)
+    return job.to_dict(coin)
+
+
+def _sse(event: str, data) -> str:
+    """一則 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/ai-stream/{coin}")
+async def ai_stream(
+    coin: str,
+    interval: str = "1h",
+    risk: str = "",
+    indicator: str = "",
+    x_gemini_api_key: Optional[str] = Header(None),
+):
+    """
+    以 Server-Sent Events 串流單一幣種的 AI 分析（模型邊產生邊送出）
+    事件依序為 analysis（技術分析結果，同 /analyze 的單一幣種）、chunk（{"text": ...}，可能多則）、done；
+    失敗時送出 error。客戶端斷線時會停止讀取上游 Gemini 串流。
+    使用者自己的 API key 以 X-Gemini-Api-Key header 提供（不放在網址中）。
+    """
+    model = _resolve_model(x_gemini_api_key)
+    bybit_interval = INTERVAL_MAP.get(interval, "60")
+
+    async def events():
+        fetched = await _fetch_coin_candles(asyncio.Semaphore(1), coin, bybit_interval)
+        result = _analyze_coins_batch([coin], [fetched], indicator, risk)[0]
+        yield _sse("analysis", result)
+        _, items = _ai_items([result])
+        if not model or not items:
+            yield _sse("done", {"ai": False})
+            return
         try:
-            resp = await client.get(base)
-            if resp.status_code != 200:
-                return {"error": f"HTTP {resp.status_code}"}
-            j = resp.json()
-            if j.get("retCode") != 0:
-                return {"error": f"Bybit: {j.get('retMsg')}"}
-            lst = j.get("result", {}).get("list") or []
-            candles = []
-            for it in lst:
-                try:
-                    ts = int(it[0])
-                    o = float(it[1]); h = float(it[2]); l = float(it[3]); c = float(it[4])
-                    vol = None
-                    try:
-                        vol = float(it[5])
-                    except Exception:
-                        vol = None
-                    candles.append({"ts": ts, "open": o, "high": h, "low": l, "close": c, "volume": vol})
-                except Exception:
-                    continue
-            candles = candles[::-1]  # oldest -> latest
-            return {"candles": candles}
+            async for text in ai_service.stream_analysis(model, coin, items[0][1]):
+                yield _sse("chunk", {"text": text})
+        except asyncio.TimeoutError:
+            yield _sse("error", {"error": ai_service.timeout_message()})
+            return
+        except Overloaded:
+            yield _sse("error", {"error": ai_service.overloaded_message()})
+            return
         except Exception as e:
-            logging.exception("history fetch failed")
-            return {"error": str(e)}
+            yield _sse("error", {"error": ai_service.format_ai_error(e)})
+            return
+        yield _sse("done", {"ai": True})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """快取等內部元件的統計資訊（除錯與監控用）"""
+    return {
+        "kline_cache": market_data.cache_stats(),
+        "ai": ai_service.stats(),
+        "ai_jobs": ai_jobs.stats(),
+        "gemini_pool": gemini_pool.stats(),
+        "chart_renderer": chart_renderer.stats(),
+        "chart_cache": chart_cache.stats(),
+    }
@@ -0,0 +1,615 @@
+"""
+行情資料模組 - 將 Bybit v5 kline 回傳轉為欄式（columnar）的 Candles 結構
+
+main.py 的 /analyze、/history 與 chart_generator 都透過這裡取得 K 線，
+不再各自以 Python 迴圈逐根解析、反轉與補值。
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import bybit_client
+from singleflight import SingleFlight
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# K 線快取設定：
+#   KLINE_CACHE_MAX_ENTRIES  最多保留的序列數（0 代表停用）
+#   KLINE_CACHE_LIVE_TTL     序列最後一根仍在形成中時的快取秒數
+#   KLINE_CACHE_CLOSED_TTL   序列全部為已收盤 candle（指定了過去的 end）時的快取秒數
+KLINE_CACHE_MAX_ENTRIES = int(os.getenv("KLINE_CACHE_MAX_ENTRIES", "512"))
+KLINE_CACHE_LIVE_TTL = float(os.getenv("KLINE_CACHE_LIVE_TTL", "5"))
+KLINE_CACHE_CLOSED_TTL = float(os.getenv("KLINE_CACHE_CLOSED_TTL", "3600"))
+
+# Bybit v5 kline 單頁上限；跨多頁抓取時同時進行的請求數
+BYBIT_PAGE_LIMIT = 1000
+KLINE_PAGE_CONCURRENCY = max(1, int(os.getenv("KLINE_PAGE_CONCURRENCY", "4")))
+# 分頁抓取遇到限流或 5xx 時的重試次數與第一次重試前的等待秒數（之後每次加倍）
+KLINE_PAGE_RETRIES = max(0, int(os.getenv("KLINE_PAGE_RETRIES", "2")))
+KLINE_PAGE_RETRY_BACKOFF = float(os.getenv("KLINE_PAGE_RETRY_BACKOFF", "0.5"))
+
+# Bybit retCode：參數錯誤（例如不存在的 symbol）、請求過於頻繁、伺服器錯誤
+_RETCODE_PARAMS_ERROR = 10001
+_RETCODE_RETRYABLE = {10006, 10016}
+
+# 增量更新緩衝區設定：
+#   KLINE_BUFFER_MAX_CANDLES  每個 (symbol, interval) 最多保留的 candle 數
+#   KLINE_BUFFER_MAX_SERIES   最多保留的序列數
+#   KLINE_BUFFER_IDLE_TTL     序列閒置多久（秒）後丟棄
+KLINE_BUFFER_MAX_CANDLES = int(os.getenv("KLINE_BUFFER_MAX_CANDLES", "2000"))
+KLINE_BUFFER_MAX_SERIES = int(os.getenv("KLINE_BUFFER_MAX_SERIES", "256"))
+KLINE_BUFFER_IDLE_TTL = float(os.getenv("KLINE_BUFFER_IDLE_TTL", "3600"))
+
+# 本機 K 線倉庫設定：
+#   CANDLE_STORE_PATH            SQLite 檔案路徑（設為空字串停用）
+#   CANDLE_STORE_MAX_PER_SERIES  壓縮時每個序列保留的 candle 數
+CANDLE_STORE_PATH = os.getenv("CANDLE_STORE_PATH", os.path.join("data", "candles.sqlite3")).strip()
+CANDLE_STORE_MAX_PER_SERIES = int(os.getenv("CANDLE_STORE_MAX_PER_SERIES", "100000"))
+
+_kline_cache = TTLCache(KLINE_CACHE_MAX_ENTRIES, name="kline")
+# 快取未命中時，相同參數的並行請求只打一次 Bybit
+_kline_flight = SingleFlight(name="kline")
+# 每個 (symbol, interval) 最新一段 candle 的緩衝區，只向 Bybit 要最後一根之後的新資料
+_buffers = TTLCache(KLINE_BUFFER_MAX_SERIES, default_ttl=KLINE_BUFFER_IDLE_TTL, name="kline_buffer")
+_buffer_flight = SingleFlight(name="kline_buffer")
+_buffer_counters = {"incremental": 0, "full": 0, "warm_starts": 0}
+# CandleStore 實例（於 startup 開啟；None 代表未啟用）
+_store = None
+_store_counters = {"range_local": 0, "range_fetched": 0, "page_retries": 0, "listing_skips": 0}
+# (symbol, interval) -> 最早一根 candle 的 ts（上市時間）；倉庫啟用時另外持久化
+_first_ts: dict = {}
+
+
+class NoCandles(ValueError):
+    """請求成功但沒有任何 K 線（例如時間範圍早於上市時間）"""
+
+
+class KlineError(ValueError):
+    """
+    Bybit K 線請求失敗（HTTP 錯誤、非 JSON、retCode 不為 0）
+
+    status 為建議回給客戶端的 HTTP 狀態碼；retryable 代表稍後重試可能成功（限流、5xx）
+    """
+
+    def __init__(self, message: str, status: int = 502, retryable: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+@dataclass(frozen=True)
+class Candles:
+    """
+    依時間升序（最舊到最新）排列的 OHLCV 資料，每個欄位是一個 numpy 陣列
+
+    ts 為 candle 開盤時間（毫秒，int64），其餘欄位為 float64。
+    """
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __post_init__(self):
+        # Candles 會透過快取在多個請求間共用，陣列一律設為唯讀
+        for a in (self.ts, self.open, self.high, self.low, self.close, self.volume):
+            a.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @classmethod
+    def empty(cls) -> "Candles":
+        f = np.empty(0, dtype=np.float64)
+        return cls(np.empty(0, dtype=np.int64), f, f, f, f, f)
+
+    def tail(self, n: int) -> "Candles":
+        """最後 n 根 candle"""
+        if n >= len(self):
+            return self
+        return self[len(self) - max(0, n):]
+
+    def __getitem__(self, idx) -> "Candles":
+        """以 slice 或布林/索引陣列取出子集合"""
+        return Candles(
+            self.ts[idx], self.open[idx], self.high[idx],
+            self.low[idx], self.close[idx], self.volume[idx],
+        )
+
+    def to_records(self) -> list[dict]:
+        """轉為 [{ts, open, high, low, close, volume}, ...]（供 JSON 回應使用）"""
+        keys = ("ts", "open", "high", "low", "close", "volume")
+        cols = (self.ts, self.open, self.high, self.low, self.close, self.volume)
+        return [dict(zip(keys, row)) for row in zip(*(c.tolist() for c in cols))]
+
+    def to_columns(self) -> dict:
+        """轉為 {ts: [...], open: [...], ...}（欄式 JSON，比 to_records 小且快）"""
+        return {
+            "ts": self.ts.tolist(),
+            "open": self.open.tolist(),
+            "high": self.high.tolist(),
+            "low": self.low.tolist(),
+            "close": self.close.tolist(),
+            "volume": self.volume.tolist(),
+        }
+
+    def downsample(self, max_points: int) -> tuple["Candles", np.ndarray]:
+        """
+        OHLC 桶聚合到最多 max_points 根：把連續的 candle 平均分成 max_points 桶，
+        每桶 open 取第一根、high 取最大、low 取最小、close 取最後一根、volume 加總、ts 取第一根，
+        因此影線的最高/最低點不會遺失。
+
+        回傳 (聚合後的 Candles, 每桶最後一根在原序列中的索引)；
+        後者可用來取出對應的指標值（與 close 對齊）。不需要聚合時原樣回傳。
+        """
+        n = len(self)
+        if max_points <= 0 or n <= max_points:
+            return self, np.arange(n)
+        starts = (np.arange(max_points, dtype=np.int64) * n) // max_points
+        ends = np.append(starts[1:], n) - 1
+        return Candles(
+            self.ts[starts],
+            self.open[starts],
+            np.maximum.reduceat(self.high, starts),
+            np.minimum.reduceat(self.low, starts),
+            self.close[ends],
+            np.add.reduceat(self.volume, starts),
+        ), ends
+
+
+def interval_to_ms(interval: str) -> int:
+    """Bybit interval 字串轉為毫秒（"D"/"W"/"M" 或分鐘數，無法辨識時視為 1 小時）"""
+    if interval == "D":
+        return 86_400_000
+    if interval == "W":
+        return 7 * 86_400_000
+    if interval == "M":
+        return 30 * 86_400_000
+    try:
+        return int(interval) * 60_000
+    except Exception:
+        return 3_600_000
+
+
+def _ffill(x: np.ndarray, leading: float = 0.0) -> np.ndarray:
+    """向量化的 NaN 前向填補：NaN 以前一個有效值取代，開頭的 NaN 用 leading"""
+    mask = np.isnan(x)
+    if not mask.any():
+        return x
+    idx = np.where(mask, 0, np.arange(len(x)))
+    np.maximum.accumulate(idx, out=idx)
+    out = x[idx]
+    # 開頭連續 NaN（之前沒有任何有效值）
+    out[np.isnan(out)] = leading
+    return out
+
+
+def _parse_rows_slow(klist: list) -> np.ndarray:
+    """逐筆解析（僅在快速路徑失敗時使用），無法解析的欄位給 NaN"""
+    arr = np.full((len(klist), 6), np.nan)
+    for i, item in enumerate(klist):
+        for k in range(6):
+            try:
+                arr[i, k] = float(item[k])
+            except Exception:
+                pass
+    return arr
+
+
+def parse_kline_list(klist: list) -> Candles:
+    """
+    將 Bybit kline list 轉為 Candles
+
+    klist 項目範例: ["1760274000000","111733.8","111887.9","111500","111523.5","770.477","86055557.1538"]
+    Bybit 回傳順序為最新到最舊，這裡統一排為最舊到最新。
+    close 的 NaN 以前一個有效值（或 0）補上，open/high/low 的 NaN 以 close 補上，volume 的 NaN 為 0。
+    無法解析時間戳的項目會被略過。
+    """
+    if not klist:
+        return Candles.empty()
+    try:
+        # 快速路徑：所有項目都是 7 個數字字串時一次轉型
+        arr = np.asarray(klist, dtype=np.float64)
+        if arr.ndim != 2 or arr.shape[1] < 6:
+            raise ValueError("unexpected kline shape")
+        arr = arr[:, :6]
+    except (ValueError, TypeError):
+        arr = _parse_rows_slow(klist)
+
+    arr = arr[~np.isnan(arr[:, 0])]
+    order = np.argsort(arr[:, 0], kind="stable")
+    arr = arr[order]
+    ts = arr[:, 0].astype(np.int64)
+
+    close = _ffill(arr[:, 4])
+    open_ = np.where(np.isnan(arr[:, 1]), close, arr[:, 1])
+    high = np.where(np.isnan(arr[:, 2]), close, arr[:, 2])
+    low = np.where(np.isnan(arr[:, 3]), close, arr[:, 3])
+    volume = np.nan_to_num(arr[:, 5], nan=0.0)
+    return Candles(ts, open_, high, low, close, volume)
+
+
+async def request_kline(params: dict) -> list:
+    """
+    呼叫 Bybit kline API 並回傳原始 list（最新到最舊）
+
+    HTTP 錯誤、非 JSON 或 retCode 不為 0 時拋出 KlineError。
+    """
+    res = await bybit_client.get_kline(params)
+    logger.debug(f"Bybit 回傳 ({params.get('symbol')}): status={res.status_code}, text={res.text[:800]}")
+    if res.status_code != 200:
+        # Bybit 以 403 表示 IP 請求過於頻繁
+        retryable = res.status_code in (403, 429) or res.status_code >= 500
+        raise KlineError(f"Bybit HTTP {res.status_code}", status=503 if retryable else 502, retryable=retryable)
+    try:
+        j = res.json()
+    except Exception as e:
+        raise KlineError(f"回傳非 JSON: {e}")
+    ret_code = j.get("retCode")
+    if ret_code != 0:
+        message = f"Bybit API 錯誤: {j.get('retMsg')}"
+        if ret_code == _RETCODE_PARAMS_ERROR:
+            raise KlineError(message, status=400)
+        if ret_code in _RETCODE_RETRYABLE:
+            raise KlineError(message, status=503, retryable=True)
+        raise KlineError(message)
+    return (j.get("result") or {}).get("list") or []
+
+
+async def fetch_candles(
+    symbol: str,
+    interval: str,
+    limit: int = 200,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Candles:
+    """
+    取得 symbol 的 K 線並解析為 Candles
+
+    symbol: e.g. "BTCUSDT"
+    interval: Bybit interval string (e.g. "15" / "60" / "240" / "D")
+    start / end: 毫秒時間戳（v5 kline 參數，可省略）
+    無資料時拋出 NoCandles，請求失敗時拋出 KlineError（兩者皆為 ValueError）。
+    """
+    params = {"category": "linear", "symbol": symbol, "interval": interval, "limit": limit}
+    if start is not None:
+        params["start"] = int(start)
+    if end is not None:
+        params["end"] = int(end)
+    logger.info(f"抓取 Bybit K 線: {params}")
+    klist = await request_kline(params)
+    if not klist:
+        raise NoCandles("K 線資料為空")
+    return parse_kline_list(klist)
+
+
+def merge_candles(old: Candles, new: Candles) -> Candles:
+    """
+    合併兩段 Candles，依 ts 排序去重；ts 重複時以 new 為準
+    （例如仍在形成中的最後一根會被新資料取代，而不是重複出現）
+    """
+    if len(old) == 0:
+        return new
+    if len(new) == 0:
+        return old
+    cols = [
+        np.concatenate([getattr(old, f), getattr(new, f)])
+        for f in ("ts", "open", "high", "low", "close", "volume")
+    ]
+    # 反轉後 np.unique 取第一次出現者，即 new 的版本；結果依 ts 升序
+    _, idx = np.unique(cols[0][::-1], return_index=True)
+    take = len(cols[0]) - 1 - idx
+    return Candles(*(c[take] for c in cols))
+
+
+def is_contiguous(candles: Candles, interval: str) -> bool:
+    """candle 之間是否沒有缺口（月線長度不固定，一律視為連續）"""
+    if interval == "M" or len(candles) < 2:
+        return True
+    return bool(np.all(np.diff(candles.ts) == interval_to_ms(interval)))
+
+
+def _closed_only(candles: Candles, interval: str) -> Candles:
+    """只保留已收盤的 candle（仍在形成中的最後一根不寫入倉庫）"""
+    now_ms = int(time.time() * 1000)
+    return candles[candles.ts + interval_to_ms(interval) <= now_ms]
+
+
+async def _persist(symbol: str, interval: str, candles: Candles) -> None:
+    """把已收盤的 candle 寫入本機倉庫（失敗只記錄，不影響回應）"""
+    if _store is None or len(candles) == 0:
+        return
+    try:
+        await asyncio.to_thread(_store.append, symbol, interval, _closed_only(candles, interval))
+    except Exception:
+        logger.exception(f"K 線寫入倉庫失敗: {symbol} {interval}")
+
+
+async def _store_load(symbol: str, interval: str, **kwargs) -> Candles:
+    if _store is None:
+        return Candles.empty()
+    return await asyncio.to_thread(_store.load, symbol, interval, **kwargs)
+
+
+async def fetch_latest(symbol: str, interval: str, limit: int) -> Candles:
+    """抓取最新 limit 根；超過 Bybit 單頁上限時自動分頁並行抓取"""
+    if limit <= BYBIT_PAGE_LIMIT:
+        return await fetch_candles(symbol, interval, limit)
+    now_ms = int(time.time() * 1000)
+    iv = interval_to_ms(interval)
+    windows = _page_windows(interval, now_ms - limit * iv + 1, now_ms)
+    fresh = await _fetch_windows(symbol, interval, windows)
+    if len(fresh) == 0:
+        raise NoCandles("K 線資料為空")
+    return fresh.tail(limit)
+
+
+async def _reload_buffer(symbol: str, interval: str, limit: int) -> Candles:
+    """完整抓取最新 limit 根，與既有緩衝區合併後存回"""
+    fresh = await fetch_latest(symbol, interval, limit)
+    await _persist(symbol, interval, fresh)
+    key = (symbol, interval)
+    old = _buffers.get(key)
+    if old is not None and len(old) and old.ts[-1] + interval_to_ms(interval) >= fresh.ts[0]:
+        # 與舊緩衝區相連，保留更早的部分
+        buf = merge_candles(old, fresh).tail(KLINE_BUFFER_MAX_CANDLES)
+    else:
+        buf = fresh.tail(KLINE_BUFFER_MAX_CANDLES)
+    _buffers.set(key, buf)
+    _buffer_counters["full"] += 1
+    return buf
+
+
+async def _refresh_buffer(symbol: str, interval: str) -> Candles:
+    """只抓取緩衝區最後一根（可能仍在形成中）之後的 candle 並接上"""
+    key = (symbol, interval)
+    buf = _buffers.get(key)
+    if buf is None or len(buf) == 0:
+        return await _reload_buffer(symbol, interval, 200)
+    last_ts = int(buf.ts[-1])
+    missing = max(1, int(time.time() * 1000 - last_ts) // interval_to_ms(interval) + 1)
+    if missing + 2 > BYBIT_PAGE_LIMIT:
+        # 落後太多，一頁補不完，直接重新抓取
+        return await _reload_buffer(symbol, interval, len(buf))
+    fresh = await fetch_candles(symbol, interval, missing + 2, start=last_ts)
+    if len(fresh) == 0 or fresh.ts[0] > last_ts:
+        # 新資料沒有和緩衝區銜接（中間有缺口），改為完整抓取
+        return await _reload_buffer(symbol, interval, len(buf))
+    await _persist(symbol, interval, fresh)
+    buf = merge_candles(buf, fresh).tail(KLINE_BUFFER_MAX_CANDLES)
+    _buffers.set(key, buf)
+    _buffer_counters["incremental"] += 1
+    return buf
+
+
+async def _latest_candles(symbol: str, interval: str, limit: int) -> Candles:
+    """
+    透過 (symbol, interval) 緩衝區取得最新 limit 根；緩衝區夠深時只做增量更新。
+    緩衝區不存在時（例如剛重啟）先從本機倉庫載入，再補抓之後的新 candle。
+    """
+    if limit > KLINE_BUFFER_MAX_CANDLES or KLINE_BUFFER_MAX_SERIES <= 0:
+        now_ms = int(time.time() * 1000)
+        return (await get_range(symbol, interval, now_ms - limit * interval_to_ms(interval), now_ms)).tail(limit)
+    key = (symbol, interval)
+    buf = _buffers.get(key)
+    if buf is None and _store is not None:
+        warm = await _store_load(symbol, interval, limit=limit)
+        if len(warm) >= limit and is_contiguous(warm, interval):
+            _buffers.set(key, warm)
+            _buffer_counters["warm_starts"] += 1
+            buf = warm
+    if buf is not None and len(buf) >= limit:
+        buf = await _buffer_flight.do(("refresh",) + key, lambda: _refresh_buffer(symbol, interval))
+    if buf is None or len(buf) < limit:
+        buf = await _buffer_flight.do(("full", limit) + key, lambda: _reload_buffer(symbol, interval, limit))
+    return buf.tail(limit)
+
+
+def _missing_windows(local: Candles, interval: str, start: int, end: int) -> list[tuple[int, int]]:
+    """
+    找出 [start, end] 中本機缺少的時間區間
+
+    缺口包含：開頭、中間不連續處，以及結尾（含仍在形成中、倉庫不會保存的最後一根）。
+    """
+    iv = interval_to_ms(interval)
+    if len(local) == 0:
+        return [(start, end)]
+    windows = []
+    if local.ts[0] >= start + iv:
+        windows.append((start, int(local.ts[0]) - 1))
+    gaps = np.nonzero(np.diff(local.ts) > iv)[0]
+    for i in gaps.tolist():
+        windows.append((int(local.ts[i]) + iv, int(local.ts[i + 1]) - 1))
+    if local.ts[-1] + iv <= end:
+        windows.append((int(local.ts[-1]) + iv, end))
+    return windows
+
+
+def _page_windows(interval: str, start: int, end: int) -> list[tuple[int, int]]:
+    """把 [start, end] 切成每段最多 BYBIT_PAGE_LIMIT 根的時間窗口"""
+    span = BYBIT_PAGE_LIMIT * interval_to_ms(interval)
+    return [(s, min(end, s + span - 1)) for s in range(start, end + 1, span)]
+
+
+async def _fetch_windows(symbol: str, interval: str, windows: list[tuple[int, int]]) -> Candles:
+    """
+    以最多 KLINE_PAGE_CONCURRENCY 個並行請求抓取多個時間窗口（每個窗口須在一頁之內），
+    依 ts 拼接並去重
+
+    只有「請求成功但沒有資料」（例如早於上市時間）的窗口視為空；限流與 5xx 重試
+    KLINE_PAGE_RETRIES 次，其餘錯誤（或重試後仍失敗）拋出 KlineError，不回傳有缺口的結果。
+    """
+    sem = asyncio.Semaphore(KLINE_PAGE_CONCURRENCY)
+
+    async def _one(w_start: int, w_end: int) -> Candles:
+        async with sem:
+            for attempt in range(KLINE_PAGE_RETRIES + 1):
+                try:
+                    return await fetch_candles(symbol, interval, BYBIT_PAGE_LIMIT, start=w_start, end=w_end)
+                except NoCandles:
+                    logger.debug(f"{symbol} {interval} [{w_start}, {w_end}] 無資料")
+                    return Candles.empty()
+                except KlineError as e:
+                    if not e.retryable or attempt == KLINE_PAGE_RETRIES:
+                        raise
+                    delay = KLINE_PAGE_RETRY_BACKOFF * 2 ** attempt
+                    _store_counters["page_retries"] += 1
+                    logger.warning(f"{symbol} {interval} [{w_start}, {w_end}] {e}，{delay:g}s 後重試")
+                    await asyncio.sleep(delay)
+
+    pages = await asyncio.gather(*(_one(s, e) for s, e in windows), return_exceptions=True)
+    for page in pages:
+        if isinstance(page, BaseException):
+            raise page
+    result = Candles.empty()
+    for page in pages:
+        result = merge_candles(result, page)
+    return result
+
+
+async def get_range(symbol: str, interval: str, start: int, end: int) -> Candles:
+    """
+    取得 start <= ts <= end（毫秒）的全部 candle，依時間升序
+
+    先讀本機倉庫，只向 Bybit 補抓缺少的區間，補抓到的已收盤 candle 會寫回倉庫。
+    已知上市時間（最早一根 candle）時，不再抓取更早的區間。
+    """
+    end = min(int(end), int(time.time() * 1000))
+    start = int(start)
+    first_ts = await _get_first_ts(symbol, interval)
+    if first_ts is not None and start < first_ts:
+        _store_counters["listing_skips"] += 1
+        start = first_ts
+    if start > end:
+        return Candles.empty()
+    local = await _store_load(symbol, interval, start=start, end=end)
+    windows = _missing_windows(local, interval, start, end)
+    if not windows:
+        _store_counters["range_local"] += 1
+        return local
+    _store_counters["range_fetched"] += 1
+    pages = [p for w_start, w_end in windows for p in _page_windows(interval, w_start, w_end)]
+    fetched = await _fetch_windows(symbol, interval, pages)
+    await _persist(symbol, interval, fetched)
+    result = merge_candles(local, fetched)
+    if windows[0][0] == start and len(result) and result.ts[0] >= start + interval_to_ms(interval):
+        # 開頭的區間已向 Bybit 查過，第一根仍晚於 start：更早的時間沒有資料（上市前）
+        await _set_first_ts(symbol, interval, int(result.ts[0]))
+    return result
+
+
+async def _get_first_ts(symbol: str, interval: str) -> Optional[int]:
+    key = (symbol, interval)
+    if key not in _first_ts and _store is not None:
+        _first_ts[key] = await asyncio.to_thread(_store.get_first_ts, symbol, interval)
+    return _first_ts.get(key)
+
+
+async def _set_first_ts(symbol: str, interval: str, ts: int) -> None:
+    _first_ts[(symbol, interval)] = ts
+    if _store is None:
+        return
+    try:
+        await asyncio.to_thread(_store.set_first_ts, symbol, interval, ts)
+    except Exception:
+        logger.exception(f"上市時間寫入倉庫失敗: {symbol} {interval}")
+
+
+def _cache_expires_at(candles: Candles, interval: str, end: Optional[int], now: float) -> float:
+    """
+    依 candle 收盤時間決定快取到期時間（秒）
+
+    已收盤的 candle 不會再變，序列在下一根 candle 開始前都有效；
+    若最後一根仍在形成中，它的價格隨時會變，只給 KLINE_CACHE_LIVE_TTL 的短效期。
+    """
+    now_ms = now * 1000
+    next_open_ms = int(candles.ts[-1]) + interval_to_ms(interval)
+    if end is not None and end < now_ms and next_open_ms > end:
+        # 指定了過去的 end：整段都是歷史資料
+        return now + KLINE_CACHE_CLOSED_TTL
+    if next_open_ms > now_ms:
+        # 最後一根仍在形成中：短效期，但不超過它收盤的時間
+        return min(now + KLINE_CACHE_LIVE_TTL, next_open_ms / 1000)
+    # 下一根 candle 已經到期卻還沒出現在資料中，只做極短快取
+    return now + min(1.0, KLINE_CACHE_LIVE_TTL)
+
+
+async def get_candles(
+    symbol: str,
+    interval: str,
+    limit: int = 200,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Candles:
+    """
+    與 fetch_candles 相同，但先查詢以 (symbol, interval, limit, start, end) 為 key 的快取；
+    未命中時，同 key 的並行呼叫共用同一個上游請求
+    """
+    key = (symbol, interval, int(limit), start, end)
+    candles = _kline_cache.get(key)
+    if candles is not None:
+        return candles
+
+    async def _load() -> Candles:
+        if start is None and end is None:
+            result = await _latest_candles(symbol, interval, int(limit))
+        else:
+            result = await fetch_candles(symbol, interval, limit, start=start, end=end)
+        _kline_cache.set(key, result, expires_at=_cache_expires_at(result, interval, end, time.time()))
+        return result
+
+    return await _kline_flight.do(key, _load)
+
+
+async def startup() -> None:
+    """開啟本機 K 線倉庫並壓縮（CANDLE_STORE_PATH 為空時不啟用）"""
+    global _store
+    if not CANDLE_STORE_PATH:
+        logger.info("CANDLE_STORE_PATH 未設定，本機 K 線倉庫停用")
+        return
+    from candle_store import CandleStore
+
+    store = CandleStore(CANDLE_STORE_PATH)
+    try:
+        await asyncio.to_thread(store.open)
+        await asyncio.to_thread(store.compact, CANDLE_STORE_MAX_PER_SERIES)
+    except Exception:
+        logger.exception(f"無法開啟 K 線倉庫 {CANDLE_STORE_PATH}，改為僅使用網路")
+        store.close()
+        return
+    _store = store
+
+
+async def shutdown() -> None:
+    global _store
+    if _store is not None:
+        await asyncio.to_thread(_store.close)
+        _store = None
+    _first_ts.clear()
+
+
+def cache_stats() -> dict:
+    """K 線快取的命中/未命中/淘汰統計，以及請求合併統計"""
+    return {
+        **_kline_cache.stats(),
+        "singleflight": _kline_flight.stats(),
+        "buffers": {
+            "series": len(_buffers),
+            "max_candles": KLINE_BUFFER_MAX_CANDLES,
+            "incremental_refreshes": _buffer_counters["incremental"],
+            "full_reloads": _buffer_counters["full"],
+            "warm_starts": _buffer_counters["warm_starts"],
+        },
+        "store": {
+            **(_store.stats() if _store is not None else {"enabled": False}),
+            "range_served_locally": _store_counters["range_local"],
+            "range_fetched": _store_counters["range_fetched"],
+        },
+    }
@@ -0,0 +1,57 @@
+"""
+Token bucket 速率限制 - 以每秒補充 rate 個 token、最多累積 capacity 個的方式限制請求數
+"""
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket（由呼叫端排隊，例如 ai_scheduler.KeyScheduler）
+
+    wait_time(n) 回傳取得 n 個 token 還需等待的秒數；try_take(n) 不等待，不足時回傳 False。
+    rate <= 0 代表不限制。時間使用 time.monotonic()。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    @classmethod
+    def per_minute(cls, limit: float, burst: float = None) -> "TokenBucket":
+        """每分鐘 limit 次，預設可一次用完一分鐘的額度"""
+        return cls(limit / 60.0, limit if burst is None else burst)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        if self.rate <= 0:
+            return float("inf")
+        self._refill()
+        return self._tokens
+
+    def wait_time(self, n: float = 1) -> float:
+        """取得 n 個 token 需要等待的秒數（0 代表現在即可）"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        # 超過容量的請求視為只需要補滿整個 bucket
+        need = min(n, self.capacity) - self._tokens
+        return max(0.0, need / self.rate)
+
+    def try_take(self, n: float = 1) -> bool:
+        if self.wait_time(n) > 0:
+            return False
+        if self.rate > 0:
+            self._tokens -= min(n, self.capacity)
+        return True
+
+    def drain(self) -> None:
+        """清空目前累積的 token（例如上游回報配額已用完時）"""
+        self._refill()
+        self._tokens = 0.0
@@ -0,0 +1,50 @@
+"""
+Single-flight：相同 key 的並行呼叫共用同一個進行中的 task，只對上游發出一次請求
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    合併相同 key 的並行非同步呼叫
+
+    第一個呼叫者建立 task，之後同 key 的呼叫者等待同一個 task 的結果（或例外）。
+    task 完成後即移除，下一次呼叫會重新執行。
+    各呼叫者以 asyncio.shield 等待，其中一人被取消（例如逾時）不會中斷其他人共用的請求。
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.coalesced += 1
+            logger.debug(f"singleflight[{self.name}] 合併請求 {key}")
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 取出例外，避免所有等待者都已取消時出現 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
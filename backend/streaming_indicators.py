@@ -0,0 +1,310 @@
+"""
+串流（增量）技術指標 - 每根新 candle O(1) 更新
+
+對應 indicators.py 的批次函式（ma_series、ema_series、compute_rsi、compute_macd、atr_series），
+可先以歷史資料 seed，之後逐根更新；update(..., replace=True) 會取代最後一根
+（例如仍在形成中的 candle 價格變動），而不是新增一根。
+每次更新後的 value 與對同一段資料呼叫批次函式所得的最後一個值相同（至浮點誤差）。
+滑動視窗百分位數（支撐/阻力）見 indicators.RollingPercentile。
+
+EMA / RSI / ATR 以序列的第一根作為 seed，因此結果與「從同一根開始的整段歷史」的批次計算一致；
+/analyze 每次以最新 limit 根重新 seed，不使用這裡的增量狀態。
+"""
+import math
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class _StreamingIndicator:
+    """
+    以不可變的 state tuple 實作的增量指標
+
+    子類別實作 _initial() 與 _step(state, *bar)；保留上一根之前的 state，
+    replace=True 時從該 state 重新套用新的 bar。
+    """
+
+    def __init__(self):
+        self._state = self._initial()
+        self._prev = None
+        self.count = 0
+
+    def _initial(self):
+        raise NotImplementedError
+
+    def _step(self, state, *bar):
+        raise NotImplementedError
+
+    def _value(self, state):
+        raise NotImplementedError
+
+    def update(self, *bar, replace: bool = False):
+        """新增一根（或 replace=True 時取代最後一根）並回傳最新值"""
+        if replace and self.count > 0:
+            self._state = self._step(self._prev, *bar)
+        else:
+            self._prev = self._state
+            self._state = self._step(self._state, *bar)
+            self.count += 1
+        return self.value
+
+    @property
+    def value(self):
+        return self._value(self._state) if self.count else None
+
+    @classmethod
+    def from_history(cls, *series, **params):
+        """以歷史資料 seed（每根一次 O(1) 更新）"""
+        obj = cls(**params)
+        for bar in zip(*(np.asarray(s, dtype=float).tolist() for s in series)):
+            obj.update(*bar)
+        return obj
+
+
+class StreamingEMA(_StreamingIndicator):
+    """對應 ema_series：第一個值作為 seed，k = 2 / (period + 1)"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.k = 2 / (period + 1)
+        super().__init__()
+
+    def _initial(self):
+        return None
+
+    def _step(self, state, x):
+        if state is None:
+            return float(x)
+        return x * self.k + state * (1 - self.k)
+
+    def _value(self, state):
+        return state
+
+
+class StreamingRSI(_StreamingIndicator):
+    """
+    對應 compute_rsi（Wilder smoothing）
+
+    前 period 個差分收集 seed（期間 value 為價格本身，與批次函式資料不足時相同），
+    之後逐根以 Wilder smoothing 更新。
+    """
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        super().__init__()
+
+    def _initial(self):
+        # (價格數, 前一根收盤, 上漲總和/平均, 下跌總和/平均, 最新價格)
+        return (0, None, 0.0, 0.0, None)
+
+    def _step(self, state, x):
+        n, prev, up, down, _ = state
+        x = float(x)
+        if n == 0:
+            return (1, x, 0.0, 0.0, x)
+        d = x - prev
+        gain = d if d > 0 else 0.0
+        loss = -d if d < 0 else 0.0
+        p = self.period
+        deltas = n  # 加入這根之後的差分數
+        if deltas < p:
+            return (n + 1, x, up + gain, down + loss, x)
+        if deltas == p:
+            return (n + 1, x, (up + gain) / p, (down + loss) / p, x)
+        return (n + 1, x, (up * (p - 1) + gain) / p, (down * (p - 1) + loss) / p, x)
+
+    def _value(self, state):
+        n, _, up, down, last = state
+        if n - 1 < self.period:
+            return last
+        if down == 0:
+            return 100.0
+        return 100 - 100 / (1 + up / down)
+
+
+class StreamingMACD:
+    """對應 compute_macd：value 為 (macd, signal)"""
+
+    def __init__(self, short: int = 12, long: int = 26, signal: int = 9):
+        self.ema_short = StreamingEMA(short)
+        self.ema_long = StreamingEMA(long)
+        self.signal = StreamingEMA(signal)
+
+    @property
+    def count(self) -> int:
+        return self.ema_short.count
+
+    def update(self, x, replace: bool = False):
+        macd = self.ema_short.update(x, replace=replace) - self.ema_long.update(x, replace=replace)
+        return macd, self.signal.update(macd, replace=replace)
+
+    @property
+    def value(self):
+        if not self.count:
+            return None
+        return self.ema_short.value - self.ema_long.value, self.signal.value
+
+    @classmethod
+    def from_history(cls, closes, **params):
+        obj = cls(**params)
+        for x in np.asarray(closes, dtype=float).tolist():
+            obj.update(x)
+        return obj
+
+
+class StreamingATR(_StreamingIndicator):
+    """對應 atr_series：update(high, low, close)，第一根以自身收盤作為前收"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        super().__init__()
+
+    def _initial(self):
+        # (前一根收盤, ATR)
+        return (None, None)
+
+    def _step(self, state, high, low, close):
+        prev_close, atr = state
+        pc = close if prev_close is None else prev_close
+        tr = max(high - low, abs(high - pc), abs(low - pc))
+        if atr is None:
+            return (float(close), float(tr))
+        return (float(close), (atr * (self.period - 1) + tr) / self.period)
+
+    def _value(self, state):
+        return state[1]
+
+
+class StreamingMA:
+    """
+    對應 ma_series：維護視窗總和，每根 O(1) 更新
+
+    資料不足 period 根時 value 為最新價格（與批次函式相同）。
+    總和每 RESYNC_EVERY 次更新重新由視窗計算一次，避免浮點誤差累積。
+    """
+
+    RESYNC_EVERY = 1024
+
+    def __init__(self, period: int):
+        self.period = period
+        # 多保留一個值：取代最後一根時不需要找回已滑出視窗的值
+        self._values: deque = deque(maxlen=period + 1)
+        self._sum = 0.0
+        self._updates = 0
+        self.count = 0
+
+    def update(self, x, replace: bool = False):
+        x = float(x)
+        if replace and self.count > 0:
+            self._sum += x - self._values[-1]
+            self._values[-1] = x
+        else:
+            self._values.append(x)
+            self._sum += x
+            self.count += 1
+            if self.count > self.period:
+                self._sum -= self._values[0]
+        self._updates += 1
+        if self._updates % self.RESYNC_EVERY == 0:
+            self._sum = math.fsum(list(self._values)[-self.period:])
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if not self.count:
+            return None
+        if self.count < self.period:
+            return self._values[-1]
+        return self._sum / self.period
+
+    @classmethod
+    def from_history(cls, data, period: int):
+        obj = cls(period)
+        for x in np.asarray(data, dtype=float).tolist():
+            obj.update(x)
+        return obj
+
+
+class StreamingVolatility:
+    """對應 volatility_pct：最近 period 根收盤的對數報酬標準差（年化百分比）"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self._values: deque = deque(maxlen=period)
+        self.count = 0
+
+    def update(self, x, replace: bool = False):
+        if replace and self.count > 0:
+            self._values[-1] = float(x)
+        else:
+            self._values.append(float(x))
+            self.count += 1
+        return self.value
+
+    @property
+    def value(self) -> float:
+        if len(self._values) < 3:
+            return 0.0
+        logrets = np.diff(np.log(np.asarray(self._values) + 1e-12))
+        return float(np.std(logrets, ddof=1)) * math.sqrt(252) * 100
+
+
+class StreamingIndicatorSet:
+    """
+    一個 (symbol, interval) 序列的整組增量指標，快照欄位與 IndicatorEngine.snapshot() 相同
+
+    apply(candles) 會依 ts 只處理新的 candle：ts 與最後一根相同時視為取代，
+    較新的依序新增，因此可以直接餵入 market_data 增量更新後的緩衝區。
+    """
+
+    def __init__(self):
+        self.ma7 = StreamingMA(7)
+        self.ma25 = StreamingMA(25)
+        self.ema12 = StreamingEMA(12)
+        self.ema26 = StreamingEMA(26)
+        self.rsi14 = StreamingRSI(14)
+        self.macd = StreamingMACD(12, 26, 9)
+        self.atr14 = StreamingATR(14)
+        self.volatility = StreamingVolatility(14)
+        self.last_ts: Optional[int] = None
+        self.last_price: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float, replace: bool = False) -> None:
+        for ind in (self.ma7, self.ma25, self.ema12, self.ema26, self.rsi14, self.macd, self.volatility):
+            ind.update(close, replace=replace)
+        self.atr14.update(high, low, close, replace=replace)
+        self.last_price = float(close)
+
+    def apply(self, candles) -> int:
+        """套用 candles 中 ts >= 最後一根的部分，回傳處理的根數"""
+        ts = np.asarray(candles.ts)
+        start = 0 if self.last_ts is None else int(np.searchsorted(ts, self.last_ts, side="left"))
+        highs = candles.high[start:].tolist()
+        lows = candles.low[start:].tolist()
+        closes = candles.close[start:].tolist()
+        for t, h, l, c in zip(ts[start:].tolist(), highs, lows, closes):
+            self.update(h, l, c, replace=(t == self.last_ts))
+            self.last_ts = t
+        return len(closes)
+
+    @classmethod
+    def from_candles(cls, candles) -> "StreamingIndicatorSet":
+        obj = cls()
+        obj.apply(candles)
+        return obj
+
+    def snapshot(self) -> dict:
+        macd, signal = self.macd.value
+        return {
+            "last_price": self.last_price,
+            "ma7": self.ma7.value,
+            "ma25": self.ma25.value,
+            "ema12": self.ema12.value,
+            "ema26": self.ema26.value,
+            "rsi14": float(self.rsi14.value),
+            "macd": macd,
+            "signal": signal,
+            "atr": self.atr14.value,
+            "volatility_pct": self.volatility.value,
+        }
@@ -0,0 +1,165 @@
+"""
+向量化之前的指標實作（逐點迴圈），原樣取自 baseline 的 main.py，只作為對照測試的基準
+
+不要修改這裡的演算法：對照測試要證明 indicators.py 的結果與這些迴圈一致。
+"""
+import math
+
+import numpy as np
+
+
+def compute_rsi(data: list[float], period: int = 14) -> list[float]:
+    """簡單的 RSI 計算，回傳與 data 相同長度（前面用第一個有效 RSI 填補）"""
+    prices = np.array(data, dtype=float)
+    if len(prices) == 0:
+        return []
+    deltas = np.diff(prices)
+    if len(deltas) < period:
+        # 不足則回傳價格（避免 null）
+        return prices.tolist()
+    seed = deltas[:period]
+    up = seed[seed > 0].sum() / period
+    down = -seed[seed < 0].sum() / period
+    rs = up / down if down != 0 else np.inf
+    first_rsi = 100 - 100 / (1 + rs) if not math.isinf(rs) else 100.0
+    rsi_list = [first_rsi]
+    up_ema = up
+    down_ema = down
+    for d in deltas[period:]:
+        gain = max(d, 0)
+        loss = -min(d, 0)
+        up_ema = (up_ema * (period - 1) + gain) / period
+        down_ema = (down_ema * (period - 1) + loss) / period
+        rs = up_ema / down_ema if down_ema != 0 else np.inf
+        r = 100 - 100 / (1 + rs) if not math.isinf(rs) else 100.0
+        rsi_list.append(r)
+    # rsi_list 長度 = len(deltas) - period +1
+    # pad 前面 period 個值用 first_rsi
+    pad = [first_rsi] * period
+    rsi_full = pad + rsi_list
+    # 若因任何原因長度錯誤，調整
+    if len(rsi_full) < len(prices):
+        # pad tail
+        rsi_full = rsi_full + [rsi_full[-1]] * (len(prices) - len(rsi_full))
+    elif len(rsi_full) > len(prices):
+        rsi_full = rsi_full[-len(prices):]
+    return [float(x) for x in rsi_full]
+
+
+def ma_series(data: list[float], period: int) -> list[float]:
+    """返回與 data 相同長度的移動平均（leading 用第一個有效值填補）"""
+    x = np.array(data, dtype=float)
+    if len(x) == 0:
+        return []
+    if len(x) < period:
+        # 若資料不足，回傳 copy 的原價（避免 null）
+        return x.tolist()
+    # 使用卷積計算 simple MA
+    kernel = np.ones(period) / period
+    ma_valid = np.convolve(x, kernel, mode="valid")  # 長度 len(x)-period+1
+    # pad 前面的 (period-1) 個值，使用第一個有效 ma 值填補
+    pad_val = float(ma_valid[0])
+    pads = np.full(period - 1, pad_val)
+    ma_full = np.concatenate([pads, ma_valid])
+    return ma_full.tolist()
+
+
+def compute_macd(data: list[float], short: int = 12, long: int = 26, signal: int = 9):
+    """計算 MACD 與 signal，回傳兩個與 data 相同長度的陣列（前面用 0 填補）"""
+    prices = np.array(data, dtype=float)
+    n = len(prices)
+    if n == 0:
+        return [], []
+    # EMA 用公式逐步計算
+    def ema(series, period):
+        res = np.zeros(len(series))
+        k = 2 / (period + 1)
+        res[0] = series[0]
+        for i in range(1, len(series)):
+            res[i] = series[i] * k + res[i - 1] * (1 - k)
+        return res
+    if n < 1:
+        return [0.0] * n, [0.0] * n
+    ema_short = ema(prices, short)
+    ema_long = ema(prices, long)
+    macd = ema_short - ema_long
+    signal_line = ema(macd, signal)
+    return macd.tolist(), signal_line.tolist()
+
+
+def ema_series(data: list[float], period: int) -> list[float]:
+    """計算 EMA 序列（與輸入等長），初始值用第一個元素作為 seed"""
+    if not data:
+        return []
+    res = [0.0] * len(data)
+    k = 2 / (period + 1)
+    res[0] = float(data[0])
+    for i in range(1, len(data)):
+        res[i] = float(data[i]) * k + res[i - 1] * (1 - k)
+    return res
+
+
+def atr_series(highs: list[float], lows: list[float], closes: list[float], period: int = 14) -> list[float]:
+    """計算 ATR（Average True Range），回傳與輸入等長"""
+    n = len(closes)
+    if n == 0:
+        return []
+    tr = [0.0] * n
+    for i in range(n):
+        h = highs[i]
+        l = lows[i]
+        if i == 0:
+            prev_close = closes[0]
+        else:
+            prev_close = closes[i - 1]
+        tr[i] = max(h - l, abs(h - prev_close), abs(l - prev_close))
+    # ATR 使用 Wilder smoothing (EMA with k=1/period)
+    atr = [0.0] * n
+    atr[0] = tr[0]
+    alpha = 1 / period
+    for i in range(1, n):
+        atr[i] = (atr[i - 1] * (period - 1) + tr[i]) / period
+    return atr
+
+
+def volatility_pct(closes: list[float], period: int = 14) -> float:
+    """回傳最近 period 的年化波動性百分比（近似）"""
+    if not closes or len(closes) < 2:
+        return 0.0
+    import math
+    arr = np.array(closes[-period:], dtype=float)
+    logrets = np.diff(np.log(arr + 1e-12))
+    if len(logrets) < 2:
+        return 0.0
+    sd = float(np.std(logrets, ddof=1))
+    # daily-ish to annualize: 假設 timeframe 可視為日級別視為 sqrt(252)，若 intraday 則此為近似
+    annualized = sd * math.sqrt(252)
+    return annualized * 100
+
+
+def indicators_snapshot(highs: list[float], lows: list[float], closes: list[float]) -> dict:
+    """baseline analyze_one_coin 中的指標計算與 indicators_snapshot（只保留快照需要的部分）"""
+    ma7 = ma_series(closes, 7)
+    ma25 = ma_series(closes, 25)
+    ema12 = ema_series(closes, 12)
+    ema26 = ema_series(closes, 26)
+    rsi = compute_rsi(closes, period=14)
+    macd, signal = compute_macd(closes, short=12, long=26, signal=9)
+    atr = atr_series(highs, lows, closes, period=14)
+    vol_pct = volatility_pct(closes, period=14)
+
+    last_price = float(closes[-1])
+    last_atr = float(atr[-1]) if atr else 0.0
+    last_rsi = float(rsi[-1])
+    return {
+        "last_price": last_price,
+        "ma7": float(ma7[-1]) if ma7 else None,
+        "ma25": float(ma25[-1]) if ma25 else None,
+        "ema12": float(ema12[-1]) if ema12 else None,
+        "ema26": float(ema26[-1]) if ema26 else None,
+        "rsi14": float(last_rsi),
+        "macd": float(macd[-1]) if macd else None,
+        "signal": float(signal[-1]) if signal else None,
+        "atr": float(last_atr),
+        "volatility_pct": float(vol_pct),
+    }
@@ -0,0 +1,55 @@
+"""
+ewm_filter / compute_rsi 效能基準（不屬於 pytest 測試）：python backend/tests/bench_ewm.py
+
+- 分塊閉式解與逐點遞迴在 1-D 長序列、2-D 多幣種陣列上的耗時與最大相對誤差
+- compute_rsi 與 baseline 逐點迴圈（tests/baseline_indicators.py）在 200 / 2k / 100k 根 K 線上的耗時與最大相對誤差
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baseline_indicators  # noqa: E402
+from indicators import compute_rsi, ewm_filter  # noqa: E402
+from test_ewm import recursive  # noqa: E402
+
+
+def _best(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    alpha = 2 / 27
+    for label, x in (
+        ("1-D 100k", 30000 + np.cumsum(rng.normal(0, 50, 100_000))),
+        ("2-D 40x1000", 30000 + np.cumsum(rng.normal(0, 50, (40, 1000)), axis=-1)),
+    ):
+        seed = x[..., 0]
+        fast = _best(lambda: ewm_filter(x, alpha, seed))
+        slow = _best(lambda: recursive(x, alpha, seed), repeat=1)
+        err = np.max(np.abs(ewm_filter(x, alpha, seed) - recursive(x, alpha, seed).reshape(x.shape)) / np.abs(x))
+        print(f"{label:>12}: ewm_filter {fast * 1000:8.2f} ms | recursive {slow * 1000:9.2f} ms | "
+              f"x{slow / fast:6.0f} | max rel err {err:.1e}")
+
+    for n in (200, 2_000, 100_000):
+        x = 30000 + np.cumsum(rng.normal(0, 50, n))
+        data = x.tolist()
+        fast = _best(lambda: compute_rsi(x, 14))
+        slow = _best(lambda: baseline_indicators.compute_rsi(data, 14), repeat=1 if n > 10_000 else 5)
+        # RSI 介於 0~100，誤差相對於滿刻度
+        err = np.max(np.abs(compute_rsi(x, 14) - baseline_indicators.compute_rsi(data, 14)) / 100)
+        print(f"{f'RSI {n}':>12}: compute_rsi {fast * 1000:7.2f} ms | baseline  {slow * 1000:9.2f} ms | "
+              f"x{slow / fast:6.0f} | max rel err {err:.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+測試設定：後端模組是扁平放在 backend/ 下的（main.py 以 `import market_data` 的方式引用），
+這裡把 backend/ 加入 sys.path，讓測試以相同方式 import。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+"""ai_cache：正規化（只用於計算 key）與磁碟層的清理"""
+import pytest
+
+from ai_cache import AICache, format_sig, normalize
+
+
+@pytest.mark.parametrize("x, want", [
+    (111733.8, "111700"),
+    (9999.6, "10000"),
+    (48.37, "48.37"),
+    (0.0012345, "0.001234"),
+    (-12.345, "-12.35"),
+    (0.0, "0"),
+])
+def test_format_sig_never_uses_e_notation(x, want):
+    assert format_sig(x, 4) == want
+
+
+def test_normalize_rewrites_numbers_in_text_as_plain_decimals():
+    got = normalize({"p": 111733.8, "why": ["價格接近支撐 110499.2322，RSI(14)=48.4"]}, 4)
+    assert got == {"p": 111700.0, "why": ["價格接近支撐 110500，RSI(14)=48.40"]}
+
+
+def disk_count(cache):
+    return cache.stats()["disk"]["entries"]
+
+
+def test_disk_tier_is_capped_on_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(AICache, "PRUNE_EVERY", 10)
+    cache = AICache(8, 60, str(tmp_path / "ai.sqlite3"), disk_max_entries=5)
+    cache.open()
+    for i in range(50):
+        cache.set(f"k{i}", f"text {i}")
+        assert disk_count(cache) <= 5 + AICache.PRUNE_EVERY - 1
+    assert disk_count(cache) == 5
+    # 保留的是最新寫入的項目
+    assert [cache.get_disk(f"k{i}") for i in (45, 49)] == ["text 45", "text 49"]
+    assert cache.get_disk("k0") is None
+    assert cache.stats()["disk"]["evictions"] == 45
+    cache.close()
+
+
+def test_expired_rows_are_purged_on_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(AICache, "PRUNE_EVERY", 4)
+    path = str(tmp_path / "ai.sqlite3")
+    stale = AICache(8, -1, path)
+    stale.open()
+    for i in range(3):
+        stale.set(f"old{i}", "expired")
+    stale.close()
+
+    cache = AICache(8, 60, path)
+    cache.open()
+    assert disk_count(cache) == 0 and cache.disk_expired == 3
+    # 執行中才過期的項目（直接寫入已過期的到期時間）
+    for i in range(3):
+        cache._conn.execute("INSERT INTO ai_cache VALUES (?, ?, ?)", (f"late{i}", 0.0, "expired"))
+    for i in range(4):
+        cache.set(f"k{i}", "fresh")
+    assert disk_count(cache) == 4
+    assert cache.disk_expired == 6
+    cache.close()
@@ -0,0 +1,28 @@
+"""ai_jobs 的工作保留：超過上限時只淘汰已完成的工作"""
+import ai_jobs
+
+
+def test_purge_keeps_pending_and_running_jobs(monkeypatch):
+    monkeypatch.setattr(ai_jobs, "AI_JOB_MAX_JOBS", 2)
+    monkeypatch.setattr(ai_jobs, "_jobs", ai_jobs.OrderedDict())
+    jobs = [ai_jobs.AIJob(None, [("BTC", {})]) for _ in range(5)]
+    for job, status in zip(jobs, ["pending", "done", "running", "failed", "done"]):
+        job.status = status
+        ai_jobs._jobs[job.id] = job
+
+    ai_jobs._purge()
+
+    assert list(ai_jobs._jobs) == [jobs[0].id, jobs[2].id]
+
+
+def test_purge_drops_expired_finished_jobs_only(monkeypatch):
+    monkeypatch.setattr(ai_jobs, "_jobs", ai_jobs.OrderedDict())
+    pending, done = ai_jobs.AIJob(None, []), ai_jobs.AIJob(None, [])
+    done.status = "done"
+    for job in (pending, done):
+        job.expires_at = 0
+        ai_jobs._jobs[job.id] = job
+
+    ai_jobs._purge()
+
+    assert list(ai_jobs._jobs) == [pending.id]
@@ -0,0 +1,23 @@
+"""ai_scheduler.priority_of：只接受具名的優先順序"""
+import pytest
+
+from ai_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, priority_of
+
+
+@pytest.mark.parametrize("value, want", [
+    ("interactive", PRIORITY_INTERACTIVE),
+    (" Background ", PRIORITY_BACKGROUND),
+    ("normal", PRIORITY_NORMAL),
+    (None, PRIORITY_NORMAL),
+    ("urgent", PRIORITY_NORMAL),
+    (-100, PRIORITY_NORMAL),
+    (999, PRIORITY_NORMAL),
+    (True, PRIORITY_NORMAL),
+])
+def test_only_named_priorities_are_accepted(value, want):
+    assert priority_of(value) == want
+
+
+def test_highest_caps_client_priority():
+    assert priority_of("interactive", PRIORITY_NORMAL, highest=PRIORITY_NORMAL) == PRIORITY_NORMAL
+    assert priority_of("background", PRIORITY_NORMAL, highest=PRIORITY_NORMAL) == PRIORITY_BACKGROUND
@@ -0,0 +1,235 @@
+"""ai_service：快取 key 與提示內容、合併請求的解析與逐幣種退回、串流的取消（以假的 model 取代 Gemini）"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ai_service
+from ai_cache import AICache
+from singleflight import SingleFlight
+
+
+class FakeModel:
+    """gemini_pool.KeyedModel 的替身：記錄收到的提示，回應由 reply(prompt) 決定"""
+
+    model_name = "fake"
+
+    def __init__(self, reply=lambda prompt: "analysis"):
+        self.reply = reply
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        text = self.reply(prompt)
+        if isinstance(text, Exception):
+            raise text
+        return text if stream else SimpleNamespace(text=text)
+
+    async def acquire(self, priority=0, tokens=0):
+        return 0.0
+
+    def release(self):
+        pass
+
+    def penalize(self, seconds):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fresh_service(monkeypatch):
+    monkeypatch.setattr(ai_service, "_cache", AICache(64, 60))
+    monkeypatch.setattr(ai_service, "_flight", SingleFlight("ai-test"))
+    monkeypatch.setattr(ai_service, "_counters", dict.fromkeys(ai_service._counters, 0))
+    yield
+    asyncio.run(ai_service.shutdown())
+
+
+def run(coro):
+    async def main():
+        await ai_service.startup()
+        return await coro
+    return asyncio.run(main())
+
+
+def context(price=111733.8, **overrides):
+    ctx = {
+        "last_price": price,
+        "indicators": {"rsi14": 48.37, "macd": -12.345, "signal": -10.5, "atr": 812.7,
+                       "volatility_pct": 41.2, "ma7": 111650.25, "ma25": 110980.5},
+        "trend": "上升",
+        "support_resistance": {"support": [108123.45, 109456.78, 110321.9],
+                               "resistance": [112345.6, 113210.4, 114876.3]},
+        "rationale": ["RSI(14)=48.4", f"價格接近支撐 {price - 1234.5678:.4f}，風險回報較佳。"],
+        "action": "小額買入",
+        "risk": "medium",
+    }
+    ctx.update(overrides)
+    return ctx
+
+
+def test_prompt_uses_original_values_not_the_normalized_key():
+    model = FakeModel()
+    run(ai_service.generate_batch(model, [("BTC", context())]))
+    (prompt,) = model.prompts
+    assert "Current Price: $111733.80" in prompt
+    assert "108123.45" in prompt and "114876.3" in prompt
+    assert "價格接近支撐 110499.2322" in prompt
+    assert "e+" not in prompt
+
+
+def test_batched_prompt_uses_original_values():
+    model = FakeModel(lambda p: '{"BTC": "a", "ETH": "b"}')
+    run(ai_service.generate_batch(model, [("BTC", context()), ("ETH", context(price=3456.789))]))
+    (prompt,) = model.prompts
+    assert "Current Price: $111733.80" in prompt and "Current Price: $3456.79" in prompt
+    assert "價格接近支撐 2222.2212" in prompt
+
+
+def test_small_price_moves_still_hit_the_cache():
+    model = FakeModel()
+    first = run(ai_service.generate_batch(model, [("BTC", context(111733.8))]))
+    second = run(ai_service.generate_batch(model, [("BTC", context(111741.2))]))
+    assert first == second == ["analysis"]
+    assert len(model.prompts) == 1
+
+
+COINS = ["BTC", "ETH", "SOL"]
+
+
+@pytest.mark.parametrize("raw, want", [
+    ('{"BTC": "a", "ETH": "b", "SOL": "c"}', {"BTC": "a", "ETH": "b", "SOL": "c"}),
+    ('```json\n{"BTC": " a ", "ETH": "b"}\n```', {"BTC": "a", "ETH": "b"}),
+    ('Here you go:\n{"BTC": "a"}\nThanks', {"BTC": "a"}),
+    ('{"BTC": ["1. x", "2. y"], "ETH": "", "SOL": null, "DOGE": "extra"}', {"BTC": "1. x\n2. y"}),
+    ('{"BTC": 42, "ETH": {"text": "b"}, "SOL": "   "}', {}),
+])
+def test_parse_batch_response_keeps_only_usable_coins(raw, want):
+    assert ai_service.parse_batch_response(raw, COINS) == want
+
+
+@pytest.mark.parametrize("raw", [
+    "抱歉，我無法提供建議。",
+    '{"BTC": "a", "ETH": "b',            # 截斷的 JSON
+    '{"BTC": "a",, "ETH": "b"}',         # 格式錯誤
+    '["BTC", "ETH"]',
+    "```json\n```",
+])
+def test_parse_batch_response_rejects_malformed_json(raw):
+    with pytest.raises(ValueError):
+        ai_service.parse_batch_response(raw, COINS)
+
+
+def batch_model(batch_reply):
+    """合併提示回傳 batch_reply，單幣提示回傳 "single <幣種價格>"（以提示中的價格辨識幣種）"""
+    def reply(prompt):
+        if "Respond with ONLY a JSON object" in prompt:
+            return batch_reply
+        return "single " + prompt.split("Current Price: $", 1)[1].split("\n", 1)[0]
+    return FakeModel(reply)
+
+
+ITEMS = [("BTC", context(111733.8)), ("ETH", context(3456.789)), ("SOL", context(171.234))]
+
+
+def test_batch_response_is_split_per_coin():
+    model = batch_model('{"BTC": "b", "ETH": "e", "SOL": "s"}')
+    published = {}
+    texts = run(ai_service.generate_batch(model, ITEMS, on_result=published.__setitem__))
+    assert texts == ["b", "e", "s"]
+    assert published == {0: "b", 1: "e", 2: "s"}
+    assert len(model.prompts) == 1
+
+
+def test_missing_coins_fall_back_to_single_calls():
+    model = batch_model('{"BTC": "b", "SOL": ""}')
+    texts = run(ai_service.generate_batch(model, ITEMS))
+    assert texts == ["b", "single 3456.79", "single 171.23"]
+    assert len(model.prompts) == 3
+    assert ai_service._counters["batch_fallbacks"] == 2
+
+
+def test_malformed_batch_response_falls_back_for_every_coin():
+    model = batch_model('{"BTC": "b", "ETH"')
+    texts = run(ai_service.generate_batch(model, ITEMS))
+    assert texts == ["single 111733.80", "single 3456.79", "single 171.23"]
+    assert ai_service._counters["batch_fallbacks"] == 3
+
+
+def test_fallback_results_are_cached():
+    model = batch_model('{"BTC": "b"}')
+    run(ai_service.generate_batch(model, ITEMS))
+    calls = len(model.prompts)
+    assert run(ai_service.generate_batch(model, ITEMS)) == ["b", "single 3456.79", "single 171.23"]
+    assert len(model.prompts) == calls
+
+
+def test_failed_batch_call_does_not_fan_out():
+    model = batch_model(RuntimeError("500 internal error"))
+    texts = run(ai_service.generate_batch(model, ITEMS))
+    assert texts == [ai_service.format_ai_error(RuntimeError("500 internal error"))] * 3
+    assert len(model.prompts) == 1
+    assert ai_service._counters["batch_fallbacks"] == 0
+
+
+def test_no_model_returns_none_per_coin():
+    assert run(ai_service.generate_batch(None, ITEMS)) == [None, None, None]
+
+
+class FakeStream:
+    """
+    串流回應的替身：與 google-generativeai 相同，底層呼叫放在 _iterator（cancel() 可從任何執行緒呼叫）。
+    送完 chunks 後 hang=True 時一直等到被取消（模擬上游遲遲沒有下一個片段）
+    """
+
+    def __init__(self, chunks, hang=False):
+        self.chunks = chunks
+        self.hang = hang
+        self.cancelled = threading.Event()
+        self._iterator = SimpleNamespace(cancel=self.cancelled.set)
+
+    def __iter__(self):
+        for text in self.chunks:
+            yield SimpleNamespace(text=text)
+        if self.hang:
+            self.cancelled.wait(10)
+            raise RuntimeError("stream cancelled")
+
+
+async def collect(gen):
+    return [text async for text in gen]
+
+
+def test_disconnect_cancels_the_upstream_stream_immediately():
+    stream = FakeStream(["第一段"], hang=True)
+    model = FakeModel(lambda p: stream)
+
+    async def main():
+        gen = ai_service.stream_analysis(model, "BTC", context())
+        assert await gen.__anext__() == "第一段"
+        await gen.aclose()
+        deadline = time.monotonic() + 2
+        while ai_service._counters["running"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    run(main())
+    assert stream.cancelled.is_set()
+    assert ai_service._counters["running"] == 0
+    assert ai_service._counters["streams_cancelled"] == 1
+    assert ai_service._cache.get_memory(ai_service._cache_key(model, "BTC", context())) is None
+
+
+def test_completed_stream_is_cached():
+    model = FakeModel(lambda p: FakeStream(["前段", "後段"]))
+    assert run(collect(ai_service.stream_analysis(model, "BTC", context()))) == ["前段", "後段"]
+    assert run(collect(ai_service.stream_analysis(model, "BTC", context()))) == ["前段後段"]
+    assert len(model.prompts) == 1
+
+
+def test_empty_stream_is_not_cached():
+    model = FakeModel(lambda p: FakeStream(["", ""]))
+    assert run(collect(ai_service.stream_analysis(model, "BTC", context()))) == []
+    assert ai_service._cache.get_memory(ai_service._cache_key(model, "BTC", context())) is None
+    run(collect(ai_service.stream_analysis(model, "BTC", context())))
+    assert len(model.prompts) == 2
@@ -0,0 +1,58 @@
+"""BatchIndicatorEngine（多幣種 2-D 一次計算）與逐幣種 IndicatorEngine 的結果必須完全相同"""
+import numpy as np
+import pytest
+
+from indicators import BatchIndicatorEngine, IndicatorEngine
+from market_data import Candles
+
+
+def candles(n, seed=0, start=30000.0):
+    rng = np.random.default_rng(seed)
+    close = start + np.cumsum(rng.normal(0, start / 600, n))
+    high = close + rng.uniform(0, start / 400, n)
+    low = close - rng.uniform(0, start / 400, n)
+    ts = 1_700_000_000_000 + 3_600_000 * np.arange(n, dtype=np.int64)
+    return Candles(ts, close.copy(), high, low, close, rng.uniform(1, 100, n))
+
+
+def assert_same_as_single(batch: IndicatorEngine, c: Candles) -> None:
+    """analyze_one_coin 從 engine 讀取的所有值都與單獨計算的結果逐位元相同"""
+    single = IndicatorEngine(c)
+    n = len(c)
+    assert batch.snapshot() == single.snapshot()
+    assert batch.support_resistance(min(200, n), 3) == single.support_resistance(min(200, n), 3)
+    assert batch.trend() == single.trend()
+    for name, args in (("ma", (7,)), ("ma", (25,)), ("ema", (12,)), ("ema", (26,)),
+                       ("rsi", (14,)), ("atr", (14,)), ("true_range", ())):
+        np.testing.assert_array_equal(getattr(batch, name)(*args), getattr(single, name)(*args), err_msg=name)
+    for got, want in zip(batch.macd(), single.macd()):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_equal_lengths_match_single_coin_path():
+    coins = [candles(200, seed=s, start=10.0 ** (s % 5)) for s in range(12)]
+    engines = BatchIndicatorEngine(coins).engines()
+    assert len(engines) == len(coins)
+    for engine, c in zip(engines, coins):
+        assert engine.candles is c
+        assert_same_as_single(engine, c)
+
+
+# 長度不一（依長度分組）；含 baseline 分析的最低根數 10、RSI 不足 14 個差分、MA25 / EMA26 邊界
+@pytest.mark.parametrize("lengths", [
+    [200, 150, 200, 37, 150, 1000],
+    [10, 11, 14, 15, 25, 26, 27],
+    [3, 1, 2, 200],
+])
+def test_ragged_and_short_series_match_single_coin_path(lengths):
+    coins = [candles(n, seed=i) for i, n in enumerate(lengths)]
+    for engine, c in zip(BatchIndicatorEngine(coins).engines(), coins):
+        assert_same_as_single(engine, c)
+
+
+def test_empty_candles_keep_their_slot():
+    coins = [candles(100, seed=1), Candles.empty(), candles(100, seed=2)]
+    engines = BatchIndicatorEngine(coins).engines()
+    assert len(engines[1]) == 0
+    assert_same_as_single(engines[0], coins[0])
+    assert_same_as_single(engines[2], coins[2])
@@ -0,0 +1,65 @@
+"""chart_renderer 的排隊與逾時：逾時只計算實際渲染時間，只重建送出時仍是目前的行程池"""
+import asyncio
+import time
+
+import pytest
+
+import chart_renderer
+
+
+def _sleep(seconds: float) -> bytes:
+    time.sleep(seconds)
+    return b"png"
+
+
+def _no_warmup() -> None:
+    pass
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    monkeypatch.setattr(chart_renderer, "CHART_RENDER_WORKERS", 1)
+    monkeypatch.setattr(chart_renderer, "CHART_RENDER_QUEUE_MAX", 8)
+    monkeypatch.setattr(chart_renderer, "CHART_RENDER_TIMEOUT", 1.0)
+    monkeypatch.setattr(chart_renderer, "_warm_worker", _no_warmup)
+    monkeypatch.setattr(chart_renderer, "_counters", dict.fromkeys(chart_renderer._counters, 0))
+    yield chart_renderer
+    asyncio.run(chart_renderer.shutdown())
+
+
+def test_queue_wait_does_not_count_towards_timeout(renderer):
+    async def main():
+        await renderer.startup()
+        # 三個 0.6s 的渲染共用一個行程：最後一個排隊 1.2s，但本身只渲染 0.6s
+        return await asyncio.gather(*(renderer.render(_sleep, 0.6) for _ in range(3)))
+
+    assert asyncio.run(main()) == [b"png"] * 3
+    assert renderer.stats()["timeouts"] == 0
+    assert renderer.stats()["restarts"] == 0
+
+
+def test_timeout_restarts_once_and_queued_renders_survive(renderer):
+    async def main():
+        await renderer.startup()
+        hung = asyncio.ensure_future(renderer.render(_sleep, 30))
+        await asyncio.sleep(0.1)
+        queued = [renderer.render(_sleep, 0.1) for _ in range(2)]
+        return await asyncio.gather(hung, *queued, return_exceptions=True)
+
+    hung, *queued = asyncio.run(main())
+    assert isinstance(hung, asyncio.TimeoutError)
+    assert queued == [b"png", b"png"]
+    assert renderer.stats()["restarts"] == 1
+
+
+def test_render_on_discarded_pool_is_unavailable(renderer):
+    async def main():
+        await renderer.startup()
+        job = asyncio.ensure_future(renderer.render(_sleep, 30))
+        await asyncio.sleep(0.5)
+        renderer._restart_pool()
+        return await asyncio.gather(job, return_exceptions=True)
+
+    (result,) = asyncio.run(main())
+    assert isinstance(result, renderer.RenderUnavailable)
+    assert renderer.stats()["restarts"] == 1
@@ -0,0 +1,81 @@
+"""ewm_filter（分塊閉式解）與逐點遞迴的對照"""
+import math
+
+import numpy as np
+import pytest
+
+from indicators import ewm_filter
+
+ALPHAS = [2 / 3, 2 / 13, 2 / 27, 1 / 14, 2 / 201]
+
+
+def recursive(x, alpha, seed):
+    """基準：y[i] = (1 - alpha) * y[i-1] + alpha * x[i]，y[-1] = seed"""
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    seeds = np.broadcast_to(np.asarray(seed, dtype=float), (x.shape[0],))
+    out = np.empty_like(x)
+    for r in range(x.shape[0]):
+        prev = seeds[r]
+        for i, v in enumerate(x[r]):
+            prev = (1 - alpha) * prev + alpha * v
+            out[r, i] = prev
+    return out
+
+
+def chunk_len(alpha):
+    return int(max(1, math.log(1e-3) / math.log(1 - alpha)))
+
+
+def series(n, rows=None, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (n,) if rows is None else (rows, n)
+    return 30000 + np.cumsum(rng.normal(0, 50, size=shape), axis=-1)
+
+
+@pytest.mark.parametrize("alpha", ALPHAS)
+def test_matches_recursive_across_chunk_boundaries(alpha):
+    c = chunk_len(alpha)
+    for n in sorted({1, 2, c - 1, c, c + 1, 2 * c, 2 * c + 1, 7 * c + 3, 3000}):
+        if n < 1:
+            continue
+        x = series(n, seed=n)
+        got = ewm_filter(x, alpha, x[0])
+        want = recursive(x, alpha, x[0])[0]
+        np.testing.assert_allclose(got, want, rtol=1e-12, atol=0, err_msg=f"alpha={alpha} n={n}")
+
+
+@pytest.mark.parametrize("alpha", ALPHAS)
+def test_2d_rows_with_per_row_seed(alpha):
+    x = series(2 * chunk_len(alpha) + 5, rows=4, seed=1)
+    seeds = x[:, 0] * np.array([1.0, 0.5, 2.0, 1.1])
+    got = ewm_filter(x, alpha, seeds)
+    assert got.shape == x.shape
+    np.testing.assert_allclose(got, recursive(x, alpha, seeds), rtol=1e-12, atol=0)
+    for r in range(x.shape[0]):
+        np.testing.assert_array_equal(got[r], ewm_filter(x[r], alpha, seeds[r]))
+
+
+@pytest.mark.parametrize("alpha", ALPHAS)
+def test_nan_leading_input_matches_recursive(alpha):
+    c = chunk_len(alpha)
+    for lead in (1, c - 1, c, c + 2):
+        x = series(3 * c + 7, seed=lead)
+        x[:lead] = np.nan
+        got = ewm_filter(x, alpha, 0.0)
+        want = recursive(x, alpha, 0.0)[0]
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(want))
+
+
+def test_nan_leading_rows_do_not_leak_into_other_rows():
+    alpha = 2 / 27
+    x = series(200, rows=3, seed=2)
+    x[1, :10] = np.nan
+    got = ewm_filter(x, alpha, x[:, 0])
+    assert np.isnan(got[1]).all()
+    np.testing.assert_allclose(got[[0, 2]], recursive(x[[0, 2]], alpha, x[[0, 2], 0]), rtol=1e-12, atol=0)
+
+
+def test_alpha_one_and_empty():
+    x = series(10)
+    np.testing.assert_array_equal(ewm_filter(x, 1.0, 0.0), x)
+    assert ewm_filter(np.array([]), 0.5, 0.0).shape == (0,)
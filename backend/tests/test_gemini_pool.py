@@ -0,0 +1,39 @@
+"""gemini_pool / ai_service 依賴的 google-generativeai 內部介面（升級 SDK 時這裡會先失敗）"""
+import inspect
+
+import pytest
+
+genai = pytest.importorskip("google.generativeai")
+
+import gemini_pool  # noqa: E402
+from google.generativeai import client as genai_client  # noqa: E402
+
+
+def test_client_manager_internals_exist():
+    manager = genai_client._ClientManager()
+    assert callable(manager.configure)
+    assert callable(manager.make_client)
+
+
+def test_generate_content_uses_per_model_client():
+    model = genai.GenerativeModel(gemini_pool.GEMINI_MODEL_NAME)
+    assert hasattr(model, "_client")
+    assert "self._client" in inspect.getsource(type(model).generate_content)
+
+
+def test_make_model_binds_its_own_client():
+    a = gemini_pool._make_model("key-a")
+    b = gemini_pool._make_model("key-b")
+    assert a._client is not None and b._client is not None
+    assert a._client is not b._client
+
+
+def test_stream_response_keeps_the_cancellable_call():
+    # ai_service._close_stream 以 GenerateContentResponse._iterator.cancel() 中斷上游串流
+    from google.generativeai.types import generation_types
+
+    from google.generativeai import protos
+
+    call = iter([protos.GenerateContentResponse(), protos.GenerateContentResponse()])
+    response = generation_types.GenerateContentResponse.from_iterator(call)
+    assert response._iterator is call
@@ -0,0 +1,131 @@
+"""indicators.py 的向量化指標與 baseline 逐點迴圈（tests/baseline_indicators.py）的對照"""
+import numpy as np
+import pytest
+
+import baseline_indicators as baseline
+import indicators
+from market_data import Candles
+
+
+def prices(n, seed=0, start=30000.0, step=50.0):
+    rng = np.random.default_rng(seed)
+    return start + np.cumsum(rng.normal(0, step, n))
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 14, 15, 16, 200, 2000, 20000])
+@pytest.mark.parametrize("period", [2, 14, 30])
+def test_rsi_matches_baseline_loop(n, period):
+    x = prices(n, seed=n + period)
+    got = indicators.compute_rsi(x, period)
+    want = baseline.compute_rsi(x.tolist(), period)
+    assert got.shape == (n,)
+    np.testing.assert_allclose(got, want, rtol=1e-12, atol=1e-10)
+
+
+@pytest.mark.parametrize("x", [
+    np.arange(1.0, 100.0),          # 只漲：down 為 0，RSI 為 100
+    np.arange(100.0, 1.0, -1.0),    # 只跌：RSI 為 0
+    np.full(60, 42.0),              # 不動：up、down 皆為 0
+    np.r_[np.arange(1.0, 30.0), np.full(40, 29.0)],  # 上漲後持平
+])
+def test_rsi_matches_baseline_on_degenerate_series(x):
+    np.testing.assert_allclose(indicators.compute_rsi(x), baseline.compute_rsi(x.tolist()), rtol=1e-12, atol=1e-10)
+
+
+def test_rsi_2d_rows_match_baseline():
+    x = np.stack([prices(500, seed=s, start=10.0 ** s, step=10.0 ** (s - 2)) for s in range(1, 6)])
+    got = indicators.compute_rsi(x)
+    for row, want in zip(got, x):
+        np.testing.assert_allclose(row, baseline.compute_rsi(want.tolist()), rtol=1e-12, atol=1e-10)
+
+
+def ohlc(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = prices(n, seed=seed)
+    high = close + rng.uniform(0, 80, n)
+    low = close - rng.uniform(0, 80, n)
+    return high, low, close
+
+
+def price_atol(x):
+    """差值型指標（MACD、ATR）在接近 0 時相對誤差沒有意義，改以價格量級的絕對誤差比較"""
+    return 1e-12 * float(np.max(np.abs(x))) if len(x) else 0.0
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 9, 26, 27, 300, 20000])
+def test_macd_matches_baseline_loop(n):
+    x = prices(n, seed=n)
+    macd, signal = indicators.compute_macd(x, 12, 26, 9)
+    want_macd, want_signal = baseline.compute_macd(x.tolist(), 12, 26, 9)
+    np.testing.assert_allclose(macd, want_macd, rtol=1e-9, atol=price_atol(x))
+    np.testing.assert_allclose(signal, want_signal, rtol=1e-9, atol=price_atol(x))
+
+
+def test_macd_near_zero_matches_baseline_with_absolute_tolerance():
+    # 價格在 30000 附近小幅震盪：MACD 反覆穿越 0，相對誤差在 0 附近會放大
+    t = np.arange(3000)
+    x = 30000 + 0.5 * np.sin(t / 17) + np.random.default_rng(1).normal(0, 0.01, len(t))
+    macd, signal = indicators.compute_macd(x)
+    want_macd, want_signal = baseline.compute_macd(x.tolist())
+    assert np.sign(want_macd).min() < 0 < np.sign(want_macd).max()
+    np.testing.assert_allclose(macd, want_macd, rtol=0, atol=price_atol(x))
+    np.testing.assert_allclose(signal, want_signal, rtol=0, atol=price_atol(x))
+
+
+@pytest.mark.parametrize("period", [7, 12, 26, 200])
+def test_ema_and_ma_match_baseline(period):
+    x = prices(5000, seed=period)
+    np.testing.assert_allclose(indicators.ema_series(x, period), baseline.ema_series(x.tolist(), period), rtol=1e-12)
+    np.testing.assert_allclose(indicators.ma_series(x, period), baseline.ma_series(x.tolist(), period), rtol=1e-12)
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 14, 15, 300, 20000])
+@pytest.mark.parametrize("period", [2, 14])
+def test_atr_matches_baseline_loop(n, period):
+    high, low, close = ohlc(n, seed=n + period)
+    got = indicators.atr_series(high, low, close, period)
+    want = baseline.atr_series(high.tolist(), low.tolist(), close.tolist(), period)
+    assert got.shape == (n,)
+    np.testing.assert_allclose(got, want, rtol=1e-12, atol=price_atol(close))
+
+
+def test_macd_and_atr_2d_rows_match_baseline():
+    rows = [ohlc(800, seed=s) for s in range(6)]
+    high, low, close = (np.stack(col) for col in zip(*rows))
+    macd, signal = indicators.compute_macd(close)
+    atr = indicators.atr_series(high, low, close)
+    for r, (h, l, c) in enumerate(rows):
+        want_macd, want_signal = baseline.compute_macd(c.tolist())
+        np.testing.assert_allclose(macd[r], want_macd, rtol=1e-9, atol=price_atol(c))
+        np.testing.assert_allclose(signal[r], want_signal, rtol=1e-9, atol=price_atol(c))
+        np.testing.assert_allclose(atr[r], baseline.atr_series(h.tolist(), l.tolist(), c.tolist()), rtol=1e-12)
+
+
+def make_candles(n, seed=0):
+    high, low, close = ohlc(n, seed)
+    ts = 1_700_000_000_000 + 3_600_000 * np.arange(n, dtype=np.int64)
+    return Candles(ts, close.copy(), high, low, close, np.ones(n))
+
+
+def assert_snapshot_matches(got: dict, want: dict, close) -> None:
+    assert set(got) == set(want) == set(indicators.SNAPSHOT_FIELDS)
+    for key, value in want.items():
+        assert type(got[key]) is type(value), key
+        tol = 1e-12 if key in ("rsi14", "volatility_pct") else price_atol(close)
+        assert got[key] == pytest.approx(value, rel=1e-9, abs=tol), key
+
+
+# baseline 的 analyze_one_coin 至少要 10 根才計算；25 / 26 為 MA25 與 EMA26 的邊界
+@pytest.mark.parametrize("n", [10, 14, 15, 25, 26, 27, 200, 1000])
+def test_engine_snapshot_matches_baseline(n):
+    candles = make_candles(n, seed=n)
+    got = indicators.IndicatorEngine(candles).snapshot()
+    want = baseline.indicators_snapshot(candles.high.tolist(), candles.low.tolist(), candles.close.tolist())
+    assert_snapshot_matches(got, want, candles.close)
+
+
+def test_engine_snapshot_fields_subset():
+    candles = make_candles(300, seed=5)
+    full = indicators.IndicatorEngine(candles).snapshot()
+    partial = indicators.IndicatorEngine(candles).snapshot(fields=["rsi14", "atr"])
+    assert partial == {"rsi14": full["rsi14"], "atr": full["atr"]}
@@ -0,0 +1,82 @@
+"""market_data 分頁抓取：空頁、錯誤、重試與上市時間"""
+import asyncio
+
+import httpx
+import pytest
+
+import bybit_client
+import market_data
+
+IV = 3_600_000
+LISTING = 1_000 * IV
+NOW = 5_000 * IV
+
+
+def _rows(start: int, end: int, limit: int) -> list:
+    """Bybit 格式（最新到最舊），只有 LISTING 之後才有資料"""
+    t = min(end, NOW - 1) // IV * IV
+    rows = []
+    while len(rows) < limit and t >= max(start, LISTING):
+        rows.append([str(t), "1", "2", "0.5", "1.5", "10", "15"])
+        t -= IV
+    return rows
+
+
+@pytest.fixture
+def bybit(monkeypatch):
+    """
+    以假的 get_kline 取代 Bybit；calls 記錄請求，errors 依序提供要回傳的錯誤回應，
+    down 設定時每個請求都回傳它
+    """
+    state = {"calls": [], "errors": [], "down": None}
+
+    async def get_kline(params):
+        state["calls"].append(params)
+        if state["down"] is not None:
+            return state["down"]
+        if state["errors"]:
+            return state["errors"].pop(0)
+        if params["symbol"] == "NOPEUSDT":
+            return httpx.Response(200, json={"retCode": 10001, "retMsg": "params error: symbol invalid"})
+        rows = _rows(params["start"], params["end"], params["limit"])
+        return httpx.Response(200, json={"retCode": 0, "retMsg": "OK", "result": {"list": rows}})
+
+    monkeypatch.setattr(bybit_client, "get_kline", get_kline)
+    monkeypatch.setattr(market_data.time, "time", lambda: NOW / 1000)
+    monkeypatch.setattr(market_data, "_store", None)
+    monkeypatch.setattr(market_data, "KLINE_PAGE_RETRY_BACKOFF", 0.0)
+    market_data._first_ts.clear()
+    yield state
+    market_data._first_ts.clear()
+
+
+def test_pages_before_listing_are_empty_and_skipped_afterwards(bybit):
+    start = LISTING - 3000 * IV
+    candles = asyncio.run(market_data.get_range("BTCUSDT", "60", start, LISTING + 1999 * IV))
+    assert len(candles) == 2000 and candles.ts[0] == LISTING
+    assert market_data._first_ts[("BTCUSDT", "60")] == LISTING
+
+    bybit["calls"].clear()
+    again = asyncio.run(market_data.get_range("BTCUSDT", "60", start, LISTING + 1999 * IV))
+    assert len(again) == 2000
+    assert all(call["end"] >= LISTING for call in bybit["calls"])
+
+
+def test_rate_limited_page_is_retried(bybit):
+    bybit["errors"] = [httpx.Response(429), httpx.Response(200, json={"retCode": 10006, "retMsg": "Too many visits"})]
+    candles = asyncio.run(market_data.get_range("BTCUSDT", "60", LISTING, LISTING + 2999 * IV))
+    assert len(candles) == 3000
+
+
+def test_persistent_error_is_raised_instead_of_returning_gaps(bybit, monkeypatch):
+    monkeypatch.setattr(market_data, "KLINE_PAGE_RETRIES", 1)
+    bybit["down"] = httpx.Response(503)
+    with pytest.raises(market_data.KlineError) as exc:
+        asyncio.run(market_data.get_range("BTCUSDT", "60", LISTING, LISTING + 2999 * IV))
+    assert exc.value.status == 503
+
+
+def test_invalid_symbol_is_a_client_error(bybit):
+    with pytest.raises(market_data.KlineError) as exc:
+        asyncio.run(market_data.get_range("NOPEUSDT", "60", LISTING, LISTING + 10 * IV))
+    assert exc.value.status == 400 and not exc.value.retryable
@@ -0,0 +1,70 @@
+"""RollingPercentile / rolling_support_resistance 與批次 np.percentile 的對照"""
+import numpy as np
+import pytest
+
+from indicators import IndicatorEngine, RollingPercentile, rolling_support_resistance, support_resistance_simple
+from market_data import Candles
+
+QS = [10, 25, 40, 60, 75, 90]
+
+
+def prices(n, seed=0):
+    rng = np.random.default_rng(seed)
+    x = 100 + np.cumsum(rng.normal(0, 1, n))
+    # 刻意製造重複值（bisect 移除時要移除正確的那一個）
+    x[::7] = np.round(x[::7])
+    return x
+
+
+@pytest.mark.parametrize("window", [1, 2, 5, 50, 200])
+def test_matches_np_percentile_on_every_window(window):
+    x = prices(600, seed=window)
+    rolling = RollingPercentile(window, QS)
+    for i, v in enumerate(x):
+        got = rolling.update(v)
+        want = np.percentile(x[max(0, i - window + 1):i + 1], QS).tolist()
+        assert got == want, i
+
+
+def test_replace_updates_last_value_in_place():
+    x = prices(120, seed=1)
+    rolling = RollingPercentile(50, QS)
+    for v in x[:-1]:
+        rolling.update(v)
+    rolling.update(x[-1] + 5.0)
+    got = rolling.update(x[-1], replace=True)
+    assert got == np.percentile(x[-50:], QS).tolist()
+    assert rolling.count == len(x)
+
+
+@pytest.mark.parametrize("levels", [1, 3])
+def test_rolling_support_resistance_matches_simple_at_every_bar(levels):
+    x = prices(400, seed=2)
+    series = rolling_support_resistance(x, lookback=50, levels=levels)
+    assert series["support"].shape == (400, levels)
+    for i in (0, 1, 48, 49, 50, 237, 399):
+        want = support_resistance_simple(x[:i + 1], 50, levels)
+        assert series["support"][i].tolist() == want["support"]
+        assert series["resistance"][i].tolist() == want["resistance"]
+
+
+def test_engine_series_last_row_matches_snapshot_levels():
+    x = prices(300, seed=3)
+    candles = Candles(np.arange(300, dtype=np.int64), x, x + 1, x - 1, x, np.ones(300))
+    engine = IndicatorEngine(candles)
+    series = engine.support_resistance_series(200, 3)
+    last = engine.support_resistance(200, 3)
+    assert series["support"][-1].tolist() == last["support"]
+    assert series["resistance"][-1].tolist() == last["resistance"]
+
+
+def test_chart_data_sr_overlay_is_the_engine_series():
+    from chart_generator import build_chart_data
+
+    x = prices(300, seed=4)
+    candles = Candles(np.arange(300, dtype=np.int64), x, x + 1, x - 1, x, np.ones(300))
+    data = build_chart_data(candles, "sr")
+    last = IndicatorEngine(candles).support_resistance(200, 3)
+    assert sorted(data["overlays"]) == ["resistance1", "resistance2", "resistance3", "support1", "support2", "support3"]
+    assert [data["overlays"][f"support{i}"][-1] for i in (1, 2, 3)] == last["support"]
+    assert [data["overlays"][f"resistance{i}"][-1] for i in (1, 2, 3)] == last["resistance"]
@@ -0,0 +1,142 @@
+"""streaming_indicators 的增量更新與 indicators.py 批次函式的對照（逐根重播同一段序列）"""
+import numpy as np
+import pytest
+
+import indicators
+from market_data import Candles
+from streaming_indicators import (
+    StreamingATR,
+    StreamingEMA,
+    StreamingIndicatorSet,
+    StreamingMA,
+    StreamingMACD,
+    StreamingRSI,
+    StreamingVolatility,
+)
+
+N = 600
+
+
+def ohlc(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.normal(0, 50, n))
+    return close + rng.uniform(0, 80, n), close - rng.uniform(0, 80, n), close
+
+
+def replay(indicator, *series):
+    return [indicator.update(*bar) for bar in zip(*(s.tolist() for s in series))]
+
+
+@pytest.mark.parametrize("period", [2, 12, 26])
+def test_ema_matches_batch(period):
+    _, _, x = ohlc(N, seed=period)
+    np.testing.assert_allclose(replay(StreamingEMA(period), x), indicators.ema(x, period), rtol=1e-12)
+
+
+@pytest.mark.parametrize("period", [7, 25])
+def test_ma_matches_batch(period):
+    _, _, x = ohlc(N, seed=period)
+    got = replay(StreamingMA(period), x)
+    batch = indicators.ma_series(x, period)
+    # 資料不足 period 根時為最新價格（與對前綴呼叫 ma_series 相同），之後與整段序列一致
+    np.testing.assert_allclose(got[:period - 1], x[:period - 1])
+    np.testing.assert_allclose(got[period - 1:], batch[period - 1:], rtol=1e-12)
+
+
+def test_ma_resync_keeps_long_replays_exact():
+    _, _, x = ohlc(3 * StreamingMA.RESYNC_EVERY, seed=1)
+    got = replay(StreamingMA(25), x)
+    np.testing.assert_allclose(got[-1], indicators.ma_series(x, 25)[-1], rtol=1e-13)
+
+
+@pytest.mark.parametrize("period", [2, 14])
+def test_rsi_matches_wilder_batch(period):
+    _, _, x = ohlc(N, seed=period)
+    got = replay(StreamingRSI(period), x)
+    batch = indicators.compute_rsi(x, period)
+    # 差分不足 period 個時 compute_rsi 回傳價格本身；之後逐根與整段序列一致
+    np.testing.assert_allclose(got[:period], x[:period])
+    np.testing.assert_allclose(got[period:], batch[period:], rtol=1e-12, atol=1e-10)
+
+
+def test_rsi_all_gains_is_100():
+    got = replay(StreamingRSI(14), np.arange(1.0, 40.0))
+    assert got[-1] == 100.0 == indicators.compute_rsi(np.arange(1.0, 40.0))[-1]
+
+
+def test_macd_matches_batch():
+    _, _, x = ohlc(N, seed=3)
+    got = np.array(replay(StreamingMACD(12, 26, 9), x))
+    macd, signal = indicators.compute_macd(x, 12, 26, 9)
+    atol = 1e-12 * np.max(np.abs(x))
+    np.testing.assert_allclose(got[:, 0], macd, rtol=1e-9, atol=atol)
+    np.testing.assert_allclose(got[:, 1], signal, rtol=1e-9, atol=atol)
+
+
+@pytest.mark.parametrize("period", [2, 14])
+def test_atr_matches_wilder_batch(period):
+    high, low, close = ohlc(N, seed=period)
+    got = replay(StreamingATR(period), high, low, close)
+    np.testing.assert_allclose(got, indicators.atr_series(high, low, close, period), rtol=1e-12)
+    np.testing.assert_allclose(got, indicators.wilder(indicators.true_range(high, low, close), period), rtol=1e-12)
+
+
+def test_volatility_matches_batch_on_every_prefix():
+    _, _, x = ohlc(60, seed=4)
+    got = replay(StreamingVolatility(14), x)
+    want = [indicators.volatility_pct(x[:i + 1], 14) for i in range(len(x))]
+    np.testing.assert_allclose(got, want, rtol=1e-12)
+
+
+@pytest.mark.parametrize("make", [
+    lambda: StreamingEMA(12), lambda: StreamingMA(7), lambda: StreamingRSI(14),
+    lambda: StreamingMACD(), lambda: StreamingVolatility(14),
+])
+def test_replace_equals_replaying_the_final_value(make):
+    # 仍在形成中的 candle：先以暫定價格更新，再以 replace=True 改成收盤價
+    _, _, x = ohlc(200, seed=5)
+    plain, live = make(), make()
+    for v in x.tolist():
+        plain.update(v)
+        live.update(v + 123.0)
+        live.update(v - 45.0, replace=True)
+        live.update(v, replace=True)
+    assert live.count == plain.count == len(x)
+    np.testing.assert_allclose(np.ravel(live.value), np.ravel(plain.value), rtol=1e-12)
+
+
+def test_atr_replace_equals_replay():
+    high, low, close = ohlc(200, seed=6)
+    plain, live = StreamingATR(14), StreamingATR(14)
+    for h, l, c in zip(high.tolist(), low.tolist(), close.tolist()):
+        plain.update(h, l, c)
+        live.update(h + 10, l - 10, c + 5)
+        live.update(h, l, c, replace=True)
+    assert live.value == pytest.approx(plain.value, rel=1e-12)
+
+
+def candles(n, seed=0):
+    high, low, close = ohlc(n, seed)
+    ts = 1_700_000_000_000 + 3_600_000 * np.arange(n, dtype=np.int64)
+    return Candles(ts, close.copy(), high, low, close, np.ones(n))
+
+
+def test_indicator_set_snapshot_matches_engine():
+    c = candles(N, seed=7)
+    got = StreamingIndicatorSet.from_candles(c).snapshot()
+    want = indicators.IndicatorEngine(c).snapshot()
+    assert set(got) == set(want)
+    for key, value in want.items():
+        assert got[key] == pytest.approx(value, rel=1e-9, abs=1e-12 * 30000), key
+
+
+def test_indicator_set_applies_only_new_and_replaced_candles():
+    full = candles(N, seed=8)
+    # 先套用前 400 根，其中最後一根是仍在形成中的價格
+    live = Candles(full.ts[:400], full.open[:400], full.high[:400], full.low[:400],
+                   np.r_[full.close[:399], full.close[399] + 300.0], full.volume[:400])
+    streaming = StreamingIndicatorSet.from_candles(live)
+    # 之後餵入重疊的緩衝區：ts 相同的最後一根視為取代，其餘依序新增
+    assert streaming.apply(Candles(full.ts[350:], full.open[350:], full.high[350:], full.low[350:],
+                                   full.close[350:], full.volume[350:])) == N - 399
+    assert streaming.snapshot() == pytest.approx(StreamingIndicatorSet.from_candles(full).snapshot(), rel=1e-12)